@@ -0,0 +1,97 @@
+import argparse
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+import time
+from data_generation.tracks_generation import load_tracks_to_db
+from data_generation.bulk_loading import tuned_pragmas
+from data_generation.schema import create_schema
+from data_generation.change_tracking import suspend_change_tracking
+from data_generation.tier_aggregates import defer_tier_aggregates
+
+"""
+Compare the rows/sec of the DataFrame.to_sql loader against the plain sqlite3 bulk loader.
+
+The loads run with the change tracking and tier aggregate triggers deferred, as a load rewriting
+every table does in the ingest command, including the catch-up at the end. The cost of the
+triggers is reported on its own: the rows/sec of the bulk loader with the triggers firing per row.
+
+Run from the submission folder:
+    python -m benchmarks.bulk_load_benchmark --sizes 10000 100000 1000000
+"""
+
+# ----- Helper Functions -----
+
+# Build num_tracks synthetic track records in the track table format.
+def make_synthetic_tracks(num_tracks):
+    return [
+        {
+            "track_id": f"track{i:022d}",
+            "song_name": f"Song {i}",
+            "external_url": f"https://open.spotify.com/track/track{i:022d}",
+            "duration_ms": 120000 + i % 180000,
+            "explicit": i % 7 == 0,
+            "disc_number": 1 + i % 2,
+            "type": "track",
+            "song_uri": f"spotify:track:track{i:022d}",
+            "album_id": f"album{i // 12:022d}",
+        }
+        for i in range(num_tracks)
+    ]
+
+
+# Defer the triggers the way the ingest command does for a load rewriting every table, see
+# data_generation/command.py.
+@contextlib.contextmanager
+def deferred_triggers(db_conn):
+    with suspend_change_tracking(db_conn), defer_tier_aggregates(db_conn):
+        yield
+
+
+# Time loading tracks into a fresh DB file and return the rows/sec.
+# bulk: use the plain sqlite3 bulk loader instead of DataFrame.to_sql.
+# deferred: defer the triggers for the load, else they fire for every row.
+def time_load(tracks, bulk, deferred=True):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_conn = sqlite3.connect(os.path.join(temp_dir, "benchmark.db"))
+        create_schema(db_conn)
+
+        start = time.perf_counter()
+        # The loaders print a line per call, keep the benchmark output readable.
+        bulk_pragmas = tuned_pragmas(db_conn) if bulk else contextlib.nullcontext()
+        triggers = deferred_triggers(db_conn) if deferred else contextlib.nullcontext()
+        with contextlib.redirect_stdout(io.StringIO()), bulk_pragmas, triggers:
+            load_tracks_to_db(tracks, db_conn, bulk=bulk)
+        elapsed = time.perf_counter() - start
+
+        db_conn.close()
+    return len(tracks) / elapsed
+
+
+# ----- Helper Functions End -----
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the track loaders.")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    args = parser.parse_args()
+
+    print(f"{'tracks':>10} {'to_sql rows/s':>15} {'bulk rows/s':>15} {'speedup':>8}")
+    for num_tracks in args.sizes:
+        tracks = make_synthetic_tracks(num_tracks)
+        to_sql_rate = time_load(tracks, bulk=False)
+        bulk_rate = time_load(tracks, bulk=True)
+        triggers_rate = time_load(tracks, bulk=True, deferred=False)
+        print(
+            f"{num_tracks:>10} {to_sql_rate:>15,.0f} {bulk_rate:>15,.0f} "
+            f"{bulk_rate / to_sql_rate:>7.1f}x"
+        )
+        # The extra seconds the bulk load takes with the triggers firing per row.
+        trigger_cost = num_tracks / triggers_rate - num_tracks / bulk_rate
+        print(
+            f"{'':>10} trigger cost: {trigger_cost:.2f}s "
+            f"({triggers_rate:,.0f} bulk rows/s with the triggers firing per row)"
+        )
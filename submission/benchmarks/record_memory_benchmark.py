@@ -0,0 +1,106 @@
+import argparse
+import gc
+import tracemalloc
+from operator import attrgetter
+from fake_spotify.catalog import SyntheticCatalog
+from data_generation.artists_generation import transform_artist
+from data_generation.albums_generation import transform_album
+from data_generation.tracks_generation import transform_track
+from data_generation.track_features_generation import transform_track_features
+
+"""
+Compare the memory held by the in-flight records as dicts (one key string reference and
+one value per column, URLs and URIs included, as earlier versions built them) against the
+compact records of records.py, on the raw objects of a synthetic catalog.
+
+The memory is measured with tracemalloc after the raw objects are dropped, so it covers
+the records and every value they keep alive, as in the stage-by-stage and streaming paths.
+
+Run from the submission folder:
+    python -m benchmarks.record_memory_benchmark --num-tracks 100000
+The bytes per row don't depend on the catalog size, and tracing makes larger runs slow.
+"""
+
+# Per table: the record transform of a raw object and its extra argument.
+TRANSFORMS = {
+    "artist": lambda raw, _: transform_artist(raw),
+    "album": transform_album,
+    "track": transform_track,
+    "track_feature": lambda raw, _: transform_track_features(raw),
+}
+
+# ----- Helper Functions -----
+
+# Generate the raw API objects of a table, for a synthetic catalog with about num_tracks tracks.
+# Returns a list of (raw object, extra argument of its transform function).
+def generate_raw_objects(num_tracks, table_name):
+    # A catalog has about 40 tracks per artist.
+    catalog = SyntheticCatalog(max(num_tracks // 40, 1))
+    raw_objects = []
+
+    for artist_name in catalog.get_artist_names():
+        artist_id = catalog.get_artist_id(catalog.find_artist_index(artist_name))
+        if table_name == "artist":
+            raw_objects.append((catalog.get_artist(artist_id), None))
+            continue
+        for album_raw in catalog.get_artist_albums(artist_id):
+            if table_name == "album":
+                raw_objects.append((album_raw, artist_id))
+                continue
+            for track_raw in catalog.get_album_tracks(album_raw["id"]):
+                if table_name == "track":
+                    raw_objects.append((track_raw, album_raw["id"]))
+                    continue
+                features_raw = catalog.get_audio_features(track_raw["id"])
+                if features_raw is not None:
+                    raw_objects.append((features_raw, None))
+    return raw_objects
+
+
+# The record as a dict, with every column value built as a separate object the way a
+# dict built from freshly parsed JSON holds them.
+def to_dict(record):
+    return dict(zip(record.columns, attrgetter(*record.columns)(record)))
+
+
+# Bytes held by the records of a table built from raw objects, once the raw objects are
+# dropped. Tracing starts before the raw objects are generated, so the strings the records
+# share with them are counted too.
+# make_record: function building the measured record from a record of records.py.
+# Returns (number of records, bytes held).
+def measure_records(num_tracks, table_name, make_record):
+    transform = TRANSFORMS[table_name]
+    gc.collect()
+    tracemalloc.start()
+    raw_objects = generate_raw_objects(num_tracks, table_name)
+    records = [make_record(transform(raw, argument)) for raw, argument in raw_objects]
+    del raw_objects
+    gc.collect()
+    held_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return len(records), held_bytes
+
+
+# ----- Helper Functions End -----
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the record memory.")
+    parser.add_argument("--num-tracks", type=int, default=100_000)
+    args = parser.parse_args()
+
+    print(
+        f"{'table':<15} {'rows':>10} {'dict B/row':>12} {'compact B/row':>15} "
+        f"{'saved':>7} {'dict MB':>9} {'compact MB':>11}"
+    )
+    for table_name in TRANSFORMS:
+        num_rows, dict_bytes = measure_records(args.num_tracks, table_name, to_dict)
+        _, compact_bytes = measure_records(
+            args.num_tracks, table_name, lambda record: record
+        )
+
+        print(
+            f"{table_name:<15} {num_rows:>10} {dict_bytes / num_rows:>12,.0f} "
+            f"{compact_bytes / num_rows:>15,.0f} "
+            f"{1 - compact_bytes / dict_bytes:>7.0%} "
+            f"{dict_bytes / 1e6:>9,.1f} {compact_bytes / 1e6:>11,.1f}"
+        )
@@ -0,0 +1,403 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+from itertools import groupby
+from operator import itemgetter
+from datetime import datetime, timezone
+import matplotlib
+
+# Render off screen, the benchmark only times the plotting.
+matplotlib.use("Agg")
+
+from fake_spotify.catalog import SyntheticCatalog
+from data_generation.artists_generation import transform_artist, load_artists_to_db
+from data_generation.albums_generation import transform_album, load_albums_to_db
+from data_generation.tracks_generation import transform_track, load_tracks_to_db
+from data_generation.bulk_loading import tuned_pragmas
+from data_generation.columnar_transform import (
+    transform_artists_columnar,
+    transform_albums_columnar,
+    transform_tracks_columnar,
+    transform_track_features_columnar,
+)
+from data_generation.schema import create_schema
+from data_generation.track_features_generation import (
+    transform_track_features,
+    load_tracks_features_to_db,
+)
+from view_creation.top_artists_by_followers import create_top_artists_by_followers_view
+from view_creation.top_songs_by_artist_duration import (
+    create_top_songs_by_artist_duration_view,
+)
+from view_creation.top_songs_by_artist_tempo import (
+    create_top_songs_by_artist_tempo_view,
+)
+from view_creation.features_per_popularity_group import (
+    create_features_per_popularity_group_view,
+)
+from view_creation.artist_features_over_time import (
+    create_artist_features_over_time_view,
+)
+from view_creation.query_plan_check import VIEW_NAMES
+from data_visualization.plot_top_artists_by_followers import (
+    plot_top_artists_by_followers,
+)
+from data_visualization.plot_features_of_an_artist_over_time import (
+    plot_features_of_an_artist_over_time,
+)
+from data_visualization.plot_features_per_popularity_group import (
+    plot_features_per_popularity_group,
+)
+from data_visualization.plot_counts_per_popularity_group import (
+    plot_counts_per_popularity_group,
+)
+
+"""
+End-to-end benchmark of every stage after the API calls, on synthetic catalogs:
+transform -> load_*_to_db -> create_*_view -> SELECT * FROM v_* -> plot_*.
+
+Each step is timed separately and the results are written to a JSON file, which can be
+compared with the results of an earlier run to catch regressions.
+
+Run from the submission folder:
+    python -m benchmarks.run_benchmarks --sizes 1000 100000 1000000 --output results.json
+    python -m benchmarks.run_benchmarks --sizes 1000 100000 --compare results.json
+"""
+
+VIEW_CREATORS = [
+    create_top_artists_by_followers_view,
+    create_top_songs_by_artist_duration_view,
+    create_top_songs_by_artist_tempo_view,
+    create_features_per_popularity_group_view,
+    create_artist_features_over_time_view,
+]
+
+# The artist plotted over time is the first artist of the synthetic catalog.
+PLOTS = [
+    (plot_top_artists_by_followers, {}),
+    (plot_features_of_an_artist_over_time, {"artist_name": "Fake Artist 0"}),
+    (plot_features_per_popularity_group, {}),
+    (plot_counts_per_popularity_group, {}),
+]
+
+# Number of raw objects transformed per timed batch. Raw objects are only kept one batch
+# at a time, so the 1M tracks catalog fits in memory.
+TRANSFORM_BATCH_SIZE = 10_000
+
+# ----- Helper Functions -----
+
+# Run fn and record how long it took.
+# results: list collecting the results.
+# rows: number of rows the step processed, if meaningful.
+# Returns what fn returned.
+def time_step(results, num_tracks, stage, name, fn, rows=None):
+    # The functions print a line per call, keep the benchmark output readable.
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        value = fn()
+        elapsed = time.perf_counter() - start
+
+    results.append(
+        {
+            "num_tracks": num_tracks,
+            "stage": stage,
+            "name": name,
+            "seconds": elapsed,
+            "rows": rows,
+        }
+    )
+    print(f"{num_tracks:>10} {stage:>10} {name:<45} {elapsed:>10.3f}s")
+    return value
+
+
+# Generate the raw API objects of a synthetic catalog with num_tracks tracks, one batch of
+# raw objects at a time.
+# Yields (kind, batch) where batch lists (raw object, extra argument of its transform function).
+def generate_raw_batches(num_tracks):
+    # A catalog has about 40 tracks per artist, make it large enough and stop at num_tracks.
+    catalog = SyntheticCatalog(max(num_tracks // 20, 1))
+    batches = {"artist": [], "album": [], "track": [], "track_features": []}
+
+    num_generated = 0
+    for artist_name in catalog.get_artist_names():
+        if num_generated >= num_tracks:
+            break
+        artist_id = catalog.get_artist_id(catalog.find_artist_index(artist_name))
+        batches["artist"].append((catalog.get_artist(artist_id), None))
+
+        for album_raw in catalog.get_artist_albums(artist_id):
+            if num_generated >= num_tracks:
+                break
+            batches["album"].append((album_raw, artist_id))
+
+            for track_raw in catalog.get_album_tracks(album_raw["id"]):
+                if num_generated >= num_tracks:
+                    break
+                num_generated += 1
+                batches["track"].append((track_raw, album_raw["id"]))
+                features_raw = catalog.get_audio_features(track_raw["id"])
+                if features_raw is not None:
+                    batches["track_features"].append((features_raw, None))
+
+        for kind, batch in batches.items():
+            if len(batch) >= TRANSFORM_BATCH_SIZE:
+                yield kind, batch
+                batches[kind] = []
+
+    for kind, batch in batches.items():
+        if len(batch) > 0:
+            yield kind, batch
+
+
+# Group a batch of (raw object, owner ID) into pages of (owner ID, raw objects), the input of the
+# columnar transforms. The raw objects of an owner are generated one after the other.
+def group_pages(batch):
+    return [
+        (owner_id, [raw for raw, _ in page])
+        for owner_id, page in groupby(batch, key=itemgetter(1))
+    ]
+
+
+# Time the transform functions on the raw objects of the catalog: the record transforms the
+# streaming pipeline runs, and the columnar transforms the stage-by-stage pipeline runs.
+# Returns the transformed records per table.
+def benchmark_transforms(results, num_tracks):
+    transforms = {
+        "artist": ("transform_artist", lambda raw, _: transform_artist(raw)),
+        "album": ("transform_album", transform_album),
+        "track": ("transform_track", transform_track),
+        "track_features": (
+            "transform_track_features",
+            lambda raw, _: transform_track_features(raw),
+        ),
+    }
+    columnar_transforms = {
+        "artist": (
+            "transform_artists_columnar",
+            lambda batch: transform_artists_columnar([raw for raw, _ in batch]),
+        ),
+        "album": (
+            "transform_albums_columnar",
+            lambda batch: transform_albums_columnar(group_pages(batch)),
+        ),
+        "track": (
+            "transform_tracks_columnar",
+            lambda batch: transform_tracks_columnar(group_pages(batch)),
+        ),
+        "track_features": (
+            "transform_track_features_columnar",
+            lambda batch: transform_track_features_columnar([raw for raw, _ in batch]),
+        ),
+    }
+    records = {kind: [] for kind in transforms}
+    # Each record transform is reported next to the columnar transform of the same table.
+    names = [
+        name
+        for kind in transforms
+        for name in (transforms[kind][0], columnar_transforms[kind][0])
+    ]
+    seconds = {name: 0.0 for name in names}
+    rows = {name: 0 for name in seconds}
+
+    for kind, batch in generate_raw_batches(num_tracks):
+        name, transform = transforms[kind]
+        start = time.perf_counter()
+        records[kind].extend(transform(raw, argument) for raw, argument in batch)
+        seconds[name] += time.perf_counter() - start
+        rows[name] += len(batch)
+
+        # The frames are only timed, the loads below use the records.
+        name, transform_columnar = columnar_transforms[kind]
+        start = time.perf_counter()
+        frame = transform_columnar(batch)
+        seconds[name] += time.perf_counter() - start
+        rows[name] += len(frame)
+
+    for name in seconds:
+        results.append(
+            {
+                "num_tracks": num_tracks,
+                "stage": "transform",
+                "name": name,
+                "seconds": seconds[name],
+                "rows": rows[name],
+            }
+        )
+        print(f"{num_tracks:>10} {'transform':>10} {name:<45} {seconds[name]:>10.3f}s")
+    return records
+
+
+# Run every stage on one catalog size, in a fresh DB file.
+def benchmark_size(results, num_tracks, bulk):
+    records = benchmark_transforms(results, num_tracks)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_conn = sqlite3.connect(os.path.join(temp_dir, "benchmark.db"))
+        cur = db_conn.cursor()
+        create_schema(db_conn)
+
+        loaders = [
+            (load_artists_to_db, records["artist"]),
+            (load_albums_to_db, records["album"]),
+            (load_tracks_to_db, records["track"]),
+            (load_tracks_features_to_db, records["track_features"]),
+        ]
+        bulk_pragmas = tuned_pragmas(db_conn) if bulk else contextlib.nullcontext()
+        with bulk_pragmas:
+            for loader, table_records in loaders:
+                time_step(
+                    results,
+                    num_tracks,
+                    "load",
+                    loader.__name__,
+                    lambda: loader(table_records, db_conn, bulk=bulk),
+                    len(table_records),
+                )
+        del records, loaders
+
+        for create_view in VIEW_CREATORS:
+            time_step(
+                results,
+                num_tracks,
+                "view",
+                create_view.__name__,
+                lambda: create_view(cur),
+            )
+
+        for view_name in VIEW_NAMES:
+            num_rows = time_step(
+                results,
+                num_tracks,
+                "query",
+                f"SELECT * FROM {view_name}",
+                lambda: len(cur.execute(f"SELECT * FROM {view_name}").fetchall()),
+            )
+            results[-1]["rows"] = num_rows
+
+        for plot, kwargs in PLOTS:
+            time_step(
+                results,
+                num_tracks,
+                "plot",
+                plot.__name__,
+                lambda: plot(db_conn, **kwargs),
+            )
+
+        db_conn.close()
+
+
+# Keep the fastest of the repeated runs of each step, the least disturbed by noise.
+def keep_fastest_runs(results):
+    fastest = {}
+    for result in results:
+        key = (result["num_tracks"], result["stage"], result["name"])
+        if key not in fastest or result["seconds"] < fastest[key]["seconds"]:
+            fastest[key] = result
+    return list(fastest.values())
+
+
+# Compare the results with those of an earlier run.
+# Steps faster than min_seconds in the baseline are too noisy to compare and are ignored.
+# Returns the steps slower than the baseline by more than tolerance (0.2 = 20% slower).
+def find_regressions(results, baseline_results, tolerance, min_seconds):
+    baseline_seconds = {
+        (result["num_tracks"], result["stage"], result["name"]): result["seconds"]
+        for result in baseline_results
+    }
+
+    regressions = []
+    for result in results:
+        key = (result["num_tracks"], result["stage"], result["name"])
+        if key not in baseline_seconds or baseline_seconds[key] < min_seconds:
+            continue
+        ratio = result["seconds"] / baseline_seconds[key]
+        if ratio > 1 + tolerance:
+            regressions.append({**result, "baseline_seconds": baseline_seconds[key]})
+    return regressions
+
+
+# ----- Helper Functions End -----
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every stage end to end.")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1_000, 100_000, 1_000_000],
+        help="Number of tracks of each synthetic catalog.",
+    )
+    parser.add_argument(
+        "--output",
+        default="benchmark_results.json",
+        help="JSON file the results are written to.",
+    )
+    parser.add_argument(
+        "--bulk-load",
+        action="store_true",
+        help="Load with the plain sqlite3 bulk loader instead of DataFrame.to_sql.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Run each size this many times and keep the fastest time of each step.",
+    )
+    parser.add_argument(
+        "--compare", help="JSON file of an earlier run to check for regressions."
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="With --compare, how much slower a step may get (0.2 = 20%%).",
+    )
+    parser.add_argument(
+        "--min-seconds",
+        type=float,
+        default=0.05,
+        help="With --compare, ignore steps that took less than this in the earlier run.",
+    )
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'tracks':>10} {'stage':>10} {'step':<45} {'time':>11}")
+    for num_tracks in args.sizes:
+        for _ in range(args.repeat):
+            benchmark_size(results, num_tracks, args.bulk_load)
+    results = keep_fastest_runs(results)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "bulk_load": args.bulk_load,
+        "results": results,
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print("Results written to", args.output)
+
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            baseline_results = json.load(baseline_file)["results"]
+        regressions = find_regressions(
+            results, baseline_results, args.tolerance, args.min_seconds
+        )
+        for regression in regressions:
+            print(
+                f"REGRESSION {regression['num_tracks']} {regression['stage']} "
+                f"{regression['name']}: {regression['baseline_seconds']:.3f}s -> "
+                f"{regression['seconds']:.3f}s"
+            )
+        if len(regressions) > 0:
+            sys.exit(1)
+        print("No regressions against", args.compare)
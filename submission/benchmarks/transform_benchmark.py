@@ -0,0 +1,130 @@
+import argparse
+import time
+from itertools import chain
+from fake_spotify.catalog import SyntheticCatalog
+from data_generation.schema import TABLE_DTYPES
+from data_generation.records import records_to_frame
+from data_generation.artists_generation import transform_artist
+from data_generation.albums_generation import transform_album
+from data_generation.tracks_generation import transform_track
+from data_generation.track_features_generation import transform_track_features
+from data_generation.columnar_transform import (
+    transform_artists_columnar,
+    transform_albums_columnar,
+    transform_tracks_columnar,
+    transform_track_features_columnar,
+)
+
+"""
+Compare the per-record cost of the record transform (one record per raw object, then a
+DataFrame built from the records, as the loaders do) against the columnar transform, on
+the raw objects of a synthetic catalog.
+
+Run from the submission folder:
+    python -m benchmarks.transform_benchmark --num-tracks 1000000
+"""
+
+# Number of artists whose raw objects are held in memory at a time.
+ARTISTS_PER_BATCH = 500
+
+# Per table: the record transform of a page (owner ID, raw objects) and the columnar
+# transform of a list of pages. Artists and track features have no owner ID.
+TRANSFORMS = {
+    "artist": (
+        lambda page: [transform_artist(raw) for raw in page[1]],
+        lambda pages: transform_artists_columnar(
+            [raw for _, raws in pages for raw in raws]
+        ),
+    ),
+    "album": (
+        lambda page: [transform_album(raw, page[0]) for raw in page[1]],
+        transform_albums_columnar,
+    ),
+    "track": (
+        lambda page: [transform_track(raw, page[0]) for raw in page[1]],
+        transform_tracks_columnar,
+    ),
+    "track_feature": (
+        lambda page: [
+            transform_track_features(raw) for raw in page[1] if raw is not None
+        ],
+        lambda pages: transform_track_features_columnar(
+            [raw for _, raws in pages for raw in raws]
+        ),
+    ),
+}
+
+# ----- Helper Functions -----
+
+# Generate the raw API objects of a synthetic catalog with about num_tracks tracks, as pages
+# of (owner ID, raw objects) the way the stage-by-stage fetchers collect them.
+# Yields one dict of table -> pages per batch of artists.
+def generate_raw_pages(num_tracks):
+    # A catalog has about 40 tracks per artist.
+    catalog = SyntheticCatalog(max(num_tracks // 40, 1))
+    artist_names = catalog.get_artist_names()
+
+    for start in range(0, len(artist_names), ARTISTS_PER_BATCH):
+        pages = {table_name: [] for table_name in TRANSFORMS}
+        for artist_name in artist_names[start : start + ARTISTS_PER_BATCH]:
+            artist_id = catalog.get_artist_id(catalog.find_artist_index(artist_name))
+            pages["artist"].append((None, [catalog.get_artist(artist_id)]))
+
+            albums_raw = catalog.get_artist_albums(artist_id)
+            pages["album"].append((artist_id, albums_raw))
+            for album_raw in albums_raw:
+                tracks_raw = catalog.get_album_tracks(album_raw["id"])
+                pages["track"].append((album_raw["id"], tracks_raw))
+                pages["track_feature"].append(
+                    (
+                        None,
+                        [catalog.get_audio_features(t["id"]) for t in tracks_raw],
+                    )
+                )
+        yield pages
+
+
+# Transform pages one record at a time, then build the DataFrame the loaders write.
+def transform_records(transform_page, pages, table_name):
+    records = list(chain.from_iterable(transform_page(page) for page in pages))
+    return records_to_frame(records, TABLE_DTYPES[table_name])
+
+
+# ----- Helper Functions End -----
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the transforms.")
+    parser.add_argument("--num-tracks", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    seconds = {
+        table_name: {"record": 0.0, "columnar": 0.0} for table_name in TRANSFORMS
+    }
+    rows = {table_name: 0 for table_name in TRANSFORMS}
+
+    for pages in generate_raw_pages(args.num_tracks):
+        for table_name, (transform_page, transform_columnar) in TRANSFORMS.items():
+            start = time.perf_counter()
+            records_df = transform_records(
+                transform_page, pages[table_name], table_name
+            )
+            seconds[table_name]["record"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            columnar_df = transform_columnar(pages[table_name])
+            seconds[table_name]["columnar"] += time.perf_counter() - start
+
+            rows[table_name] += len(columnar_df)
+            assert len(records_df) == len(columnar_df)
+
+    print(
+        f"{'table':<15} {'rows':>10} {'record ns/row':>15} "
+        f"{'columnar ns/row':>17} {'speedup':>8}"
+    )
+    for table_name in TRANSFORMS:
+        record_ns = seconds[table_name]["record"] / rows[table_name] * 1e9
+        columnar_ns = seconds[table_name]["columnar"] / rows[table_name] * 1e9
+        print(
+            f"{table_name:<15} {rows[table_name]:>10} {record_ns:>15,.0f} "
+            f"{columnar_ns:>17,.0f} {record_ns / columnar_ns:>7.1f}x"
+        )
@@ -0,0 +1,167 @@
+import argparse
+import importlib
+import shlex
+from instrumentation.run_metrics import (
+    add_instrumentation_arguments,
+    metrics,
+    start_run_metrics,
+)
+
+"""
+Single entry point for the pipeline, with one subcommand per step:
+
+    python cli.py ingest [options]   same as data_generation.py
+    python cli.py views [options]    same as view_creation.py
+    python cli.py report [options]   same as data_visualization.py
+    python cli.py export [options]   same as data_export.py
+    python cli.py all [options]      the selected steps in order, on one DB
+
+Run `python cli.py <subcommand> --help` for the options of a step.
+
+Each step lives in a <package>.command module, imported only when its subcommand runs.
+The ingest, report and export steps import spotipy, pandas, matplotlib, seaborn and pyarrow
+in their run() function, so `views`, which only needs sqlite3, starts in a few tens of milliseconds.
+
+`all` runs each step with its default options. Use --db-path to point every step at the same
+file, --stages to pick the steps (ingest, views and report by default), and --ingest-options,
+--views-options, --report-options and --export-options to pass options to a step (with an "=", since the value starts with "--"), e.g.
+    python cli.py all --stages ingest views --ingest-options="--incremental" --views-options="--materialize"
+"""
+
+# Subcommand -> (module running it, script it replaces, help).
+# The script name also names the metrics report files, so both entry points write the same ones.
+STAGES = {
+    "ingest": (
+        "data_generation.command",
+        "data_generation",
+        "Pull, transform and load datasets.",
+    ),
+    "views": ("view_creation.command", "view_creation", "Create the views."),
+    "report": (
+        "data_visualization.command",
+        "data_visualization",
+        "Create the visualizations.",
+    ),
+    "export": (
+        "data_export.command",
+        "data_export",
+        "Export the tables and views to Parquet.",
+    ),
+}
+
+# Steps `all` runs when --stages isn't given.
+DEFAULT_STAGES = ["ingest", "views", "report"]
+
+# ----- Helper Functions -----
+
+# Build the argument parser of a step's options, without the instrumentation options.
+# command: the step's command module.
+def build_stage_parser(command, stage_name):
+    parser = argparse.ArgumentParser(prog=f"cli.py {stage_name}")
+    command.add_arguments(parser)
+    return parser
+
+
+# Parse the options of a step and check them.
+# options: the options, as a string split like a shell command line.
+def parse_stage_options(command, stage_name, options):
+    parser = build_stage_parser(command, stage_name)
+    stage_args = parser.parse_args(shlex.split(options))
+    if hasattr(command, "check_arguments"):
+        command.check_arguments(parser, stage_args)
+    return stage_args
+
+
+# Run the selected steps in order.
+# args: the parsed arguments of the `all` subcommand.
+def run_all(args):
+    db_path = args.db_path
+    for stage_name in STAGES:
+        if stage_name not in args.stages:
+            continue
+        command = importlib.import_module(STAGES[stage_name][0])
+        stage_args = parse_stage_options(
+            command, stage_name, getattr(args, f"{stage_name}_options")
+        )
+        if db_path is not None:
+            stage_args.db_path = db_path
+        elif hasattr(command, "get_db_path"):
+            # The later steps use the file the ingest step loaded into, e.g. fake_spotify.db.
+            db_path = stage_args.db_path = command.get_db_path(stage_args)
+
+        print(f"----- {stage_name} -----")
+        with metrics.stage(stage_name):
+            command.run(stage_args)
+
+
+# ----- Helper Functions End -----
+
+
+# Build the CLI's argument parser. The options of each step are added to its subcommand,
+# which imports its command module but none of the heavy libraries.
+# stage_name: the subcommand that will run, if known. Only its options are added, so the
+# command modules of the other steps aren't imported. None adds the options of every step.
+def build_parser(stage_name=None):
+    parser = argparse.ArgumentParser(description="Run the Spotify data pipeline.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name, (module_name, _, help_text) in STAGES.items():
+        subparser = subparsers.add_parser(name, help=help_text, description=help_text)
+        if stage_name in (None, name):
+            importlib.import_module(module_name).add_arguments(subparser)
+        add_instrumentation_arguments(subparser)
+
+    all_parser = subparsers.add_parser(
+        "all",
+        help="Run the selected steps in order.",
+        description="Run the selected steps in order, each with its default options "
+        "unless given with --<step>-options.",
+    )
+    all_parser.add_argument(
+        "--db-path",
+        help="SQLite file used by every step. Defaults to the file the ingest step loads into.",
+    )
+    all_parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=list(STAGES),
+        default=DEFAULT_STAGES,
+        help="Steps to run, ingest, views and report by default. They always run in the "
+        "order ingest, views, report, export.",
+    )
+    for name in STAGES:
+        all_parser.add_argument(
+            f"--{name}-options",
+            default="",
+            help=f"Options of the {name} step, as one quoted string.",
+        )
+    add_instrumentation_arguments(all_parser)
+    return parser
+
+
+# Parse the command line and run the chosen subcommand.
+# argv: the arguments, defaults to sys.argv[1:].
+def main(argv=None):
+    # Peek at the subcommand, so only its command module is imported to build the parser.
+    peek_parser = argparse.ArgumentParser(add_help=False)
+    peek_parser.add_argument("command", nargs="?")
+    peek_args, _ = peek_parser.parse_known_args(argv)
+
+    parser = build_parser(peek_args.command)
+    args = parser.parse_args(argv)
+
+    if args.command == "all":
+        start_run_metrics("all", args)
+        run_all(args)
+        return
+
+    module_name, script, _ = STAGES[args.command]
+    command = importlib.import_module(module_name)
+    if hasattr(command, "check_arguments"):
+        command.check_arguments(parser, args)
+    start_run_metrics(script, args)
+    command.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import argparse
+from data_export.command import add_arguments, run
+from instrumentation.run_metrics import (
+    add_instrumentation_arguments,
+    start_run_metrics,
+)
+
+"""
+Run this file to export the tables and views to Parquet, for notebooks and other tools
+reading columnar files.
+
+Every base table and v_* view is written to its own folder under parquet_export/ (see
+--export-dir), streamed from the DB in chunks of --chunk-rows rows. With --partition-by
+(release_year by default, or artist), each folder is split into one subfolder per partition,
+so readers can skip the partitions they don't need. Rerunning it after a load only writes
+the partitions of the artists touched by that load again.
+
+The time spent and the time per SQLite statement are written to metrics/ (see --metrics-dir).
+"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the tables and views to Parquet."
+    )
+    add_arguments(parser)
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    start_run_metrics("data_export", args)
+    run(args)
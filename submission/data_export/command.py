@@ -0,0 +1,89 @@
+from instrumentation.run_metrics import metrics
+from instrumentation.sqlite_timing import connect_timed
+
+"""
+The export command, run by data_export.py and by `cli.py export`.
+
+The export module imports pyarrow, which takes a fraction of a second to load. It is
+imported by run() rather than at the top of this module, so building the CLI's argument
+parser, or running another subcommand, doesn't load it.
+"""
+
+# Choices of --partition-by, see parquet_export.PARTITION_COLUMNS.
+PARTITION_CHOICES = ["none", "artist", "release_year"]
+
+
+# Add the export options to an argument parser.
+def add_arguments(parser):
+    parser.add_argument(
+        "--db-path",
+        default="spotify.db",
+        help="SQLite file to export the tables and views of.",
+    )
+    parser.add_argument(
+        "--export-dir",
+        default="parquet_export",
+        help="Folder to write the Parquet files into, one subfolder per table or view.",
+    )
+    parser.add_argument(
+        "--partition-by",
+        choices=PARTITION_CHOICES,
+        default="release_year",
+        help="Split the tables and views into one folder per artist or per release year. "
+        "Only the partitions of changed artists are written again on the next export.",
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=100000,
+        help="Number of rows read from the DB and written per Parquet row group.",
+    )
+    parser.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help="Export every table and view from scratch.",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="After exporting, check that every partition holds exactly the rows an export "
+        "from scratch would write. Reads every table and view again.",
+    )
+
+
+# Export the tables and views to Parquet.
+# args: the parsed arguments, see add_arguments.
+def run(args):
+    from data_generation.schema import create_schema
+    from data_export.parquet_export import export_to_parquet, verify_export
+
+    db_conn = connect_timed(args.db_path)
+
+    # Migrates databases created without the change tracking tables the export relies on.
+    with metrics.stage("create_schema"):
+        create_schema(db_conn)
+
+    with metrics.stage("export_to_parquet"):
+        num_partitions = export_to_parquet(
+            db_conn,
+            args.export_dir,
+            partition_by=None if args.partition_by == "none" else args.partition_by,
+            chunk_rows=args.chunk_rows,
+            full=args.full_refresh,
+        )
+    for name, num_written in num_partitions.items():
+        if num_written is None:
+            print(f"Exported {name} from scratch")
+        else:
+            print(f"Exported {num_written} changed partitions of {name}")
+    print(f"Wrote the Parquet files to {args.export_dir}")
+
+    if args.verify:
+        with metrics.stage("verify_export"):
+            mismatches = verify_export(db_conn, args.export_dir, args.chunk_rows)
+        if len(mismatches) > 0:
+            details = "\n".join(f"  {mismatch}" for mismatch in mismatches)
+            raise RuntimeError(
+                f"Export differs from an export from scratch:\n{details}"
+            )
+        print("Verified the export against the DB")
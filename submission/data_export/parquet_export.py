@@ -0,0 +1,694 @@
+import hashlib
+import itertools
+import json
+import os
+import shutil
+from urllib.parse import quote
+import pyarrow as pa
+import pyarrow.parquet as pq
+from data_generation.change_tracking import (
+    get_changed_artist_ids,
+    has_changes_without_artist,
+    mark_changes_consumed,
+)
+from view_creation.materialized_views import MATERIALIZED_VIEWS
+
+# High level overview:
+#
+# 1) Every base table (artist, album, track, track_feature) and every v_* view is a dataset, exported to its own folder
+#    of Parquet files under the export folder. The rows are streamed from SQLite in chunks of chunk_rows rows, each
+#    written as a row group, so memory stays bounded whatever the size of the table.
+# 2) With partition_by, a dataset is split Hive style into one folder per partition value, e.g.
+#    track_feature/release_year=2015/part-0.parquet, and the partition column is read back from the folder names.
+#    Tracks and track features get the artist_id and release_year of their album as partition columns. The views are
+#    partitioned by artist_name or year when they have that column and their rows are computed per artist (see
+#    materialized_views.py). Other datasets aren't partitioned.
+# 3) manifest.json lists the datasets with their columns and SQLite types, their partitions and their row counts, and
+#    for each artist the partitions holding its rows.
+# 4) On the next export, only the partitions of the artists stamped by the change tracking triggers since the last
+#    export are written again: the partitions the artists are in now, plus the ones the manifest recorded for them.
+#    Partitions left without rows are removed. An unpartitioned dataset is written again whole if any artist changed.
+#    The tables' rows belonging to no artist (e.g. track features of a deleted track) are in the NULL partition,
+#    written again whenever the change tracking triggers stamped such rows.
+# 5) A dataset is exported from scratch on the first export, when its table or view changed shape, or when the
+#    partitioning changed. Each export folder keeps its own change tracking consumer, so two folders can be exported
+#    from the same DB.
+# 6) Files are written under a temporary name and renamed once complete, the manifest last.
+# 7) verify_export checks that every partition holds exactly the rows an export from scratch would write.
+
+# Tables exported, with the SQL finding the album of their rows.
+# from: the FROM clause, the table's own alias first. {join} is LEFT JOIN, or INNER JOIN when
+# only rows with an album are read, which lets SQLite start from the album.
+# alias: alias of the table's own columns.
+# album_alias: alias of the album the rows belong to.
+EXPORTED_TABLES = {
+    "artist": {
+        "from": "artist AS a",
+        "alias": "a",
+        "album_alias": None,
+    },
+    "album": {
+        "from": "album AS al",
+        "alias": "al",
+        "album_alias": "al",
+    },
+    "track": {
+        "from": "track AS t {join} album AS al ON (t.album_id = al.album_id)",
+        "alias": "t",
+        "album_alias": "al",
+    },
+    "track_feature": {
+        "from": """track_feature AS tf
+            {join} track AS t ON (tf.track_id = t.track_id)
+            {join} album AS al ON (t.album_id = al.album_id)""",
+        "alias": "tf",
+        "album_alias": "al",
+    },
+}
+
+# partition_by choice -> the partition column of the tables, and of the views.
+PARTITION_COLUMNS = {
+    "artist": {"table": "artist_id", "view": "artist_name"},
+    "release_year": {"table": "release_year", "view": "year"},
+}
+
+# partition_by choice -> the partition value of every artist's rows, as (artist_id, value) rows.
+# None when the value is the artist ID itself.
+PARTITION_OWNERS = {
+    "artist": {
+        "table": None,
+        "view": "SELECT artist_id, artist_name AS value FROM artist",
+    },
+    "release_year": {
+        "table": "SELECT artist_id, release_year AS value FROM album",
+        "view": "SELECT artist_id, release_year AS value FROM album",
+    },
+}
+
+# SQLite type -> Arrow type of the exported columns.
+ARROW_TYPES = {
+    "INTEGER": pa.int64(),
+    "REAL": pa.float64(),
+    "TEXT": pa.string(),
+    "BLOB": pa.binary(),
+}
+
+# Default folder of the export.
+DEFAULT_EXPORT_DIR = "parquet_export"
+
+# Rows read from the DB and written per row group.
+DEFAULT_CHUNK_ROWS = 100000
+
+# Partition values to write again during an incremental export.
+EXPORT_PARTITION_VALUES = "SELECT value FROM temp.export_partition"
+
+# Folder name of the NULL partition, the one pyarrow reads back as NULL.
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+MANIFEST_FILE = "manifest.json"
+
+PART_FILE = "part-0.parquet"
+
+# ----- Helper Functions -----
+
+
+# Change tracking consumer of an export folder.
+def get_change_consumer(export_dir):
+    return f"parquet_export:{os.path.abspath(export_dir)}"
+
+
+def read_manifest(export_dir):
+    path = os.path.join(export_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(export_dir, manifest):
+    path = os.path.join(export_dir, MANIFEST_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+# SQLite type of a column without a declared type (view columns computed by an expression, or
+# NUMERIC columns), from the types of its values: TEXT if any value is text, else REAL if any value
+# is real, else INTEGER if any value is an integer. Columns of NULLs are TEXT.
+def get_value_types(cur, source, columns):
+    if len(columns) == 0:
+        return {}
+    checks = [
+        f"MAX(typeof({column}) = '{value_type}')"
+        for column in columns
+        for value_type in ["text", "blob", "real", "integer"]
+    ]
+    row = cur.execute(f"SELECT {', '.join(checks)} FROM {source}").fetchone()
+
+    types = {}
+    for i, column in enumerate(columns):
+        has_text, has_blob, has_real, has_integer = row[4 * i : 4 * i + 4]
+        if has_text or not (has_blob or has_real or has_integer):
+            types[column] = "TEXT"
+        elif has_blob:
+            types[column] = "BLOB"
+        else:
+            types[column] = "REAL" if has_real else "INTEGER"
+    return types
+
+
+# Columns of a table or view with their declared SQLite types, as [name, type] pairs.
+def get_declared_columns(cur, name):
+    return [
+        [row[1], row[2].upper()] for row in cur.execute(f"PRAGMA table_info({name})")
+    ]
+
+
+# Columns of a dataset with the SQLite type of every column, the declared one or else the one of
+# its values.
+def resolve_column_types(cur, dataset):
+    declared = dataset["declared_columns"]
+    value_types = get_value_types(
+        cur,
+        f"{dataset['name']} AS x",
+        [
+            f'x."{column}"'
+            for column, sqlite_type in declared
+            if sqlite_type not in ARROW_TYPES
+        ],
+    )
+    return [
+        [
+            column,
+            sqlite_type if sqlite_type in ARROW_TYPES else value_types[f'x."{column}"'],
+        ]
+        for column, sqlite_type in declared
+    ]
+
+
+# SELECT list of the exported columns, cast to their type so every value fits the Arrow schema.
+def build_select_list(columns, alias):
+    return ", ".join(
+        f'CAST({alias}."{column}" AS {sqlite_type}) AS "{column}"'
+        for column, sqlite_type in columns
+    )
+
+
+# Columns stored in the files of a dataset. The partition column is read back from the folder
+# names, so it isn't stored in the files too.
+def get_file_columns(columns, partition_column):
+    return [column for column in columns if column[0] != partition_column]
+
+
+# SQL condition keeping the rows whose partition value is to be written again.
+# include_null: whether the NULL partition is one of them.
+def build_partition_condition(expression, include_null):
+    condition = f"{expression} IN ({EXPORT_PARTITION_VALUES})"
+    return f"({condition} OR {expression} IS NULL)" if include_null else condition
+
+
+# Describe how to export a base table.
+# Returns a dataset: its name, declared columns, partition column, partition owners SQL,
+# fingerprint and build_query(columns, include_null), which builds the SELECT of its rows (followed
+# by the partition value, and ordered by it, when partitioned). include_null=None selects every
+# row, else the rows of the partitions in temp.export_partition, and of the NULL one if True.
+def get_table_dataset(cur, table_name, partition_by):
+    spec = EXPORTED_TABLES[table_name]
+    alias = spec["alias"]
+
+    partition_column = None
+    owners = None
+    expression = None
+    if partition_by == "artist":
+        partition_column = PARTITION_COLUMNS[partition_by]["table"]
+        owners = PARTITION_OWNERS[partition_by]["table"]
+        expression = f"{spec['album_alias'] or alias}.artist_id"
+    elif partition_by == "release_year" and spec["album_alias"] is not None:
+        partition_column = PARTITION_COLUMNS[partition_by]["table"]
+        owners = PARTITION_OWNERS[partition_by]["table"]
+        expression = f"{spec['album_alias']}.release_year"
+
+    def build_query(columns, include_null=None):
+        select_list = build_select_list(
+            get_file_columns(columns, partition_column), alias
+        )
+        # Rows without an album are in the NULL partition.
+        join = "INNER JOIN" if include_null is False else "LEFT JOIN"
+        from_clause = spec["from"].format(join=join)
+        if partition_column is None:
+            return f"SELECT {select_list} FROM {from_clause}"
+        where = (
+            f"WHERE {build_partition_condition(expression, include_null)}"
+            if include_null is not None
+            else ""
+        )
+        return f"""
+            SELECT {select_list}, {expression}
+            FROM {from_clause}
+            {where}
+            ORDER BY {expression}
+        """
+
+    return build_dataset(
+        cur,
+        table_name,
+        partition_column,
+        owners,
+        build_query,
+        has_rows_without_artist=True,
+    )
+
+
+# Describe how to export a view. See get_table_dataset.
+def get_view_dataset(cur, view_name, partition_by):
+    declared_columns = get_declared_columns(cur, view_name)
+    build_view_query = MATERIALIZED_VIEWS.get(view_name, {}).get("build_query")
+
+    partition_column = None
+    owners = None
+    if partition_by is not None and build_view_query is not None:
+        column = PARTITION_COLUMNS[partition_by]["view"]
+        if column in [name for name, _ in declared_columns]:
+            partition_column = column
+            owners = PARTITION_OWNERS[partition_by]["view"]
+
+    def build_query(columns, include_null=None):
+        select_list = build_select_list(
+            get_file_columns(columns, partition_column), "v"
+        )
+        if partition_column is None:
+            return f"SELECT {select_list} FROM {view_name} AS v"
+        if include_null is None:
+            return f"""
+                SELECT {select_list}, v.{partition_column}
+                FROM {view_name} AS v
+                ORDER BY v.{partition_column}
+            """
+        # Only the artists owning the partitions are computed, then the view's rows are kept
+        # to the partitions.
+        artist_ids = f"""
+            SELECT artist_id FROM ({owners})
+            WHERE {build_partition_condition("value", include_null)}
+        """
+        return f"""
+            SELECT {select_list}, v.{partition_column}
+            FROM ({build_view_query(artist_ids)}) AS v
+            WHERE {build_partition_condition(f"v.{partition_column}", include_null)}
+            ORDER BY v.{partition_column}
+        """
+
+    return build_dataset(cur, view_name, partition_column, owners, build_query)
+
+
+# The fingerprint covers the SQL of the table or view and of the export query. A different
+# fingerprint means the exported files are stale.
+# has_rows_without_artist: whether rows belonging to no artist can be in the NULL partition.
+def build_dataset(
+    cur, name, partition_column, owners, build_query, has_rows_without_artist=False
+):
+    declared_columns = get_declared_columns(cur, name)
+    schema_sql = cur.execute(
+        "SELECT sql FROM sqlite_master WHERE name = ?", (name,)
+    ).fetchone()[0]
+    fingerprint = hashlib.sha256(
+        json.dumps([schema_sql, build_query(declared_columns)]).encode()
+    ).hexdigest()
+    return {
+        "name": name,
+        "declared_columns": declared_columns,
+        "partition_column": partition_column,
+        "owners": owners,
+        "fingerprint": fingerprint,
+        "build_query": build_query,
+        "has_rows_without_artist": has_rows_without_artist,
+    }
+
+
+# The datasets exported from the DB: the base tables, then every v_* view.
+def get_datasets(cur, partition_by):
+    view_names = [
+        row[0]
+        for row in cur.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'view' AND name LIKE 'v\\_%' ESCAPE '\\' ORDER BY name"
+        )
+    ]
+    return [
+        get_table_dataset(cur, table_name, partition_by)
+        for table_name in EXPORTED_TABLES
+    ] + [get_view_dataset(cur, view_name, partition_by) for view_name in view_names]
+
+
+# Path of a partition's file, relative to its dataset folder.
+def get_partition_path(partition_column, value):
+    if partition_column is None:
+        return PART_FILE
+    segment = NULL_PARTITION if value is None else quote(str(value), safe="")
+    return os.path.join(f"{partition_column}={segment}", PART_FILE)
+
+
+# Partition values of some artists' rows, as artist_id -> list of values.
+# artist_ids: a subquery returning the artist IDs, or None for every artist.
+def get_artist_partitions(cur, owners, artist_ids=None):
+    where = f"WHERE artist_id IN ({artist_ids})" if artist_ids is not None else ""
+    artist_partitions = {}
+    for artist_id, value in cur.execute(
+        f"SELECT DISTINCT artist_id, value FROM ({owners}) {where}"
+    ):
+        artist_partitions.setdefault(artist_id, []).append(value)
+    return artist_partitions
+
+
+# Stream the rows of a query into the dataset folder, one file per partition.
+# The rows come ordered by their partition value, the last column, when partitioned.
+# Returns partition value -> number of rows written, for the partitions having rows.
+def write_partition_files(cur, query, dataset, columns, dataset_dir, chunk_rows):
+    partition_column = dataset["partition_column"]
+    columns = get_file_columns(columns, partition_column)
+    schema = pa.schema(
+        [(column, ARROW_TYPES[sqlite_type]) for column, sqlite_type in columns]
+    )
+    num_columns = len(columns)
+
+    num_rows = {}
+    writer = None
+    path = None
+    buffer = []
+
+    def flush():
+        if len(buffer) > 0:
+            arrays = [
+                pa.array(values, type=field.type)
+                for values, field in zip(zip(*buffer), schema)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            buffer.clear()
+
+    def close():
+        if writer is not None:
+            flush()
+            writer.close()
+            os.replace(path + ".tmp", path)
+
+    cur.execute(query)
+    while True:
+        rows = cur.fetchmany(chunk_rows)
+        if len(rows) == 0:
+            break
+        groups = (
+            itertools.groupby(rows, key=lambda row: row[num_columns])
+            if partition_column is not None
+            else [(None, rows)]
+        )
+        for value, group in groups:
+            if writer is None or value not in num_rows:
+                close()
+                path = os.path.join(
+                    dataset_dir, get_partition_path(partition_column, value)
+                )
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                writer = pq.ParquetWriter(path + ".tmp", schema)
+                num_rows[value] = 0
+            for row in group:
+                buffer.append(row[:num_columns])
+                num_rows[value] += 1
+                if len(buffer) >= chunk_rows:
+                    flush()
+    close()
+
+    # An unpartitioned dataset always has its file, even without rows.
+    if partition_column is None and len(num_rows) == 0:
+        pq.write_table(schema.empty_table(), os.path.join(dataset_dir, PART_FILE))
+        num_rows[None] = 0
+    return num_rows
+
+
+def build_partition_entries(dataset, num_rows):
+    return [
+        {
+            "value": value,
+            "path": get_partition_path(dataset["partition_column"], value),
+            "num_rows": count,
+        }
+        for value, count in num_rows.items()
+    ]
+
+
+# Export a dataset from scratch into a new folder, then swap it with the previous one.
+# Returns the dataset's manifest entry.
+def export_dataset(cur, dataset, export_dir, chunk_rows):
+    dataset_dir = os.path.join(export_dir, dataset["name"])
+    shutil.rmtree(dataset_dir + ".tmp", ignore_errors=True)
+    os.makedirs(dataset_dir + ".tmp")
+    columns = resolve_column_types(cur, dataset)
+    num_rows = write_partition_files(
+        cur,
+        dataset["build_query"](columns),
+        dataset,
+        columns,
+        dataset_dir + ".tmp",
+        chunk_rows,
+    )
+    shutil.rmtree(dataset_dir, ignore_errors=True)
+    os.replace(dataset_dir + ".tmp", dataset_dir)
+
+    entry = {
+        "fingerprint": dataset["fingerprint"],
+        "columns": columns,
+        "partition_column": dataset["partition_column"],
+        "partitions": build_partition_entries(dataset, num_rows),
+    }
+    if dataset["owners"] is not None:
+        entry["artist_partitions"] = get_artist_partitions(cur, dataset["owners"])
+    return entry
+
+
+# Write again the partitions of a dataset holding rows of the changed artists, listed in
+# temp.export_artist. The columns and their types are the ones of the previous export.
+# changed_without_artist: whether rows belonging to no artist changed, so the NULL partition of
+# the tables is written again too.
+# Updates the dataset's manifest entry, and returns the number of partitions written again.
+def export_changed_partitions(
+    cur, dataset, entry, export_dir, chunk_rows, changed_without_artist
+):
+    dataset_dir = os.path.join(export_dir, dataset["name"])
+    changed_artist_ids = [
+        row[0] for row in cur.execute("SELECT artist_id FROM temp.export_artist")
+    ]
+
+    if dataset["owners"] is None:
+        values = set(changed_artist_ids)
+    else:
+        artist_partitions = entry["artist_partitions"]
+        current = get_artist_partitions(
+            cur, dataset["owners"], "SELECT artist_id FROM temp.export_artist"
+        )
+        values = set()
+        for artist_id in changed_artist_ids:
+            values.update(artist_partitions.pop(artist_id, []))
+            values.update(current.get(artist_id, []))
+        artist_partitions.update(current)
+    if changed_without_artist and dataset["has_rows_without_artist"]:
+        values.add(None)
+
+    include_null = None in values
+    cur.execute("DELETE FROM temp.export_partition")
+    cur.executemany(
+        "INSERT INTO temp.export_partition VALUES (?)",
+        [(value,) for value in values if value is not None],
+    )
+    num_rows = write_partition_files(
+        cur,
+        dataset["build_query"](entry["columns"], include_null),
+        dataset,
+        entry["columns"],
+        dataset_dir,
+        chunk_rows,
+    )
+
+    # Partitions left without rows are removed.
+    partitions = []
+    for partition in entry["partitions"]:
+        if partition["value"] not in values:
+            partitions.append(partition)
+        elif partition["value"] not in num_rows:
+            shutil.rmtree(
+                os.path.dirname(os.path.join(dataset_dir, partition["path"])),
+                ignore_errors=True,
+            )
+    partitions.extend(build_partition_entries(dataset, num_rows))
+    entry["partitions"] = sorted(partitions, key=lambda partition: partition["path"])
+    return len(values)
+
+
+# Order independent digest of rows: their number and the sum of their hashes.
+def add_to_digest(digest, rows):
+    count, total = digest
+    for row in rows:
+        count += 1
+        total = (total + hash(row)) & 0xFFFFFFFFFFFFFFFF
+    return count, total
+
+
+# Digest of every partition of a dataset as an export from scratch would write it, read from the
+# DB in chunks. Returns partition path -> digest.
+def get_expected_digests(cur, dataset, columns, chunk_rows):
+    partition_column = dataset["partition_column"]
+    num_columns = len(get_file_columns(columns, partition_column))
+    digests = {}
+    cur.execute(dataset["build_query"](columns))
+    while True:
+        rows = cur.fetchmany(chunk_rows)
+        if len(rows) == 0:
+            break
+        groups = (
+            itertools.groupby(rows, key=lambda row: row[num_columns])
+            if partition_column is not None
+            else [(None, rows)]
+        )
+        for value, group in groups:
+            path = get_partition_path(partition_column, value)
+            digests[path] = add_to_digest(
+                digests.get(path, (0, 0)), (row[:num_columns] for row in group)
+            )
+    return digests
+
+
+# Digest of every Parquet file in a dataset folder, read batch by batch.
+# Returns partition path -> digest.
+def get_exported_digests(dataset_dir):
+    digests = {}
+    for folder, _, file_names in os.walk(dataset_dir):
+        for file_name in file_names:
+            if not file_name.endswith(".parquet"):
+                continue
+            path = os.path.join(folder, file_name)
+            digest = (0, 0)
+            for batch in pq.ParquetFile(path).iter_batches():
+                digest = add_to_digest(
+                    digest, zip(*(column.to_pylist() for column in batch.columns))
+                )
+            digests[os.path.relpath(path, dataset_dir)] = digest
+    return digests
+
+
+# ----- Helper Functions End -----
+
+
+# Export the base tables and the v_* views to Parquet, or bring a previous export up to date.
+# Only the partitions holding rows of the artists changed since the previous export of the folder
+# are written again. A dataset is exported from scratch when the folder has no export of it yet,
+# when its table or view changed, when partition_by changed, or when full is True.
+# db_conn: a database connection.
+# export_dir: the export folder.
+# partition_by: None, "artist" or "release_year".
+# chunk_rows: rows read from the DB and written per row group.
+# full: export every dataset from scratch.
+# Returns dataset name -> number of partitions written, or None when exported from scratch.
+def export_to_parquet(
+    db_conn,
+    export_dir=DEFAULT_EXPORT_DIR,
+    partition_by=None,
+    chunk_rows=DEFAULT_CHUNK_ROWS,
+    full=False,
+):
+    cur = db_conn.cursor()
+    consumer = get_change_consumer(export_dir)
+    changed_artist_ids = get_changed_artist_ids(db_conn, consumer)
+    changed_without_artist = has_changes_without_artist(db_conn, consumer)
+    manifest = read_manifest(export_dir)
+    database = db_conn.execute("PRAGMA database_list").fetchone()[2]
+    if (
+        full
+        or changed_artist_ids is None
+        or manifest is None
+        or manifest["database"] != database
+        or manifest["partition_by"] != partition_by
+    ):
+        manifest = {"database": database, "partition_by": partition_by, "datasets": {}}
+
+    os.makedirs(export_dir, exist_ok=True)
+    cur.execute("DROP TABLE IF EXISTS temp.export_artist")
+    cur.execute("CREATE TEMP TABLE export_artist (artist_id TEXT PRIMARY KEY)")
+    cur.executemany(
+        "INSERT INTO temp.export_artist VALUES (?)",
+        [(artist_id,) for artist_id in changed_artist_ids or []],
+    )
+    cur.execute("DROP TABLE IF EXISTS temp.export_partition")
+    cur.execute("CREATE TEMP TABLE export_partition (value PRIMARY KEY)")
+
+    datasets = get_datasets(cur, partition_by)
+    num_partitions = {}
+    for dataset in datasets:
+        entry = manifest["datasets"].get(dataset["name"])
+        if entry is None or entry["fingerprint"] != dataset["fingerprint"]:
+            manifest["datasets"][dataset["name"]] = export_dataset(
+                cur, dataset, export_dir, chunk_rows
+            )
+            num_partitions[dataset["name"]] = None
+        elif len(changed_artist_ids) == 0 and not changed_without_artist:
+            num_partitions[dataset["name"]] = 0
+        elif dataset["partition_column"] is None:
+            manifest["datasets"][dataset["name"]] = export_dataset(
+                cur, dataset, export_dir, chunk_rows
+            )
+            num_partitions[dataset["name"]] = 1
+        else:
+            num_partitions[dataset["name"]] = export_changed_partitions(
+                cur, dataset, entry, export_dir, chunk_rows, changed_without_artist
+            )
+
+    # Datasets gone from the DB, e.g. a dropped view, go too.
+    names = [dataset["name"] for dataset in datasets]
+    for name in list(manifest["datasets"]):
+        if name not in names:
+            shutil.rmtree(os.path.join(export_dir, name), ignore_errors=True)
+            del manifest["datasets"][name]
+
+    write_manifest(export_dir, manifest)
+    with db_conn:
+        mark_changes_consumed(db_conn, consumer)
+    return num_partitions
+
+
+# Check that an export folder holds exactly the rows an export from scratch would write: the same
+# partitions, each with the same rows, and nothing else. Reads every table and view again.
+# db_conn: a database connection.
+# export_dir: the export folder.
+# chunk_rows: rows read from the DB at once.
+# Returns a list of the mismatches, empty when the export is up to date.
+def verify_export(
+    db_conn, export_dir=DEFAULT_EXPORT_DIR, chunk_rows=DEFAULT_CHUNK_ROWS
+):
+    manifest = read_manifest(export_dir)
+    if manifest is None:
+        return [f"No export in {export_dir!r}"]
+
+    cur = db_conn.cursor()
+    mismatches = []
+    datasets = get_datasets(cur, manifest["partition_by"])
+    for dataset in datasets:
+        entry = manifest["datasets"].get(dataset["name"])
+        if entry is None:
+            mismatches.append(f"{dataset['name']}: not exported")
+            continue
+        expected = get_expected_digests(cur, dataset, entry["columns"], chunk_rows)
+        exported = get_exported_digests(os.path.join(export_dir, dataset["name"]))
+        # An unpartitioned dataset without rows still has its file.
+        if dataset["partition_column"] is None and PART_FILE not in expected:
+            expected[PART_FILE] = (0, 0)
+        for path in sorted(set(expected) | set(exported)):
+            if path not in exported:
+                mismatches.append(f"{dataset['name']}/{path}: missing")
+            elif path not in expected:
+                mismatches.append(f"{dataset['name']}/{path}: stale")
+            elif exported[path] != expected[path]:
+                mismatches.append(
+                    f"{dataset['name']}/{path}: {exported[path][0]} rows exported, "
+                    f"{expected[path][0]} expected, or different values"
+                )
+        manifest_paths = {partition["path"] for partition in entry["partitions"]}
+        if manifest_paths != set(exported):
+            mismatches.append(
+                f"{dataset['name']}: manifest partitions differ from files"
+            )
+    return mismatches
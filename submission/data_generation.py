@@ -1,19 +1,8 @@
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-import sqlite3
-from seeds import seeds
-from data_generation.artists_generation import fetch_artists, load_artists_to_db
-from data_generation.albums_generation import (
-    fetch_albums_for_all_artists,
-    load_albums_to_db,
-)
-from data_generation.tracks_generation import (
-    fetch_tracks_for_all_albums,
-    load_tracks_to_db,
-)
-from data_generation.track_features_generation import (
-    fetch_features_for_all_tracks,
-    load_tracks_features_to_db,
+import argparse
+from data_generation.command import add_arguments, check_arguments, run
+from instrumentation.run_metrics import (
+    add_instrumentation_arguments,
+    start_run_metrics,
 )
 
 """
@@ -23,36 +12,50 @@ from data_generation.track_features_generation import (
         SPOTIPY_CLIENT_ID
         SPOTIPY_CLIENT_SECRET
         SPOTIPY_REDIRECT_URI
-"""
 
-if __name__ == "__main__":
-    # ----- Step 1: Create the datasets -----
-    spotify = spotipy.Spotify(auth_manager=SpotifyClientCredentials())
+    Use --max-workers to fetch from the Spotify API concurrently, e.g.
+        python data_generation.py --max-workers 8
+
+    By default the stages run as a streaming pipeline that writes rows to the DB in chunks
+    while later stages are still fetching. Use --stage-by-stage to build every dataset in
+    memory first and load them at the end. Its datasets are DataFrames built column by
+    column from the raw API objects.
 
-    # Fetch the unique artists.
-    artists = fetch_artists(seeds, spotify)
-    print("artists_size: ", len(artists))
+    API responses are cached in spotify_cache.db, so reruns only call the API for stale or
+    missing entries. Use --no-cache to always call the API.
 
-    # Fetch the unique albums (in terms of album name).
-    albums = fetch_albums_for_all_artists(artists, spotify)
-    print("albums_size: ", len(albums))
+    Use --incremental for a refresh that upserts into the existing tables: new rows are
+    inserted, changed rows updated and unchanged rows left untouched.
 
-    # Fetch the unique tracks (in terms of song name).
-    tracks = fetch_tracks_for_all_albums(albums, spotify)
-    print("tracks_size: ", len(tracks))
+    Use --bulk-load to write with plain sqlite3 executemany and load-tuned PRAGMAs instead of
+    pandas' DataFrame.to_sql.
 
-    # Fetch the track features.
-    track_features = fetch_features_for_all_tracks(tracks, spotify)
-    print("track_features_size: ", len(track_features))
+    Streaming runs record their progress in the DB as they write. If a run is interrupted
+    (crash, Ctrl+C, kill), use --resume to carry on where it stopped instead of starting over.
 
-    print("All datasets are ready to be imported into db!!!")
+    Use --skip-unchanged for a daily refresh that only fetches the tracks of new or changed
+    albums and the features of new tracks. Like --incremental, it upserts.
 
-    # ----- Step 2: Write the datasets to DB -----
-    db_conn = sqlite3.connect("spotify.db")
-    print("connected to db!!!")
+    Use --batch-endpoints to minimize API round trips: seeds are searched once and their
+    artist IDs kept in the DB, then artists are fetched 50 per call and album tracks 20
+    albums per call.
 
-    load_artists_to_db(artists, db_conn)
-    load_albums_to_db(albums, db_conn)
-    load_tracks_to_db(tracks, db_conn)
-    load_tracks_features_to_db(track_features, db_conn)
-    print("finished loading to db!!!")
+    Use --fake-catalog-size to run offline against a local fake Spotify serving a synthetic
+    catalog of that many artists, e.g. to load-test concurrency, caching and retries:
+        python data_generation.py --fake-catalog-size 1000 --fake-latency 0.05 --fake-rate-limit 50
+    It writes to fake_spotify.db and caches in fake_spotify_cache.db unless told otherwise.
+
+    Every run writes a JSON report and a Prometheus textfile into metrics/ (see --metrics-dir):
+    wall time per stage, API calls, retries and cache hits per endpoint, rows fetched,
+    deduplicated and written per table, peak RSS and SQLite time per statement. Add --profile
+    for a cProfile file per stage and --trace-memory for the peak Python memory per stage.
+"""
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pull, transform and load datasets.")
+    add_arguments(parser)
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    check_arguments(parser, args)
+    start_run_metrics("data_generation", args)
+    run(args)
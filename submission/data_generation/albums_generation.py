@@ -1,5 +1,24 @@
-import pandas as pd
-import numpy as np
+from instrumentation.run_metrics import metrics
+from data_generation.concurrent_fetch import map_concurrently
+from data_generation.records import (
+    records_to_frame,
+    AlbumRecord,
+    find_overrides,
+    intern_category,
+)
+from data_generation.columnar_transform import (
+    deduplicate_frame,
+    get_column,
+    transform_albums_columnar,
+)
+from data_generation.upsert_loading import upsert_records
+from data_generation.bulk_loading import bulk_load_records
+from data_generation.derived_columns import add_derived_columns
+from data_generation.schema import (
+    ALBUM_DTYPE,
+    get_stored_dtype,
+    prepare_table_for_load,
+)
 
 """
 Functions related to albums dataset generation.
@@ -11,101 +30,141 @@ Functions related to albums dataset generation.
 # albums: list of albums to be deduplicated.
 # Can't deduplicate based on IDs since the same album may have different IDs (release version etc.)
 # causing the same album to appear multiple times if based on ID.
-def deduplicate_albums(albums):
+# visited_names: names already seen, e.g. in earlier chunks of a stream. Updated in place.
+def deduplicate_albums(albums, visited_names=None):
     unique_albums = []
-    visited_names = set()
+    visited_names = set() if visited_names is None else visited_names
 
     for album in albums:
-        album_name = album["album_name"]
+        album_name = album.album_name
         if album_name not in visited_names:
             unique_albums.append(album)
             visited_names.add(album_name)
 
+    metrics.increment("rows_fetched", len(albums), table="album")
+    metrics.increment(
+        "rows_deduplicated", len(albums) - len(unique_albums), table="album"
+    )
     return unique_albums
 
 
+# Convert a raw album dict from the Spotify API to an album table record (see records.py).
+# album_raw: an album object returned by the artist_albums endpoint.
+# artist_id: the ID of the artist the album was fetched for.
+def transform_album(album_raw, artist_id):
+    # These properties could be empty.
+    images = album_raw["images"]
+
+    album = AlbumRecord(
+        album_id=album_raw["id"],
+        album_name=album_raw["name"],
+        image_url=images[0]["url"]
+        if len(images) > 0
+        else "",  # Assign empty string if no image found.
+        release_date=album_raw["release_date"],
+        total_tracks=album_raw["total_tracks"],
+        type=intern_category(album_raw["type"]),
+        artist_id=artist_id,
+        # The URL and URI are rebuilt from the ID, unless they don't follow the pattern.
+        overrides=find_overrides(
+            AlbumRecord,
+            album_raw["id"],
+            external_url=album_raw["external_urls"]["spotify"],
+            album_uri=album_raw["uri"],
+        ),
+    )
+
+    return album
+
+
 # ----- Helper Functions End -----
 
 
+# Fetch the raw album dicts of an artist from the Spotify API.
+# artist_uri: the URI of the artist.
+# spotify: an object created after connecting to Spotipy library.
+def fetch_albums_raw_by_artist(artist_uri, spotify):
+    albums_search_result = spotify.artist_albums(
+        artist_id=artist_uri, album_type="album", country="US"
+    )
+    return albums_search_result["items"]
+
+
 # Fetch all albums by an artist.
 # artist: the artist we are interested in.
 # spotify: an object created after connecting to Spotipy library.
 def fetch_albums_by_artist(artist, spotify):
     # Search the albums by an artist using the Spotify API.
-    albums_search_result = spotify.artist_albums(
-        artist_id=artist["artist_uri"], album_type="album", country="US"
-    )
-    albums_list_raw = albums_search_result["items"]
+    albums_list_raw = fetch_albums_raw_by_artist(artist.artist_uri, spotify)
 
     albums_list = []
 
     # Convert the raw albums to the format compatible with the album table schema.
     for album_raw in albums_list_raw:
-        # These properties could be empty.
-        images = album_raw["images"]
-
-        album = {
-            "album_id": album_raw["id"],
-            "album_name": album_raw["name"],
-            "external_url": album_raw["external_urls"]["spotify"],
-            "image_url": images[0]["url"]
-            if len(images) > 0
-            else "",  # Assign empty string if no image found.
-            "release_date": album_raw["release_date"],
-            "total_tracks": album_raw["total_tracks"],
-            "type": album_raw["type"],
-            "album_uri": album_raw["uri"],
-            "artist_id": artist[
-                "artist_id"
-            ],  # Due to possibility of multiple artists, use artist id directly from input artist.
-        }
-        albums_list.append(album)
+        # Due to possibility of multiple artists, use artist id directly from input artist.
+        albums_list.append(transform_album(album_raw, artist.artist_id))
 
     return albums_list
 
 
-# Fetch albums across all artists.
-# artists: the list of artists we want to get the albums for.
+# Fetch albums across all artists, as an album table DataFrame.
+# The raw albums are transformed column by column (see columnar_transform.py).
+# artists: the artists we want to get the albums for, as a DataFrame or a list of dicts.
 # spotify: an object created after connecting to Spotipy library.
+# max_workers: number of concurrent API calls. Defaults to 1, which fetches the artists' albums one by one.
 # Final albums are deduplicated based on their names.
-def fetch_albums_for_all_artists(artists, spotify):
-    all_albums_nested = []
-
-    for artist in artists:
-        fetched_albums = fetch_albums_by_artist(artist, spotify)
-        all_albums_nested.append(fetched_albums)
+def fetch_albums_for_all_artists(artists, spotify, max_workers=1):
+    album_pages = map_concurrently(
+        lambda artist: (artist[1], fetch_albums_raw_by_artist(artist[0], spotify)),
+        list(zip(get_column(artists, "artist_uri"), get_column(artists, "artist_id"))),
+        max_workers,
+    )
 
-    all_albums = list(np.concatenate(all_albums_nested).flat)
-    unique_albums = deduplicate_albums(all_albums)
+    all_albums = transform_albums_columnar(album_pages)
+    unique_albums = deduplicate_frame(all_albums, "album_name", "album")
 
     print(f"Number of albums: all {len(all_albums)} -> unique {len(unique_albums)}")
     return unique_albums
 
 
 # Load the albums into database's album table.
-# albums: the albums to load.
+# albums: the albums to load, as a list of dicts or a DataFrame.
 # db_conn: a database connection.
-def load_albums_to_db(albums, db_conn):
-    albums_df = pd.DataFrame(albums)
+# if_exists: "replace" rewrites the table, "append" adds the rows to it (used when loading in chunks),
+# "upsert" inserts new rows and updates changed rows keyed on album_id, leaving unchanged rows untouched.
+# bulk: load with plain sqlite3 executemany instead of DataFrame.to_sql, see bulk_loading.py.
+def load_albums_to_db(albums, db_conn, if_exists="replace", bulk=False):
+    # The derived columns (see derived_columns.py) are computed once here and stored.
+    albums = add_derived_columns(albums, "album", db_conn)
+    dtype = get_stored_dtype("album")
+
+    if bulk:
+        num_rows = bulk_load_records(
+            albums, "album", dtype, "album_id", db_conn, if_exists
+        )
+        print(f"Bulk loaded albums: {num_rows} rows written")
+        return
+
+    if if_exists == "upsert":
+        num_changed = upsert_records(albums, "album", dtype, "album_id", db_conn)
+        print(f"Upserted albums: {num_changed} of {len(albums)} rows changed")
+        return
+
+    albums_df = records_to_frame(albums, dtype)
 
     # Evaluate Nones.
-    print("Number of NaN in albums DF: ", albums_df.isna().sum().sum())
+    metrics.increment(
+        "nan_values",
+        int(albums_df[list(ALBUM_DTYPE)].isna().sum().sum()),
+        table="album",
+    )
 
+    # Load into the declared table (keys and indexes) rather than letting to_sql create it.
+    prepare_table_for_load("album", db_conn, if_exists)
     albums_df.to_sql(
         name="album",
         con=db_conn,
-        if_exists="replace",
+        if_exists="append",
         index=False,
-        # Following https://www.sqlite.org/datatype3.html to translate the required datatypes to sqlite3 types.
-        dtype={
-            "album_id": "TEXT",
-            "album_name": "TEXT",
-            "external_url": "TEXT",
-            "image_url": "TEXT",
-            "release_date": "TEXT",
-            "total_tracks": "INTEGER",
-            "type": "TEXT",
-            "album_uri": "TEXT",
-            "artist_id": "TEXT",
-        },
+        dtype=dtype,
     )
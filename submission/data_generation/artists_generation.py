@@ -1,4 +1,23 @@
-import pandas as pd
+from instrumentation.run_metrics import metrics
+from data_generation.concurrent_fetch import map_concurrently
+from data_generation.records import (
+    records_to_frame,
+    ArtistRecord,
+    find_overrides,
+    intern_category,
+)
+from data_generation.columnar_transform import (
+    deduplicate_frame,
+    transform_artists_columnar,
+)
+from data_generation.upsert_loading import upsert_records
+from data_generation.bulk_loading import bulk_load_records
+from data_generation.derived_columns import add_derived_columns
+from data_generation.schema import (
+    ARTIST_DTYPE,
+    get_stored_dtype,
+    prepare_table_for_load,
+)
 
 """
 Functions related to artists dataset generation.
@@ -17,14 +36,44 @@ def find_artist_match(artist_name, artist_list):
     return None
 
 
+# Convert a raw artist dict from the Spotify API to an artist table record (see records.py).
+# artist_raw: an artist object returned by the search or artists endpoints.
+def transform_artist(artist_raw):
+    # These properties could be empty.
+    genres = artist_raw["genres"]
+    images = artist_raw["images"]
+
+    artist = ArtistRecord(
+        artist_id=artist_raw["id"],
+        artist_name=artist_raw["name"],
+        genre=intern_category(genres[0])
+        if len(genres) > 0
+        else "",  # Assign empty string if no genre found.
+        image_url=images[0]["url"]
+        if len(images) > 0
+        else "",  # Assign empty string if no image found.
+        followers=artist_raw["followers"]["total"],
+        popularity=artist_raw["popularity"],
+        type=intern_category(artist_raw["type"]),
+        # The URL and URI are rebuilt from the ID, unless they don't follow the pattern.
+        overrides=find_overrides(
+            ArtistRecord,
+            artist_raw["id"],
+            external_url=artist_raw["external_urls"]["spotify"],
+            artist_uri=artist_raw["uri"],
+        ),
+    )
+
+    return artist
+
+
 # ----- Helper Functions End -----
 
 
-# Fetch information of an artist using spotipy.
+# Search an artist by name and return the raw artist dict from the Spotify API, or None.
 # artist_name: The name of the artist we want to fetch info about.
 # spotify: an object created after connecting to Spotipy library.
-def fetch_artist(artist_name, spotify):
-    # Fetch the raw artist dict from the Spotify API.
+def fetch_artist_raw(artist_name, spotify):
     artist_search_result = spotify.search(
         q=f"artist:{artist_name}", limit=10, type="artist"
     )
@@ -33,73 +82,90 @@ def fetch_artist(artist_name, spotify):
 
     if artist_raw is None:
         print("cannot find artist associated with: ", artist_name)
+    return artist_raw
+
+
+# Fetch information of an artist using spotipy.
+# artist_name: The name of the artist we want to fetch info about.
+# spotify: an object created after connecting to Spotipy library.
+def fetch_artist(artist_name, spotify):
+    artist_raw = fetch_artist_raw(artist_name, spotify)
+    if artist_raw is None:
         return None
 
     # Convert the raw artist dict to the format compatible with the artist table schema.
-    # These properties could be empty.
-    genres = artist_raw["genres"]
-    images = artist_raw["images"]
+    return transform_artist(artist_raw)
 
-    artist = {
-        "artist_id": artist_raw["id"],
-        "artist_name": artist_raw["name"],
-        "external_url": artist_raw["external_urls"]["spotify"],
-        "genre": genres[0]
-        if len(genres) > 0
-        else "",  # Assign empty string if no genre found.
-        "image_url": images[0]["url"]
-        if len(images) > 0
-        else "",  # Assign empty string if no image found.
-        "followers": artist_raw["followers"]["total"],
-        "popularity": artist_raw["popularity"],
-        "type": artist_raw["type"],
-        "artist_uri": artist_raw["uri"],
-    }
 
-    return artist
+# Fetch up to 50 artists by ID in a single call to the artists endpoint.
+# artist_ids_batch: at most 50 artist IDs.
+# spotify: an object created after connecting to Spotipy library.
+# Returns one artist per ID, in the same order. None for an artist that no longer exists.
+def fetch_artists_batch(artist_ids_batch, spotify):
+    artists_raw = spotify.artists(artist_ids_batch)["artists"]
+    return [
+        None if artist_raw is None else transform_artist(artist_raw)
+        for artist_raw in artists_raw
+    ]
 
 
-# Fetch a list of artists in dict representation from the given artist_names.
+# Fetch the artists of the given artist_names, as an artist table DataFrame.
+# The raw artists are transformed column by column (see columnar_transform.py).
 # Deduplicate the artists by their IDs.
 # artist_names: the list of artist names we use to look for the artists from Spotify.
 # spotify: an object created after connecting to Spotipy library.
-def fetch_artists(artist_names, spotify):
-    artists = []
-    visited_ids = set()
-
-    for artist_name in artist_names:
-        artist = fetch_artist(artist_name, spotify)
-        if artist is not None and artist["artist_id"] not in visited_ids:
-            artists.append(artist)
-            visited_ids.add(artist["artist_id"])
+# max_workers: number of concurrent API calls. Defaults to 1, which fetches the artists one by one.
+def fetch_artists(artist_names, spotify, max_workers=1):
+    artists_raw = map_concurrently(
+        lambda artist_name: fetch_artist_raw(artist_name, spotify),
+        artist_names,
+        max_workers,
+    )
 
-    return artists
+    artists = transform_artists_columnar(
+        [artist_raw for artist_raw in artists_raw if artist_raw is not None]
+    )
+    return deduplicate_frame(artists, "artist_id", "artist")
 
 
 # Load the artists into database's artist table.
-# artists: the artists to load.
+# artists: the artists to load, as a list of dicts or a DataFrame.
 # db_conn: a database connection.
-def load_artists_to_db(artists, db_conn):
-    artists_df = pd.DataFrame(artists)
+# if_exists: "replace" rewrites the table, "append" adds the rows to it (used when loading in chunks),
+# "upsert" inserts new rows and updates changed rows keyed on artist_id, leaving unchanged rows untouched.
+# bulk: load with plain sqlite3 executemany instead of DataFrame.to_sql, see bulk_loading.py.
+def load_artists_to_db(artists, db_conn, if_exists="replace", bulk=False):
+    # The derived columns (see derived_columns.py) are computed once here and stored.
+    artists = add_derived_columns(artists, "artist", db_conn)
+    dtype = get_stored_dtype("artist")
+
+    if bulk:
+        num_rows = bulk_load_records(
+            artists, "artist", dtype, "artist_id", db_conn, if_exists
+        )
+        print(f"Bulk loaded artists: {num_rows} rows written")
+        return
+
+    if if_exists == "upsert":
+        num_changed = upsert_records(artists, "artist", dtype, "artist_id", db_conn)
+        print(f"Upserted artists: {num_changed} of {len(artists)} rows changed")
+        return
+
+    artists_df = records_to_frame(artists, dtype)
 
     # Evaluate Nones.
-    print("Number of NaN in artists DF: ", artists_df.isna().sum().sum())
+    metrics.increment(
+        "nan_values",
+        int(artists_df[list(ARTIST_DTYPE)].isna().sum().sum()),
+        table="artist",
+    )
 
+    # Load into the declared table (keys and indexes) rather than letting to_sql create it.
+    prepare_table_for_load("artist", db_conn, if_exists)
     artists_df.to_sql(
         name="artist",
         con=db_conn,
-        if_exists="replace",
+        if_exists="append",
         index=False,
-        # Following https://www.sqlite.org/datatype3.html to translate the required datatypes to sqlite3 types.
-        dtype={
-            "artist_id": "TEXT",
-            "artist_name": "TEXT",
-            "external_url": "TEXT",
-            "genre": "TEXT",
-            "image_url": "TEXT",
-            "followers": "INTEGER",
-            "popularity": "INTEGER",
-            "type": "TEXT",
-            "artist_uri": "TEXT",
-        },
+        dtype=dtype,
     )
@@ -0,0 +1,128 @@
+from contextlib import contextmanager
+from data_generation.upsert_loading import build_upsert_statement, iterate_rows
+from data_generation.schema import prepare_table_for_load
+from data_generation.change_tracking import (
+    build_stamp_staged_rows_statement,
+    is_change_tracking_suspended,
+)
+
+"""
+High-throughput loading on plain sqlite3, bypassing pandas' DataFrame.to_sql.
+"""
+
+# PRAGMAs applied for the duration of a bulk load run, see tuned_pragmas.
+# synchronous = OFF skips the fsync after every transaction and a large page cache (negative
+# values are in KiB) keeps the indexes in memory. The previous values are restored afterwards.
+BULK_LOAD_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "OFF",
+    "cache_size": -256 * 1024,
+}
+
+# Temporary table holding a chunk of an upsert while the change tracking triggers are suspended.
+STAGED_TABLE = "bulk_load_stage"
+
+# ----- Helper Functions -----
+
+# Split an iterable into lists of at most chunk_size items.
+def iterate_chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if len(chunk) > 0:
+        yield chunk
+
+
+# ----- Helper Functions End -----
+
+
+# Apply the given PRAGMAs for the duration of the with block, then restore their previous values.
+# Wrap a whole load run with it, rather than each bulk_load_records call: switching journal_mode
+# and synchronous on every chunk costs more than it saves.
+# db_conn: a database connection, outside of any open transaction.
+# pragmas: PRAGMA name -> value to use during the load. Defaults to BULK_LOAD_PRAGMAS.
+@contextmanager
+def tuned_pragmas(db_conn, pragmas=None):
+    pragmas = BULK_LOAD_PRAGMAS if pragmas is None else pragmas
+    previous_values = {
+        name: db_conn.execute(f"PRAGMA {name}").fetchone()[0] for name in pragmas
+    }
+
+    for name, value in pragmas.items():
+        db_conn.execute(f"PRAGMA {name} = {value}")
+    try:
+        yield
+    finally:
+        for name, value in previous_values.items():
+            db_conn.execute(f"PRAGMA {name} = {value}")
+
+
+# Load the records into a table with executemany, committing one transaction per chunk.
+# Run it inside tuned_pragmas for the load-tuned PRAGMAs.
+# records: iterable of records (see records.py) or dicts with one key per column, or a DataFrame
+# or ColumnarRows.
+# table_name: the table to load into.
+# dtype: the sqlite3 type of each column, in column order.
+# key_column: the column identifying a row. Only used when if_exists is "upsert".
+# db_conn: a database connection.
+# if_exists: "replace" empties the table first, "append" adds the rows to it,
+# "upsert" inserts new rows and updates changed rows keyed on key_column.
+# chunk_size: number of rows per transaction.
+# With the change tracking triggers suspended (see change_tracking.suspend_change_tracking), each
+# chunk of an upsert is staged in a temporary table first, to stamp the artists of the rows it
+# changes in one statement, then upserted from there.
+# Returns the number of rows inserted or updated, not counting the writes of the triggers.
+def bulk_load_records(
+    records,
+    table_name,
+    dtype,
+    key_column,
+    db_conn,
+    if_exists="replace",
+    chunk_size=50000,
+):
+    columns = list(dtype)
+    prepare_table_for_load(table_name, db_conn, if_exists)
+
+    staged = if_exists == "upsert" and is_change_tracking_suspended(db_conn)
+    if staged:
+        db_conn.execute(f"DROP TABLE IF EXISTS temp.{STAGED_TABLE}")
+        db_conn.execute(f"CREATE TEMP TABLE {STAGED_TABLE} ({', '.join(columns)})")
+        stage_statement = f"""
+            INSERT INTO temp.{STAGED_TABLE}
+            VALUES ({", ".join("?" for _ in columns)})
+        """
+        stamp_statement = build_stamp_staged_rows_statement(
+            table_name, f"temp.{STAGED_TABLE}", columns, key_column
+        )
+        statement = build_upsert_statement(
+            table_name, columns, key_column, source=f"temp.{STAGED_TABLE}"
+        )
+    elif if_exists == "upsert":
+        statement = build_upsert_statement(table_name, columns, key_column)
+    else:
+        statement = f"""
+            INSERT INTO {table_name} ({", ".join(columns)})
+            VALUES ({", ".join("?" for _ in columns)})
+        """
+
+    rows = iterate_rows(records, columns)
+
+    num_rows = 0
+    for chunk in iterate_chunks(rows, chunk_size):
+        with db_conn:
+            if staged:
+                db_conn.execute(f"DELETE FROM temp.{STAGED_TABLE}")
+                db_conn.executemany(stage_statement, chunk)
+                db_conn.execute(stamp_statement)
+                num_rows += db_conn.execute(statement).rowcount
+            else:
+                num_rows += db_conn.executemany(statement, chunk).rowcount
+
+    if staged:
+        db_conn.execute(f"DROP TABLE temp.{STAGED_TABLE}")
+    return num_rows
@@ -0,0 +1,50 @@
+import threading
+from instrumentation.run_metrics import metrics
+
+"""
+Count the Spotify API calls made by each ingestion stage.
+"""
+
+# The stage each endpoint belongs to.
+STAGES_BY_ENDPOINT = {
+    "search": "artists",
+    "artists": "artists",
+    "artist_albums": "albums",
+    "album_tracks": "tracks",
+    "albums": "tracks",
+    "audio_features": "track_features",
+}
+
+
+# Wrap a spotipy client to count the calls made to each endpoint.
+# Any method of the wrapped client can be called on this object.
+# Place it under the response cache to count the calls that actually reach the API.
+# spotify: an object created after connecting to Spotipy library.
+class CountingSpotify:
+    def __init__(self, spotify):
+        self.spotify = spotify
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.spotify, name)
+        if not callable(attribute):
+            return attribute
+
+        def counted_call(*args, **kwargs):
+            with self._lock:
+                self.calls[name] = self.calls.get(name, 0) + 1
+            metrics.increment("api_calls", endpoint=name)
+            return attribute(*args, **kwargs)
+
+        return counted_call
+
+    # Number of calls per stage, with the calls per endpoint of each stage.
+    def report(self):
+        calls_per_stage = {}
+        for endpoint, num_calls in sorted(self.calls.items()):
+            stage = STAGES_BY_ENDPOINT.get(endpoint, "other")
+            stage_calls = calls_per_stage.setdefault(stage, {"total": 0})
+            stage_calls["total"] += num_calls
+            stage_calls[endpoint] = num_calls
+        return calls_per_stage
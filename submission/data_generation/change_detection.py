@@ -0,0 +1,57 @@
+"""
+Change detection for refresh runs that skip unchanged albums and tracks.
+
+artist_albums is called for every artist anyway, and its response already carries cheap
+signals of each album: its ID, total_tracks and release_date. An album whose signals match
+what is stored has the same track list, so album_tracks isn't called for it again. Audio
+features of a track never change, so audio_features is only called for tracks that have
+none stored yet.
+"""
+
+# ----- Helper Functions -----
+
+# The signals of an album compared between the stored row and the fetched one.
+def get_album_signature(album):
+    return (album.total_tracks, album.release_date)
+
+
+# ----- Helper Functions End -----
+
+
+# Read what a refresh run compares the fetched albums and tracks with.
+# Returns a dict with:
+#   album_signatures: album_id -> (total_tracks, release_date) of every stored album.
+#   song_names_by_album: album_id -> song names of the stored tracks, to keep deduplicating
+#   against the tracks of albums that are skipped.
+#   featured_track_ids: IDs of the tracks whose features are stored.
+# db_conn: a database connection.
+def load_stored_state(db_conn):
+    album_signatures = {
+        album_id: (total_tracks, release_date)
+        for album_id, total_tracks, release_date in db_conn.execute(
+            "SELECT album_id, total_tracks, release_date FROM album"
+        )
+    }
+
+    song_names_by_album = {}
+    for album_id, song_name in db_conn.execute(
+        "SELECT album_id, song_name FROM track ORDER BY rowid"
+    ):
+        song_names_by_album.setdefault(album_id, []).append(song_name)
+
+    return {
+        "album_signatures": album_signatures,
+        "song_names_by_album": song_names_by_album,
+        "featured_track_ids": {
+            row[0] for row in db_conn.execute("SELECT track_id FROM track_feature")
+        },
+    }
+
+
+# Whether an album fetched from artist_albums is stored with the same signals.
+# New albums (not stored yet) count as changed.
+# album: the fetched album, in the album table format.
+# stored_state: state returned by load_stored_state.
+def is_album_unchanged(album, stored_state):
+    stored_signature = stored_state["album_signatures"].get(album.album_id)
+    return stored_signature == get_album_signature(album)
@@ -0,0 +1,329 @@
+from contextlib import contextmanager
+
+"""
+Change tracking for the base tables, at artist granularity.
+
+Triggers on artist, album, track and track_feature stamp the artist owning every inserted,
+updated or deleted row with the current load generation. Downstream consumers (e.g. the
+materialized views) remember the last generation they processed and only recompute the
+artists stamped after it.
+
+Writes to rows that belong to no artist (e.g. a track whose album isn't loaded), and deletes
+that leave such rows behind, stamp NO_ARTIST_ID instead, for the consumers that keep those rows
+(see has_changes_without_artist).
+
+Loads rewriting every table, and bulk upserts, run under suspend_change_tracking instead: the
+triggers are dropped, which also lets SQLite empty a table in one go, and the changed artists are
+stamped set-based, once per load or once per chunk.
+
+    load_generation        single row holding the current generation
+    artist_change          artist_id -> generation of its latest change
+    refresh_watermark      consumer -> last generation it processed
+    change_tracking_state  single row telling whether the triggers are suspended
+"""
+
+# Stamped for the rows that belong to no artist. Never a Spotify artist ID.
+NO_ARTIST_ID = ""
+
+# How to find the artist owning a row of each table, given the row alias (NEW or OLD).
+# Tracks and track features go through album, so a track loaded before its album stamps
+# NO_ARTIST_ID. Its artist is stamped by the album insert of the same load.
+ARTIST_ID_LOOKUPS = {
+    "artist": "{row}.artist_id",
+    "album": "{row}.artist_id",
+    "track": "(SELECT artist_id FROM album WHERE album_id = {row}.album_id)",
+    "track_feature": """(
+        SELECT al.artist_id
+        FROM track AS t INNER JOIN album AS al ON (t.album_id = al.album_id)
+        WHERE t.track_id = {row}.track_id
+    )""",
+}
+
+# Deleting a row of these tables leaves the rows below it without an artist, so it stamps
+# NO_ARTIST_ID when there are any: table -> SQL finding them, given the row alias.
+ORPHANED_ROWS = {
+    "album": "SELECT 1 FROM track WHERE album_id = {row}.album_id",
+    "track": "SELECT 1 FROM track_feature WHERE track_id = {row}.track_id",
+}
+
+# Events the triggers of every table fire on.
+TRIGGER_EVENTS = ["INSERT", "UPDATE", "DELETE"]
+
+# ----- Helper Functions -----
+
+# Build the statement stamping the artist found by artist_id_expression with the current generation,
+# or NO_ARTIST_ID if there is none.
+# condition: SQL condition to stamp on, defaults to always.
+def build_stamp_statement(artist_id_expression, condition="true"):
+    return f"""
+        INSERT INTO artist_change (artist_id, generation)
+        SELECT COALESCE({artist_id_expression}, '{NO_ARTIST_ID}'), generation
+        FROM load_generation
+        WHERE {condition}
+        ON CONFLICT (artist_id) DO UPDATE SET generation = excluded.generation;
+    """
+
+
+# Create the insert, update and delete triggers of a table.
+# Triggers created by an earlier version of this module are replaced.
+def create_table_triggers(table_name, db_conn):
+    lookup = ARTIST_ID_LOOKUPS[table_name]
+    stamps_per_event = {
+        "INSERT": [build_stamp_statement(lookup.format(row="NEW"))],
+        # An update may move the row to another artist, stamp both sides.
+        "UPDATE": [
+            build_stamp_statement(lookup.format(row="OLD")),
+            build_stamp_statement(lookup.format(row="NEW")),
+        ],
+        "DELETE": [build_stamp_statement(lookup.format(row="OLD"))],
+    }
+    if table_name in ORPHANED_ROWS:
+        stamps_per_event["DELETE"].append(
+            build_stamp_statement(
+                "NULL", f"EXISTS ({ORPHANED_ROWS[table_name].format(row='OLD')})"
+            )
+        )
+
+    for event, statements in stamps_per_event.items():
+        trigger_name = get_trigger_name(table_name, event)
+        # Stored as written in sqlite_master, which tells whether the trigger is up to date.
+        trigger_sql = f"""CREATE TRIGGER {trigger_name}
+            AFTER {event} ON {table_name}
+            BEGIN
+                {"".join(statements)}
+            END"""
+        row = db_conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+            (trigger_name,),
+        ).fetchone()
+        if row is None or row[0] != trigger_sql:
+            db_conn.execute(f"DROP TRIGGER IF EXISTS {trigger_name}")
+            db_conn.execute(trigger_sql)
+
+
+def get_trigger_name(table_name, event):
+    return f"tr_{table_name}_{event.lower()}_change"
+
+
+def drop_table_triggers(table_name, db_conn):
+    for event in TRIGGER_EVENTS:
+        db_conn.execute(f"DROP TRIGGER IF EXISTS {get_trigger_name(table_name, event)}")
+
+
+# Stamp every artist the tables refer to, and NO_ARTIST_ID, in one statement.
+def stamp_every_artist(db_conn):
+    db_conn.execute(
+        f"""
+        INSERT INTO artist_change (artist_id, generation)
+        SELECT artist_id, generation
+        FROM (
+            SELECT artist_id FROM artist
+            UNION SELECT artist_id FROM album WHERE artist_id IS NOT NULL
+            UNION SELECT '{NO_ARTIST_ID}'
+        ), load_generation
+        WHERE true
+        ON CONFLICT (artist_id) DO UPDATE SET generation = excluded.generation
+    """
+    )
+
+
+def get_watermark(db_conn, consumer):
+    row = db_conn.execute(
+        "SELECT generation FROM refresh_watermark WHERE consumer = ?", (consumer,)
+    ).fetchone()
+    return None if row is None else row[0]
+
+
+# ----- Helper Functions End -----
+
+
+# Create the change tracking tables and triggers. Safe to call repeatedly.
+# Must run after the base tables exist.
+# db_conn: a database connection.
+def create_change_tracking(db_conn):
+    with db_conn:
+        db_conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS load_generation (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                generation INTEGER NOT NULL
+            )
+        """
+        )
+        db_conn.execute(
+            "INSERT OR IGNORE INTO load_generation (id, generation) VALUES (1, 0)"
+        )
+        db_conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS artist_change (
+                artist_id TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL
+            )
+        """
+        )
+        db_conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS ix_artist_change_generation
+            ON artist_change (generation)
+        """
+        )
+        db_conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS refresh_watermark (
+                consumer TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL
+            )
+        """
+        )
+
+        db_conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS change_tracking_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                suspended INTEGER NOT NULL
+            )
+        """
+        )
+        db_conn.execute(
+            "INSERT OR IGNORE INTO change_tracking_state (id, suspended) VALUES (1, 0)"
+        )
+
+        for table_name in ARTIST_ID_LOOKUPS:
+            create_table_triggers(table_name, db_conn)
+
+        # A load killed while the triggers were suspended may have changed anything without
+        # stamping it: every consumer starts from scratch.
+        if is_change_tracking_suspended(db_conn):
+            db_conn.execute("DELETE FROM refresh_watermark")
+            db_conn.execute("UPDATE change_tracking_state SET suspended = 0")
+
+
+# Start a new load generation. Call once at the beginning of every load.
+# Returns the new generation number.
+def start_load_generation(db_conn):
+    with db_conn:
+        db_conn.execute("UPDATE load_generation SET generation = generation + 1")
+    return get_load_generation(db_conn)
+
+
+def get_load_generation(db_conn):
+    return db_conn.execute("SELECT generation FROM load_generation").fetchone()[0]
+
+
+def is_change_tracking_suspended(db_conn):
+    row = db_conn.execute("SELECT suspended FROM change_tracking_state").fetchone()
+    return row is not None and row[0] == 1
+
+
+# Turn the change tracking triggers off for the duration of the with block, and stamp the changes
+# set-based instead.
+# A run killed before the end leaves the triggers off until the next create_change_tracking, which
+# makes every consumer start from scratch.
+# db_conn: a database connection.
+# rewrite: the block rewrites every table, so every artist of the tables is stamped before it
+# (their rows are about to be deleted) and after it. Otherwise the block must only write through
+# the bulk loader, which stamps the rows each chunk changes (see bulk_loading.py).
+@contextmanager
+def suspend_change_tracking(db_conn, rewrite=True):
+    with db_conn:
+        if rewrite:
+            stamp_every_artist(db_conn)
+        db_conn.execute("UPDATE change_tracking_state SET suspended = 1")
+        for table_name in ARTIST_ID_LOOKUPS:
+            drop_table_triggers(table_name, db_conn)
+    try:
+        yield
+    finally:
+        with db_conn:
+            if rewrite:
+                stamp_every_artist(db_conn)
+            for table_name in ARTIST_ID_LOOKUPS:
+                create_table_triggers(table_name, db_conn)
+            db_conn.execute("UPDATE change_tracking_state SET suspended = 0")
+
+
+# Build the statement stamping the artists of the staged rows that differ from the stored ones,
+# before and after the change, like the triggers do for the rows an upsert changes.
+# Run it after staging the rows and before upserting them.
+# table_name: the table the rows are upserted into.
+# staged_table: the table holding the staged rows, with the same columns.
+# columns: the columns of the rows.
+# key_column: the column identifying a row.
+def build_stamp_staged_rows_statement(table_name, staged_table, columns, key_column):
+    lookup = ARTIST_ID_LOOKUPS[table_name]
+    differs = " OR ".join(
+        f"b.{column} IS NOT s.{column}" for column in columns if column != key_column
+    )
+    return f"""
+        INSERT INTO artist_change (artist_id, generation)
+        SELECT artist_id, generation
+        FROM (
+            SELECT COALESCE({lookup.format(row="s")}, '{NO_ARTIST_ID}') AS artist_id
+            FROM {staged_table} AS s
+                LEFT JOIN {table_name} AS b ON (b.{key_column} = s.{key_column})
+            WHERE b.{key_column} IS NULL OR {differs}
+            UNION
+            SELECT COALESCE({lookup.format(row="b")}, '{NO_ARTIST_ID}')
+            FROM {staged_table} AS s
+                INNER JOIN {table_name} AS b ON (b.{key_column} = s.{key_column})
+            WHERE {differs}
+        ), load_generation
+        WHERE true
+        ON CONFLICT (artist_id) DO UPDATE SET generation = excluded.generation
+    """
+
+
+# IDs of the artists changed since a generation, included. E.g. the artists a load changed, given
+# the generation it started.
+# Returns a list of artist IDs.
+def get_artist_ids_changed_since(db_conn, generation):
+    rows = db_conn.execute(
+        "SELECT artist_id FROM artist_change WHERE generation >= ? AND artist_id != ?",
+        (generation, NO_ARTIST_ID),
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+# IDs of the artists changed since the consumer last called mark_changes_consumed.
+# Returns None if the consumer never processed any change, meaning it needs a full rebuild.
+# db_conn: a database connection.
+# consumer: name of the downstream consumer, e.g. "materialized_views".
+def get_changed_artist_ids(db_conn, consumer):
+    watermark = get_watermark(db_conn, consumer)
+    if watermark is None:
+        return None
+    return get_artist_ids_changed_since(db_conn, watermark + 1)
+
+
+# Whether rows belonging to no artist changed, or may have been left behind by a delete, since the
+# consumer last called mark_changes_consumed. True if the consumer never processed any change.
+# db_conn: a database connection.
+# consumer: name of the downstream consumer.
+def has_changes_without_artist(db_conn, consumer):
+    watermark = get_watermark(db_conn, consumer)
+    if watermark is None:
+        return True
+
+    row = db_conn.execute(
+        "SELECT 1 FROM artist_change WHERE artist_id = ? AND generation > ?",
+        (NO_ARTIST_ID, watermark),
+    ).fetchone()
+    return row is not None
+
+
+# Record that the consumer has processed every change so far.
+# The generation is bumped as well, so changes written later in the same load are still
+# seen as newer than the watermark.
+# Runs in the caller's transaction, so commit it together with the consumer's own writes.
+# db_conn: a database connection.
+# consumer: name of the downstream consumer.
+def mark_changes_consumed(db_conn, consumer):
+    db_conn.execute(
+        """
+        INSERT INTO refresh_watermark (consumer, generation)
+        SELECT ?, generation FROM load_generation WHERE true
+        ON CONFLICT (consumer) DO UPDATE SET generation = excluded.generation
+    """,
+        (consumer,),
+    )
+    db_conn.execute("UPDATE load_generation SET generation = generation + 1")
@@ -0,0 +1,147 @@
+from data_generation.schema import PRIMARY_KEYS
+from data_generation.records import (
+    ArtistRecord,
+    AlbumRecord,
+    TrackRecord,
+    get_value_getter,
+    record_from_row,
+)
+
+"""
+Progress journal for crash-safe, resumable ingestion runs.
+
+The journal lives in the same DB as the data. The streaming writer records an entry only
+after the rows it covers have been committed, so a crashed run never claims more progress
+than what was written:
+
+    seed            the artist searched for the seed name is written
+    artist          the artist's albums are written
+    album           the album's tracks are written
+    track_features  the track's features (or the lack of them) are written
+
+It also records the key of every artist, album and track row the run has written (see
+WRITTEN_ROW_KINDS). A resumed run only deduplicates against, and carries on from, the rows of
+its own run, never the rows an earlier run left in the tables.
+"""
+
+# Table -> the kind of the journal entries recording its rows written by the current run.
+WRITTEN_ROW_KINDS = {
+    "artist": "artist_row",
+    "album": "album_row",
+    "track": "track_row",
+}
+
+# ----- Helper Functions -----
+
+# Read the item keys of a kind of journal entry.
+# Returns a set of keys.
+def get_done_keys(db_conn, kind):
+    rows = db_conn.execute(
+        "SELECT item_key FROM ingestion_journal WHERE kind = ?", (kind,)
+    ).fetchall()
+    return {row[0] for row in rows}
+
+
+# Read a column of the rows of a table written by the current run.
+# Returns a set of values.
+def get_written_values(db_conn, table_name, column):
+    rows = db_conn.execute(
+        f"""
+        SELECT {column} FROM {table_name}
+        WHERE {PRIMARY_KEYS[table_name]} IN (
+            SELECT item_key FROM ingestion_journal WHERE kind = ?
+        )
+    """,
+        (WRITTEN_ROW_KINDS[table_name],),
+    )
+    return {row[0] for row in rows}
+
+
+# Read the rows of a table written by the current run that have no journal entry of the given kind.
+# record_type: the record type of the table (see records.py).
+# Returns a list of records, one per row, in insertion order.
+def get_pending_rows(db_conn, table_name, kind, record_type):
+    key_column = PRIMARY_KEYS[table_name]
+    cur = db_conn.execute(
+        f"""
+        SELECT * FROM {table_name}
+        WHERE {key_column} IN (
+            SELECT item_key FROM ingestion_journal WHERE kind = ?
+        )
+        AND {key_column} NOT IN (
+            SELECT item_key FROM ingestion_journal WHERE kind = ?
+        )
+        ORDER BY rowid
+    """,
+        (WRITTEN_ROW_KINDS[table_name], kind),
+    )
+    columns = [description[0] for description in cur.description]
+    return [
+        record_from_row(record_type, dict(zip(columns, row))) for row in cur.fetchall()
+    ]
+
+
+# ----- Helper Functions End -----
+
+
+# Create the journal table. Safe to call repeatedly.
+# db_conn: a database connection.
+def create_journal(db_conn):
+    with db_conn:
+        db_conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ingestion_journal (
+                kind TEXT NOT NULL,
+                item_key TEXT NOT NULL,
+                PRIMARY KEY (kind, item_key)
+            )
+        """
+        )
+
+
+# Forget the progress of earlier runs. Call at the start of a fresh (non resumed) run.
+def clear_journal(db_conn):
+    with db_conn:
+        db_conn.execute("DELETE FROM ingestion_journal")
+
+
+# Record completed work.
+# entries: list of (kind, item_key) tuples.
+def record_journal_entries(db_conn, entries):
+    with db_conn:
+        db_conn.executemany(
+            "INSERT OR IGNORE INTO ingestion_journal (kind, item_key) VALUES (?, ?)",
+            entries,
+        )
+
+
+# The journal entries recording rows written to a table.
+# records: the records just written, as records (see records.py) or dicts.
+# Returns a list of (kind, item_key) tuples, empty for a table whose rows aren't journaled.
+def list_written_rows(table_name, records):
+    if table_name not in WRITTEN_ROW_KINDS or len(records) == 0:
+        return []
+    get_key = get_value_getter(records[0], PRIMARY_KEYS[table_name])
+    return [(WRITTEN_ROW_KINDS[table_name], get_key(record)) for record in records]
+
+
+# Read everything a resumed run needs from the DB and the journal.
+# Returns a dict with:
+#   done_seeds: seed names whose artist is already written.
+#   visited_artist_ids, visited_album_names, visited_song_names: what the interrupted run already
+#   wrote, so deduplication carries on exactly as if the run had never stopped.
+#   pending_artists, pending_albums, pending_tracks: rows written by the interrupted run whose
+#   downstream work is unfinished.
+# db_conn: a database connection.
+def load_resume_state(db_conn):
+    return {
+        "done_seeds": get_done_keys(db_conn, "seed"),
+        "visited_artist_ids": get_done_keys(db_conn, WRITTEN_ROW_KINDS["artist"]),
+        "visited_album_names": get_written_values(db_conn, "album", "album_name"),
+        "visited_song_names": get_written_values(db_conn, "track", "song_name"),
+        "pending_artists": get_pending_rows(db_conn, "artist", "artist", ArtistRecord),
+        "pending_albums": get_pending_rows(db_conn, "album", "album", AlbumRecord),
+        "pending_tracks": get_pending_rows(
+            db_conn, "track", "track_features", TrackRecord
+        ),
+    }
@@ -0,0 +1,156 @@
+from itertools import chain
+from operator import itemgetter
+import numpy as np
+import pandas as pd
+from instrumentation.run_metrics import metrics
+from data_generation.records import get_value_getter
+
+"""
+Columnar transform of raw Spotify API objects.
+
+The transform_* functions of the *_generation modules build one record per raw object,
+field by field. Here the raw objects of a whole stage are kept as they come from the API, and each
+column is extracted in one pass over them, straight into a DataFrame. There is no dict per
+record and no object array round trip, and the DataFrame goes to the loaders as it is.
+
+The column specs mirror transform_artist, transform_album, transform_track and
+transform_track_features, and give the same rows.
+"""
+
+# How to read each column of a table from a raw object, in table column order:
+# a key, a (key, nested key) path or a function of the raw object.
+ARTIST_COLUMNS = {
+    "artist_id": "id",
+    "artist_name": "name",
+    "external_url": ("external_urls", "spotify"),
+    # Empty string if the artist has no genre or no image.
+    "genre": lambda raw: raw["genres"][0] if len(raw["genres"]) > 0 else "",
+    "image_url": lambda raw: raw["images"][0]["url"] if len(raw["images"]) > 0 else "",
+    "followers": ("followers", "total"),
+    "popularity": "popularity",
+    "type": "type",
+    "artist_uri": "uri",
+}
+
+# Without artist_id, which comes from the artist the albums were fetched for.
+ALBUM_COLUMNS = {
+    "album_id": "id",
+    "album_name": "name",
+    "external_url": ("external_urls", "spotify"),
+    "image_url": lambda raw: raw["images"][0]["url"] if len(raw["images"]) > 0 else "",
+    "release_date": "release_date",
+    "total_tracks": "total_tracks",
+    "type": "type",
+    "album_uri": "uri",
+}
+
+# Without album_id, which comes from the album the tracks were fetched for.
+TRACK_COLUMNS = {
+    "track_id": "id",
+    "song_name": "name",
+    "external_url": ("external_urls", "spotify"),
+    "duration_ms": "duration_ms",
+    "explicit": "explicit",
+    "disc_number": "disc_number",
+    "type": "type",
+    "song_uri": "uri",
+}
+
+TRACK_FEATURE_COLUMNS = {
+    "track_id": "id",
+    "danceability": "danceability",
+    "energy": "energy",
+    "instrumentalness": "instrumentalness",
+    "liveness": "liveness",
+    "loudness": "loudness",
+    "speechiness": "speechiness",
+    "tempo": "tempo",
+    "type": "type",
+    "valence": "valence",
+    "song_uri": "uri",
+}
+
+# ----- Helper Functions -----
+
+# Extract one column from every raw object.
+# source: a key, a (key, nested key) path or a function, as in the column specs.
+def extract_column(raw_objects, source):
+    if isinstance(source, str):
+        return list(map(itemgetter(source), raw_objects))
+    if isinstance(source, tuple):
+        key, nested_key = source
+        return [raw[key][nested_key] for raw in raw_objects]
+    return list(map(source, raw_objects))
+
+
+# Build the DataFrame of a table from raw objects.
+# columns: the column spec of the table.
+def build_frame(raw_objects, columns):
+    return pd.DataFrame(
+        {
+            column: extract_column(raw_objects, source)
+            for column, source in columns.items()
+        }
+    )
+
+
+# Build the DataFrame of a table from pages of raw objects fetched for an owner, e.g. the
+# albums of an artist, and add the owner's ID as the last column.
+# pages: list of (owner ID, list of raw objects).
+def build_frame_from_pages(pages, columns, owner_column):
+    raw_objects = list(chain.from_iterable(raw_list for _, raw_list in pages))
+    df = build_frame(raw_objects, columns)
+    df[owner_column] = np.repeat(
+        np.array([owner_id for owner_id, _ in pages], dtype=object),
+        [len(raw_list) for _, raw_list in pages],
+    )
+    return df
+
+
+# ----- Helper Functions End -----
+
+
+# Convert raw artists (search or artists endpoint) to an artist table DataFrame.
+def transform_artists_columnar(artists_raw):
+    return build_frame(artists_raw, ARTIST_COLUMNS)
+
+
+# Convert pages of raw albums (artist_albums endpoint) to an album table DataFrame.
+# album_pages: list of (artist ID, raw albums fetched for that artist).
+def transform_albums_columnar(album_pages):
+    return build_frame_from_pages(album_pages, ALBUM_COLUMNS, "artist_id")
+
+
+# Convert pages of raw tracks (album_tracks or albums endpoint) to a track table DataFrame.
+# track_pages: list of (album ID, raw tracks of that album).
+def transform_tracks_columnar(track_pages):
+    return build_frame_from_pages(track_pages, TRACK_COLUMNS, "album_id")
+
+
+# Convert raw track features (audio_features endpoint) to a track_feature table DataFrame.
+# Tracks without features (None) are left out.
+def transform_track_features_columnar(track_features_raw):
+    return build_frame(
+        [tfr for tfr in track_features_raw if tfr is not None], TRACK_FEATURE_COLUMNS
+    )
+
+
+# Keep the first row of each value of key_column, like the deduplicate_* functions.
+# table_name: the table the rows belong to, for the metrics.
+def deduplicate_frame(df, key_column, table_name):
+    unique_df = df.drop_duplicates(subset=key_column, keep="first").reset_index(
+        drop=True
+    )
+    metrics.increment("rows_fetched", len(df), table=table_name)
+    metrics.increment("rows_deduplicated", len(df) - len(unique_df), table=table_name)
+    return unique_df
+
+
+# Read a column of records given either as a DataFrame or as a list of records or dicts.
+# Returns a list.
+def get_column(records, column):
+    if isinstance(records, pd.DataFrame):
+        return records[column].tolist()
+    if len(records) == 0:
+        return []
+    return list(map(get_value_getter(records[0], column), records))
@@ -0,0 +1,230 @@
+import signal
+import sys
+from contextlib import nullcontext
+from instrumentation.run_metrics import metrics
+from instrumentation.sqlite_timing import connect_timed
+
+"""
+The ingest command, run by data_generation.py and by `cli.py ingest`.
+
+spotipy and the fetch and load modules (which import pandas) are imported by run() rather
+than at the top of this module, so building the CLI's argument parser, or running another
+subcommand, doesn't load them.
+"""
+
+
+# Add the ingest options to an argument parser.
+def add_arguments(parser):
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=1,
+        help="Number of concurrent Spotify API calls. Defaults to 1 (sequential).",
+    )
+    parser.add_argument(
+        "--stage-by-stage",
+        action="store_true",
+        help="Fetch each dataset in full before loading, instead of streaming.",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=5000,
+        help="Number of rows per DB write when streaming.",
+    )
+    parser.add_argument(
+        "--db-path",
+        help="SQLite file to load into. Defaults to spotify.db (fake_spotify.db with the fake).",
+    )
+    parser.add_argument(
+        "--cache-path",
+        help="SQLite file caching the Spotify API responses. "
+        "Defaults to spotify_cache.db (fake_spotify_cache.db with the fake).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Call the Spotify API for every request, bypassing the response cache.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Upsert into the existing tables instead of rewriting them.",
+    )
+    parser.add_argument(
+        "--bulk-load",
+        action="store_true",
+        help="Write with plain sqlite3 executemany instead of DataFrame.to_sql.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Carry on an interrupted streaming run, skipping the work it already wrote.",
+    )
+    parser.add_argument(
+        "--skip-unchanged",
+        action="store_true",
+        help="Only fetch the tracks of new or changed albums and the features of new tracks.",
+    )
+    parser.add_argument(
+        "--batch-endpoints",
+        action="store_true",
+        help="Fetch artists and album tracks through the batch endpoints.",
+    )
+    parser.add_argument(
+        "--fake-catalog-size",
+        type=int,
+        help="Run against a local fake Spotify with a synthetic catalog of this many artists.",
+    )
+    parser.add_argument(
+        "--fake-latency",
+        type=float,
+        default=0.0,
+        help="Seconds each call to the fake Spotify takes.",
+    )
+    parser.add_argument(
+        "--fake-rate-limit",
+        type=int,
+        help="Calls per second the fake Spotify allows before answering 429.",
+    )
+
+
+# Fail through the parser if the parsed arguments combine options that don't work together.
+def check_arguments(parser, args):
+    if (
+        args.resume or args.skip_unchanged or args.batch_endpoints
+    ) and args.stage_by_stage:
+        parser.error(
+            "--resume, --skip-unchanged and --batch-endpoints only work with the streaming pipeline."
+        )
+
+
+# The SQLite file loaded into: --db-path, else spotify.db, or fake_spotify.db with the fake.
+def get_db_path(args):
+    if args.db_path is not None:
+        return args.db_path
+    return "spotify.db" if args.fake_catalog_size is None else "fake_spotify.db"
+
+
+# Pull, transform and load the datasets into the DB.
+# args: the parsed arguments, see add_arguments.
+def run(args):
+    import spotipy
+    from spotipy.oauth2 import SpotifyClientCredentials
+    from seeds import seeds
+    from data_generation.rate_limiting import RateLimitedSpotify
+    from data_generation.response_cache import CachedSpotify
+    from data_generation.call_counting import CountingSpotify
+    from fake_spotify.catalog import SyntheticCatalog
+    from fake_spotify.client import FakeSpotify
+    from data_generation.schema import create_schema
+    from data_generation.change_tracking import (
+        start_load_generation,
+        suspend_change_tracking,
+    )
+    from data_generation.tier_aggregates import defer_tier_aggregates
+    from data_generation.bulk_loading import tuned_pragmas
+    from data_generation.checkpoint import (
+        clear_journal,
+        create_journal,
+        load_resume_state,
+    )
+    from data_generation.change_detection import load_stored_state
+    from data_generation.streaming_pipeline import run_streaming_ingestion
+    from data_generation.stage_by_stage import run_stage_by_stage
+
+    # Resumed and change-aware runs keep the rows already written, so they always upsert.
+    if_exists = (
+        "upsert"
+        if args.incremental or args.resume or args.skip_unchanged
+        else "replace"
+    )
+
+    # Turn a kill signal into an exception, so the rows fetched so far are flushed before exiting.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    if args.fake_catalog_size is None:
+        artist_names = seeds
+        spotify = spotipy.Spotify(auth_manager=SpotifyClientCredentials())
+        cache_path = args.cache_path or "spotify_cache.db"
+    else:
+        # Keep the synthetic data apart from the real data and its cached responses.
+        catalog = SyntheticCatalog(args.fake_catalog_size)
+        artist_names = catalog.get_artist_names()
+        spotify = FakeSpotify(catalog, args.fake_latency, args.fake_rate_limit)
+        cache_path = args.cache_path or "fake_spotify_cache.db"
+
+    # All calls go through the rate limiter so HTTP 429 responses are retried after Retry-After.
+    spotify = RateLimitedSpotify(spotify)
+    # Counts the calls reaching the API, i.e. cache misses, per stage.
+    call_counter = CountingSpotify(spotify)
+    spotify = call_counter
+    # Cache hits are served before reaching the rate limiter.
+    if not args.no_cache:
+        spotify = CachedSpotify(spotify, cache_path)
+
+    db_conn = connect_timed(get_db_path(args))
+    print("connected to db!!!")
+
+    # Declare the tables with their keys and join indexes before loading into them.
+    create_schema(db_conn)
+    # Rows changed by this run are stamped with a new generation, for incremental view refreshes.
+    start_load_generation(db_conn)
+
+    # The journal tracks what a streaming run has written, so an interrupted run can resume.
+    create_journal(db_conn)
+    resume_state = None
+    if args.resume:
+        resume_state = load_resume_state(db_conn)
+        print("resuming after", len(resume_state["done_seeds"]), "seeds")
+    else:
+        clear_journal(db_conn)
+
+    # Compare the fetched albums against the stored ones to skip unchanged albums and tracks.
+    stored_state = None
+    if args.skip_unchanged:
+        stored_state = load_stored_state(db_conn)
+
+    # Bulk loads tune the PRAGMAs once for the whole run.
+    bulk_pragmas = tuned_pragmas(db_conn) if args.bulk_load else nullcontext()
+    # Replace and bulk loads stamp the changed artists once per chunk, or once for the whole
+    # run when rewriting every table, instead of through the per row triggers.
+    suspended_tracking = (
+        suspend_change_tracking(db_conn, rewrite=if_exists == "replace")
+        if args.bulk_load or if_exists == "replace"
+        else nullcontext()
+    )
+    # The tier aggregates are brought up to date once at the end, instead of row by row: rebuilt
+    # after a run rewriting every table, else recomputed for the artists stamped by the run.
+    deferred_tiers = defer_tier_aggregates(db_conn, full=if_exists == "replace")
+    with bulk_pragmas, suspended_tracking, deferred_tiers:
+        if args.stage_by_stage:
+            run_stage_by_stage(
+                artist_names,
+                spotify,
+                db_conn,
+                args.max_workers,
+                if_exists,
+                args.bulk_load,
+            )
+        else:
+            rows_written = run_streaming_ingestion(
+                artist_names,
+                spotify,
+                db_conn,
+                max_workers=args.max_workers,
+                chunk_size=args.chunk_size,
+                if_exists=if_exists,
+                bulk=args.bulk_load,
+                resume_state=resume_state,
+                stored_state=stored_state,
+                batch_endpoints=args.batch_endpoints,
+            )
+            for table_name, num_rows in rows_written.items():
+                print(f"{table_name}_size: ", num_rows)
+
+    print("finished loading to db!!!")
+    print("API calls per stage: ", call_counter.report())
+
+    if not args.no_cache:
+        print("API response cache: ", spotify.report())
@@ -0,0 +1,42 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Helpers for running Spotify API calls concurrently.
+"""
+
+# Apply fetch_fn to every item, running up to max_workers calls at the same time.
+# Results come back in the same order as items, so the deduplication that follows
+# keeps exactly the same records as the sequential path.
+# fetch_fn: function taking one item and returning its fetched result.
+# items: the inputs to fetch, e.g. artist names or albums.
+# max_workers: concurrency limit. 1 (or less) runs the calls one after another in the calling thread.
+def map_concurrently(fetch_fn, items, max_workers=1):
+    if max_workers <= 1:
+        return [fetch_fn(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(fetch_fn, items))
+
+
+# Lazy version of map_concurrently for streams of unknown length.
+# Items are pulled from the input only as results are consumed, keeping at most
+# 2 * max_workers calls in flight, and results are yielded in input order.
+# fetch_fn: function taking one item and returning its fetched result.
+# items: any iterable, e.g. a generator fed by an upstream pipeline stage.
+# max_workers: concurrency limit. 1 (or less) runs the calls one after another in the calling thread.
+def imap_concurrently(fetch_fn, items, max_workers=1):
+    if max_workers <= 1:
+        for item in items:
+            yield fetch_fn(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque()
+        for item in items:
+            in_flight.append(executor.submit(fetch_fn, item))
+            if len(in_flight) >= 2 * max_workers:
+                yield in_flight.popleft().result()
+
+        while in_flight:
+            yield in_flight.popleft().result()
@@ -0,0 +1,161 @@
+from bisect import bisect_left
+from data_generation.schema import DERIVED_DTYPES, PRIMARY_KEYS, TABLE_DTYPES
+from data_generation.records import ColumnarRows, records_to_columns
+
+"""
+Columns derived from the loaded ones, computed once per chunk by the loaders.
+
+The views used to parse album.release_date and bucket artist.popularity on every row of
+every query. The loaders compute these values column by column, in one pass over the
+column's list of values in each chunk, and store them next to the columns they come from
+(see schema.DERIVED_DTYPES), where they are indexed:
+
+    artist.popularity_tier        the tier of popularity_tier the artist belongs to
+    album.release_year            the year of release_date, whatever its precision
+    album.release_date_precision  "year", "month" or "day", like Spotify's own field
+    track.duration_bucket         duration_ms in whole minutes: 0 for under a minute, ...
+"""
+
+# release_date length -> its precision. Spotify sends YYYY, YYYY-MM or YYYY-MM-DD.
+RELEASE_DATE_PRECISIONS = {4: "year", 7: "month", 10: "day"}
+
+# Width of a duration bucket.
+DURATION_BUCKET_MS = 60 * 1000
+
+# ----- Helper Functions -----
+
+# Whether a value is missing: None, or NaN in the columns of a DataFrame.
+def is_missing(value):
+    return value is None or value != value
+
+
+def get_release_year(release_dates):
+    years = []
+    for release_date in release_dates:
+        year = release_date[:4] if isinstance(release_date, str) else ""
+        # "0000" is sent for albums of unknown date.
+        years.append(int(year) if year.isdigit() and int(year) > 0 else None)
+    return years
+
+
+def get_release_date_precision(release_dates):
+    return [
+        RELEASE_DATE_PRECISIONS.get(len(release_date))
+        if isinstance(release_date, str)
+        else None
+        for release_date in release_dates
+    ]
+
+
+# tiers: (tier, min_popularity) of each tier in order, see read_popularity_tiers.
+# An artist is in the first tier whose min_popularity it reaches, else in the last tier, like
+# NULL popularity.
+def get_popularity_tier(popularities, tiers):
+    # Negated, the decreasing boundaries are sorted, and the number of boundaries above a
+    # popularity is the position of its tier.
+    negated_boundaries = [-min_popularity for _, min_popularity in tiers[:-1]]
+    last_position = len(negated_boundaries)
+    return [
+        tiers[
+            last_position
+            if is_missing(popularity)
+            else bisect_left(negated_boundaries, -popularity)
+        ][0]
+        for popularity in popularities
+    ]
+
+
+def get_duration_bucket(durations_ms):
+    return [
+        None if is_missing(duration_ms) else int(duration_ms // DURATION_BUCKET_MS)
+        for duration_ms in durations_ms
+    ]
+
+
+# The tiers come from the popularity_tier table (see tier_aggregates.py).
+def read_popularity_tiers(db_conn):
+    return db_conn.execute(
+        "SELECT tier, min_popularity FROM popularity_tier ORDER BY position"
+    ).fetchall()
+
+
+# Compute derived columns from the values of their source columns.
+# columns: the derived columns to compute.
+# source_values: source column -> list of its values.
+# Returns derived column -> list of its values.
+def derive_columns(columns, source_values, db_conn):
+    values = {}
+    for column in columns:
+        source_column, derive, read_settings = DERIVATIONS[column]
+        settings = () if read_settings is None else (read_settings(db_conn),)
+        values[column] = derive(source_values[source_column], *settings)
+    return values
+
+
+# ----- Helper Functions End -----
+
+
+# derived column -> (the column it is computed from, the function computing it, the function
+# reading its settings from the DB or None).
+# Each function takes the list of values of the source column, followed by the settings if
+# any, and returns the list of values of the derived column.
+DERIVATIONS = {
+    "popularity_tier": ("popularity", get_popularity_tier, read_popularity_tiers),
+    "release_year": ("release_date", get_release_year, None),
+    "release_date_precision": ("release_date", get_release_date_precision, None),
+    "duration_bucket": ("duration_ms", get_duration_bucket, None),
+}
+
+
+# Compute the derived columns of a table for the rows about to be loaded.
+# The schema must exist (see schema.create_schema): some derivations read their settings from
+# the DB, e.g. the popularity tiers.
+# records: the rows, as records (see records.py), dicts or a DataFrame.
+# table_name: the table the rows are loaded into.
+# db_conn: a database connection.
+# Returns ColumnarRows of the table's columns followed by its derived columns. Records of a table
+# without derived columns are returned as they are.
+def add_derived_columns(records, table_name, db_conn):
+    derived_columns = DERIVED_DTYPES.get(table_name, {})
+    if len(derived_columns) == 0:
+        return records
+
+    values = records_to_columns(records, TABLE_DTYPES[table_name])
+    values.update(derive_columns(derived_columns, values, db_conn))
+    return ColumnarRows(values)
+
+
+# Recompute derived columns of the rows already stored in a table, e.g. once the columns were
+# added to a DB created without them, or after the popularity tiers changed.
+# db_conn: a database connection.
+# table_name: a table with derived columns.
+# columns: the derived columns to recompute. Defaults to all of them.
+# Only the rows whose values change are updated, so the triggers don't fire for the others.
+# Returns the number of rows updated.
+def refresh_derived_columns(db_conn, table_name, columns=None):
+    columns = list(DERIVED_DTYPES[table_name]) if columns is None else columns
+    key_column = PRIMARY_KEYS[table_name]
+    source_columns = sorted({DERIVATIONS[column][0] for column in columns})
+
+    rows = db_conn.execute(
+        f"SELECT {key_column}, {', '.join(source_columns)} FROM {table_name}"
+    ).fetchall()
+    if len(rows) == 0:
+        return 0
+    keys, *source_values = zip(*rows)
+    values = derive_columns(columns, dict(zip(source_columns, source_values)), db_conn)
+
+    with db_conn:
+        cur = db_conn.executemany(
+            f"""
+            UPDATE {table_name}
+            SET {", ".join(f"{column} = ?" for column in columns)}
+            WHERE {key_column} = ?
+                AND ({" OR ".join(f"{column} IS NOT ?" for column in columns)})
+        """,
+            [
+                (*row_values, key, *row_values)
+                for key, *row_values in zip(keys, *(values[c] for c in columns))
+            ],
+        )
+    return cur.rowcount
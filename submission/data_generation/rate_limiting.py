@@ -0,0 +1,108 @@
+import threading
+import time
+
+from spotipy.exceptions import SpotifyException
+from instrumentation.run_metrics import metrics
+
+"""
+Rate limit handling for Spotify API calls.
+"""
+
+# ----- Helper Functions -----
+
+# Read how long Spotify asked us to wait from a 429 error.
+# error: the SpotifyException raised by spotipy.
+# default: seconds to wait when the response carries no usable Retry-After header.
+def get_retry_after(error, default):
+    headers = error.headers or {}
+    retry_after = headers.get("Retry-After", headers.get("retry-after"))
+
+    try:
+        return max(float(retry_after), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+# ----- Helper Functions End -----
+
+
+# Backoff state shared by every thread talking to the Spotify API.
+# When one call gets a 429, all workers pause until the Retry-After window is over.
+# On top of that pause, a per-call delay doubles after every 429 and decays after successful calls,
+# so the request rate settles on what Spotify tolerates instead of hammering it.
+# initial_delay: per-call delay (seconds) applied after the first 429.
+# max_delay: upper bound for the per-call delay.
+# decay: factor applied to the per-call delay after each successful call.
+class AdaptiveBackoff:
+    def __init__(self, initial_delay=0.1, max_delay=10.0, decay=0.8):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.decay = decay
+        self.delay = 0.0
+        self.paused_until = 0.0
+        self.num_rate_limited = 0
+        self._lock = threading.Lock()
+
+    # Block the calling thread until the shared pause is over and the per-call delay has passed.
+    def wait(self):
+        with self._lock:
+            wait_time = max(self.paused_until - time.monotonic(), 0.0) + self.delay
+
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def record_success(self):
+        with self._lock:
+            self.delay *= self.decay
+            # Stop delaying entirely once the delay becomes negligible.
+            if self.delay < self.initial_delay / 10:
+                self.delay = 0.0
+
+    # retry_after: seconds Spotify asked us to wait before the next call.
+    def record_rate_limited(self, retry_after):
+        with self._lock:
+            self.num_rate_limited += 1
+            self.delay = min(max(self.delay * 2, self.initial_delay), self.max_delay)
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+
+# Wrap a spotipy client so every API call honors HTTP 429 responses.
+# Any method of the wrapped client (search, artist_albums, album_tracks, audio_features...) can be called on this object.
+# spotify: an object created after connecting to Spotipy library.
+# backoff: an AdaptiveBackoff shared by all callers. A new one is created if not given.
+# max_attempts: number of attempts per call before the 429 error is raised to the caller.
+class RateLimitedSpotify:
+    def __init__(self, spotify, backoff=None, max_attempts=6):
+        self.spotify = spotify
+        self.backoff = backoff if backoff is not None else AdaptiveBackoff()
+        self.max_attempts = max_attempts
+
+    def __getattr__(self, name):
+        attribute = getattr(self.spotify, name)
+        if not callable(attribute):
+            return attribute
+
+        def rate_limited_call(*args, **kwargs):
+            return self.call(attribute, *args, **kwargs)
+
+        return rate_limited_call
+
+    # Call method with the given arguments, retrying after rate limit errors.
+    def call(self, method, *args, **kwargs):
+        for attempt in range(1, self.max_attempts + 1):
+            self.backoff.wait()
+            try:
+                result = method(*args, **kwargs)
+            except SpotifyException as error:
+                if error.http_status != 429 or attempt == self.max_attempts:
+                    raise
+                # Fall back to exponential backoff if Spotify didn't say how long to wait.
+                retry_after = get_retry_after(error, default=2 ** (attempt - 1))
+                self.backoff.record_rate_limited(retry_after)
+                metrics.increment(
+                    "api_retries", endpoint=getattr(method, "__name__", "unknown")
+                )
+                continue
+
+            self.backoff.record_success()
+            return result
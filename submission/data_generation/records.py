@@ -0,0 +1,185 @@
+import sys
+import pandas as pd
+from collections import namedtuple
+from operator import attrgetter, itemgetter
+from data_generation.schema import (
+    ARTIST_DTYPE,
+    ALBUM_DTYPE,
+    TRACK_DTYPE,
+    TRACK_FEATURE_DTYPE,
+)
+
+"""
+Compact in-memory records of the artist, album, track and track_feature tables.
+
+A dict per record repeats its key strings and holds every value, including values that
+can be rebuilt. The record types here are named tuples (no per-record dict, fields read
+as attributes, e.g. track.album_id) that:
+
+    drop the derivable columns   external_url and *_uri follow Spotify's URL and URI
+                                 patterns, so they are rebuilt from the ID when read. A
+                                 value that doesn't follow its pattern is kept in
+                                 `overrides` instead.
+    intern categorical values    "type" values such as "track" and "audio_features", and
+                                 genres, are shared strings rather than a copy per record.
+
+Read the table columns by name, not by position: the tuple positions hold the stored
+fields only. `columns` lists the table columns in table order.
+"""
+
+# ----- Helper Functions -----
+
+# Property reading a derived column: its override if any, else the value rebuilt from the ID.
+def derived_column(column, prefix, id_column):
+    get_id = attrgetter(id_column)
+
+    def get(record):
+        if record.overrides is not None and column in record.overrides:
+            return record.overrides[column]
+        return prefix + get_id(record)
+
+    return property(get)
+
+
+# Create the record type of a table.
+# table_columns: the table columns, in table order.
+# kind: the Spotify object kind used in its URLs and URIs, e.g. "track".
+# id_column: the column holding the Spotify ID.
+# url_column, uri_column: the derived columns. None if the table has no such column.
+def make_record_type(name, table_columns, kind, id_column, url_column, uri_column):
+    # Derived column -> the prefix its values have before the ID.
+    derived_columns = {
+        url_column: f"https://open.spotify.com/{kind}/",
+        uri_column: f"spotify:{kind}:",
+    }
+    derived_columns.pop(None, None)
+    stored_columns = [c for c in table_columns if c not in derived_columns]
+
+    namespace = {
+        "__slots__": (),
+        "columns": tuple(table_columns),
+        "id_column": id_column,
+        "derived_columns": derived_columns,
+    }
+    for column, prefix in derived_columns.items():
+        namespace[column] = derived_column(column, prefix, id_column)
+
+    fields = namedtuple(name, stored_columns + ["overrides"], defaults=(None,))
+    return type(name, (fields,), namespace)
+
+
+# ----- Helper Functions End -----
+
+
+ArtistRecord = make_record_type(
+    "ArtistRecord", ARTIST_DTYPE, "artist", "artist_id", "external_url", "artist_uri"
+)
+AlbumRecord = make_record_type(
+    "AlbumRecord", ALBUM_DTYPE, "album", "album_id", "external_url", "album_uri"
+)
+TrackRecord = make_record_type(
+    "TrackRecord", TRACK_DTYPE, "track", "track_id", "external_url", "song_uri"
+)
+TrackFeatureRecord = make_record_type(
+    "TrackFeatureRecord", TRACK_FEATURE_DTYPE, "track", "track_id", None, "song_uri"
+)
+
+
+# Share one copy of a categorical string, e.g. a "type" value, across all records.
+def intern_category(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+# Find the values of derived columns that don't follow their pattern.
+# record_type: the record type the values are for.
+# object_id: the Spotify ID of the record.
+# values: derived column -> its value from the API.
+# Returns the dict to store as the record's overrides, or None when every value follows
+# its pattern (the usual case).
+def find_overrides(record_type, object_id, **values):
+    prefixes = record_type.derived_columns
+    for column, value in values.items():
+        if value != prefixes[column] + object_id:
+            return {
+                column: value
+                for column, value in values.items()
+                if value != prefixes[column] + object_id
+            }
+    return None
+
+
+# Create a record from a row of its table, e.g. a dict read back from the DB.
+def record_from_row(record_type, row):
+    return record_type(
+        *(row[c] for c in record_type._fields[:-1]),
+        overrides=find_overrides(
+            record_type,
+            row[record_type.id_column],
+            **{c: row[c] for c in record_type.derived_columns},
+        ),
+    )
+
+
+# A getter of a column that works on records and on dicts (e.g. rows read back from the DB).
+# first_record: a record (or dict) of the kind the getter will be used on.
+def get_value_getter(first_record, column):
+    return itemgetter(column) if isinstance(first_record, dict) else attrgetter(column)
+
+
+# A getter of the given columns, returning a tuple of values, for records or dicts.
+def get_columns_getter(first_record, columns):
+    if len(columns) == 1:
+        get_value = get_value_getter(first_record, columns[0])
+        return lambda record: (get_value(record),)
+    get = itemgetter if isinstance(first_record, dict) else attrgetter
+    return get(*columns)
+
+
+# The rows of a table held column by column, e.g. records with their derived columns added (see
+# derived_columns.py). Cheaper to build than a DataFrame for rows that are only written to the DB.
+# values: column -> list of its values, one per row.
+class ColumnarRows:
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        self.values = values
+
+    def __len__(self):
+        return len(next(iter(self.values.values()), []))
+
+
+# Read the given columns of a list of records or dicts, or of a DataFrame or ColumnarRows.
+# Returns column -> list of its values, one per row.
+def records_to_columns(records, columns):
+    if isinstance(records, ColumnarRows):
+        return {column: records.values[column] for column in columns}
+    if isinstance(records, pd.DataFrame):
+        return {column: records[column].tolist() for column in columns}
+    if len(records) == 0:
+        return {column: [] for column in columns}
+    if isinstance(records[0], dict):
+        return {column: list(map(itemgetter(column), records)) for column in columns}
+
+    # Without overrides, the derived columns are rebuilt in bulk rather than through their
+    # properties.
+    record_type = type(records[0])
+    has_overrides = any(record.overrides is not None for record in records)
+    ids = list(map(attrgetter(record_type.id_column), records))
+    values = {}
+    for column in columns:
+        prefix = record_type.derived_columns.get(column)
+        if prefix is None or has_overrides:
+            values[column] = list(map(attrgetter(column), records))
+        else:
+            values[column] = [prefix + object_id for object_id in ids]
+    return values
+
+
+# Build a DataFrame with the given columns from a list of records or dicts, or ColumnarRows.
+# A DataFrame is returned as it is.
+def records_to_frame(records, columns):
+    if isinstance(records, pd.DataFrame):
+        return records
+    if len(records) == 0:
+        return pd.DataFrame(columns=list(columns))
+    return pd.DataFrame(records_to_columns(records, columns))
@@ -0,0 +1,232 @@
+import json
+import sqlite3
+import threading
+import time
+from instrumentation.run_metrics import metrics
+
+"""
+Persistent on-disk cache for Spotify API responses.
+"""
+
+DAY = 24 * 60 * 60
+
+# How long (in seconds) a cached response stays fresh, per endpoint.
+# Audio features of a track essentially never change, while an artist's album list does.
+DEFAULT_TTLS = {
+    "search": 7 * DAY,
+    "artists": 1 * DAY,
+    "artist_albums": 1 * DAY,
+    "albums": 30 * DAY,
+    "album_tracks": 30 * DAY,
+    "audio_features": 365 * DAY,
+}
+
+# Endpoints taking a list of IDs. Their responses are cached per ID rather than per call,
+# so a rerun that groups the IDs into different batches still hits the cache.
+# Maps the endpoint to the key holding the list of results in its response (None if the
+# response is the list itself).
+PER_ID_ENDPOINTS = {
+    "artists": "artists",
+    "albums": "albums",
+    "audio_features": None,
+}
+
+# ----- Helper Functions -----
+
+# Build the cache key of an API call from its arguments.
+def make_cache_key(endpoint, args, kwargs):
+    return endpoint + ":" + json.dumps([args, kwargs], sort_keys=True)
+
+
+# ----- Helper Functions End -----
+
+
+# Wrap a spotipy client so API responses are read from and written to a local SQLite cache.
+# Any method of the wrapped client can be called on this object. Methods listed in ttls are
+# cached, everything else goes straight to the wrapped client.
+# Entries older than their endpoint's TTL are refetched. Once the cache grows over max_bytes,
+# the least recently used entries are evicted.
+# spotify: an object created after connecting to Spotipy library.
+# cache_path: path to the SQLite file holding the cache.
+# ttls: TTL in seconds per endpoint. Defaults to DEFAULT_TTLS.
+# max_bytes: size cap for the cached responses.
+class CachedSpotify:
+    def __init__(
+        self,
+        spotify,
+        cache_path="spotify_cache.db",
+        ttls=None,
+        max_bytes=512 * 1024 * 1024,
+    ):
+        self.spotify = spotify
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.max_bytes = max_bytes
+        self.hits = {endpoint: 0 for endpoint in self.ttls}
+        self.misses = {endpoint: 0 for endpoint in self.ttls}
+
+        # The cache is shared by the fetch threads, so access is serialized with a lock.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        # Every hit updates last_access, so keep commits cheap. Losing the latest entries
+        # on a crash only costs a refetch.
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS response_cache (
+                cache_key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """
+        )
+        self._conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS ix_response_cache_last_access
+            ON response_cache (last_access)
+        """
+        )
+        self._conn.commit()
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM response_cache"
+        ).fetchone()[0]
+
+    def __getattr__(self, name):
+        attribute = getattr(self.spotify, name)
+        if not callable(attribute) or name not in self.ttls:
+            return attribute
+
+        def cached_call(*args, **kwargs):
+            if name in PER_ID_ENDPOINTS:
+                return self._call_per_id(name, attribute, *args, **kwargs)
+            return self._call(name, attribute, *args, **kwargs)
+
+        return cached_call
+
+    # Hit and miss counts per endpoint, plus the overall hit rate.
+    def report(self):
+        total_hits = sum(self.hits.values())
+        total_requests = total_hits + sum(self.misses.values())
+        return {
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+            "hit_rate": total_hits / total_requests if total_requests > 0 else 0.0,
+            "size_bytes": self._total_bytes,
+        }
+
+    def close(self):
+        self._conn.close()
+
+    def _call(self, endpoint, method, *args, **kwargs):
+        cache_key = make_cache_key(endpoint, args, kwargs)
+        found, response = self._get(endpoint, cache_key)
+        self._count(endpoint, hits=1 if found else 0, misses=0 if found else 1)
+        if found:
+            return response
+
+        response = method(*args, **kwargs)
+        self._put(endpoint, {cache_key: response})
+        return response
+
+    # Serve the cached IDs from the cache and request only the missing ones, in a single call.
+    # ids: the list of IDs, always the first argument of these endpoints.
+    def _call_per_id(self, endpoint, method, ids, *args, **kwargs):
+        result_key = PER_ID_ENDPOINTS[endpoint]
+        cache_keys = [make_cache_key(endpoint, [id_, *args], kwargs) for id_ in ids]
+
+        results = {}
+        missing_ids = []
+        for id_, cache_key in zip(ids, cache_keys):
+            found, response = self._get(endpoint, cache_key)
+            if found:
+                results[cache_key] = response
+            else:
+                missing_ids.append(id_)
+
+        self._count(endpoint, hits=len(ids) - len(missing_ids), misses=len(missing_ids))
+
+        if len(missing_ids) > 0:
+            response = method(missing_ids, *args, **kwargs)
+            fetched = response if result_key is None else response[result_key]
+            fetched_by_key = {
+                make_cache_key(endpoint, [id_, *args], kwargs): item
+                for id_, item in zip(missing_ids, fetched)
+            }
+            self._put(endpoint, fetched_by_key)
+            results.update(fetched_by_key)
+
+        ordered_results = [results[cache_key] for cache_key in cache_keys]
+        return ordered_results if result_key is None else {result_key: ordered_results}
+
+    def _count(self, endpoint, hits, misses):
+        with self._lock:
+            self.hits[endpoint] += hits
+            self.misses[endpoint] += misses
+        metrics.increment("api_cache_hits", hits, endpoint=endpoint)
+        metrics.increment("api_cache_misses", misses, endpoint=endpoint)
+
+    # Returns (True, response) for a fresh entry, (False, None) for a missing or stale one.
+    def _get(self, endpoint, cache_key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM response_cache WHERE cache_key = ?",
+                (cache_key,),
+            ).fetchone()
+            if row is None or now - row[1] > self.ttls[endpoint]:
+                return False, None
+
+            self._conn.execute(
+                "UPDATE response_cache SET last_access = ? WHERE cache_key = ?",
+                (now, cache_key),
+            )
+            self._conn.commit()
+        return True, json.loads(row[0])
+
+    # responses: the responses to store, keyed by cache key.
+    def _put(self, endpoint, responses):
+        now = time.time()
+        rows = []
+        for cache_key, response in responses.items():
+            serialized = json.dumps(response)
+            rows.append((cache_key, endpoint, serialized, len(serialized), now, now))
+
+        with self._lock:
+            for row in rows:
+                replaced = self._conn.execute(
+                    "SELECT size FROM response_cache WHERE cache_key = ?", (row[0],)
+                ).fetchone()
+                if replaced is not None:
+                    self._total_bytes -= replaced[0]
+                self._total_bytes += row[3]
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    # Delete the least recently used entries until the cache fits into max_bytes.
+    # Must be called while holding the lock.
+    def _evict(self):
+        while self._total_bytes > self.max_bytes:
+            oldest = self._conn.execute(
+                """
+                SELECT cache_key, size FROM response_cache
+                ORDER BY last_access ASC
+                LIMIT 100
+            """
+            ).fetchall()
+            if len(oldest) == 0:
+                break
+
+            for cache_key, size in oldest:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                self._conn.execute(
+                    "DELETE FROM response_cache WHERE cache_key = ?", (cache_key,)
+                )
+                self._total_bytes -= size
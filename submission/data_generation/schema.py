@@ -0,0 +1,258 @@
+from data_generation.change_tracking import create_change_tracking
+from data_generation.tier_aggregates import (
+    create_tier_aggregates,
+    defer_tier_aggregates,
+)
+
+"""
+Declared schema of the four base tables: columns, primary keys, foreign keys and join indexes.
+
+Every view in view_creation/ joins artist -> album -> track -> track_feature, so each join
+column is either a primary key or the leading column of an index.
+"""
+
+# Columns of each table.
+# Following https://www.sqlite.org/datatype3.html to translate the required datatypes to sqlite3 types.
+ARTIST_DTYPE = {
+    "artist_id": "TEXT",
+    "artist_name": "TEXT",
+    "external_url": "TEXT",
+    "genre": "TEXT",
+    "image_url": "TEXT",
+    "followers": "INTEGER",
+    "popularity": "INTEGER",
+    "type": "TEXT",
+    "artist_uri": "TEXT",
+}
+
+ALBUM_DTYPE = {
+    "album_id": "TEXT",
+    "album_name": "TEXT",
+    "external_url": "TEXT",
+    "image_url": "TEXT",
+    "release_date": "TEXT",
+    "total_tracks": "INTEGER",
+    "type": "TEXT",
+    "album_uri": "TEXT",
+    "artist_id": "TEXT",
+}
+
+TRACK_DTYPE = {
+    "track_id": "TEXT",
+    "song_name": "TEXT",
+    "external_url": "TEXT",
+    "duration_ms": "INTEGER",
+    "explicit": "NUMERIC",
+    "disc_number": "INTEGER",
+    "type": "TEXT",
+    "song_uri": "TEXT",
+    "album_id": "TEXT",
+}
+
+TRACK_FEATURE_DTYPE = {
+    "track_id": "TEXT",
+    "danceability": "REAL",
+    "energy": "REAL",
+    "instrumentalness": "REAL",
+    "liveness": "REAL",
+    "loudness": "REAL",
+    "speechiness": "REAL",
+    "tempo": "REAL",
+    "type": "TEXT",
+    "valence": "REAL",
+    "song_uri": "TEXT",
+}
+
+# Tables in creation order: parents before children.
+TABLE_DTYPES = {
+    "artist": ARTIST_DTYPE,
+    "album": ALBUM_DTYPE,
+    "track": TRACK_DTYPE,
+    "track_feature": TRACK_FEATURE_DTYPE,
+}
+
+# Columns the loaders derive from the loaded ones and store after them (see derived_columns.py),
+# so the views group on stored, indexed values instead of parsing them on every query.
+DERIVED_DTYPES = {
+    "artist": {"popularity_tier": "TEXT"},
+    "album": {"release_year": "INTEGER", "release_date_precision": "TEXT"},
+    "track": {"duration_bucket": "INTEGER"},
+}
+
+PRIMARY_KEYS = {
+    "artist": "artist_id",
+    "album": "album_id",
+    "track": "track_id",
+    "track_feature": "track_id",
+}
+
+# table -> {column: (referenced table, referenced column)}
+# SQLite only enforces them with PRAGMA foreign_keys = ON. The loaders leave it off because the
+# streaming writer may flush a child chunk before its parents; use PRAGMA foreign_key_check instead.
+FOREIGN_KEYS = {
+    "album": {"artist_id": ("artist", "artist_id")},
+    "track": {"album_id": ("album", "album_id")},
+    "track_feature": {"track_id": ("track", "track_id")},
+}
+
+# Covering indexes for the join and PARTITION BY columns used by the views.
+# index name -> (table, columns). The first column is the one joined or partitioned on,
+# the others let the views read what they need without visiting the table.
+INDEXES = {
+    # Artist lookups by name, e.g. the top tracks of an artist in view_creation/rankings.py.
+    "ix_artist_artist_name": ("artist", ["artist_name", "artist_id"]),
+    # Artists of a popularity tier.
+    "ix_artist_popularity_tier": ("artist", ["popularity_tier", "artist_id"]),
+    # artist -> album joins, PARTITION BY al.artist_id in the top songs views and the
+    # grouping by year of the features over time.
+    "ix_album_artist_id": ("album", ["artist_id", "album_id", "release_year"]),
+    # album -> track joins.
+    "ix_track_album_id": (
+        "track",
+        ["album_id", "track_id", "song_name", "duration_ms"],
+    ),
+    # Tracks of a duration bucket.
+    "ix_track_duration_bucket": ("track", ["duration_bucket", "track_id"]),
+}
+
+# ----- Helper Functions -----
+
+# Build the CREATE TABLE statement of a table from its declared columns and keys.
+def build_create_table_statement(table_name, table_name_in_db=None):
+    column_definitions = []
+    for column, sqlite_type in get_stored_dtype(table_name).items():
+        definition = f"{column} {sqlite_type}"
+        if column == PRIMARY_KEYS[table_name]:
+            definition += " PRIMARY KEY"
+        column_definitions.append(definition)
+
+    for column, (parent, parent_column) in FOREIGN_KEYS.get(table_name, {}).items():
+        column_definitions.append(
+            f"FOREIGN KEY ({column}) REFERENCES {parent} ({parent_column})"
+        )
+
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table_name_in_db or table_name} (
+            {", ".join(column_definitions)}
+        )
+    """
+
+
+# Whether a table already exists in the DB, and whether it was created with its primary key.
+# Returns (exists, has_primary_key).
+def inspect_table(table_name, db_conn):
+    columns = db_conn.execute(f"PRAGMA table_info({table_name})").fetchall()
+    # The 6th field of table_info is the column's position in the primary key (0 if not part of it).
+    return len(columns) > 0, any(column[5] > 0 for column in columns)
+
+
+# Rebuild a table created without keys (e.g. by an earlier DataFrame.to_sql run) with the declared schema.
+# Rows with a duplicate key keep the first occurrence.
+def migrate_legacy_table(table_name, db_conn):
+    columns = ", ".join(TABLE_DTYPES[table_name])
+    new_table_name = f"{table_name}__new"
+
+    db_conn.execute(f"DROP TABLE IF EXISTS {new_table_name}")
+    db_conn.execute(build_create_table_statement(table_name, new_table_name))
+    db_conn.execute(
+        f"""
+        INSERT OR IGNORE INTO {new_table_name} ({columns})
+        SELECT {columns} FROM {table_name}
+    """
+    )
+    db_conn.execute(f"DROP TABLE {table_name}")
+
+    # Legacy mode keeps the views that reference the table by name untouched by the rename.
+    db_conn.execute("PRAGMA legacy_alter_table = ON")
+    db_conn.execute(f"ALTER TABLE {new_table_name} RENAME TO {table_name}")
+    db_conn.execute("PRAGMA legacy_alter_table = OFF")
+
+
+# Add the derived columns missing from a table created before they were declared.
+# Returns whether any column was added.
+def add_missing_derived_columns(table_name, db_conn):
+    existing_columns = {
+        column[1]
+        for column in db_conn.execute(f"PRAGMA table_info({table_name})").fetchall()
+    }
+    missing_columns = {
+        column: sqlite_type
+        for column, sqlite_type in DERIVED_DTYPES.get(table_name, {}).items()
+        if column not in existing_columns
+    }
+    for column, sqlite_type in missing_columns.items():
+        db_conn.execute(f"ALTER TABLE {table_name} ADD COLUMN {column} {sqlite_type}")
+    return len(missing_columns) > 0
+
+
+# The columns of an index in the DB, in order. Empty if there is no such index.
+def get_index_columns(index_name, db_conn):
+    rows = db_conn.execute(f"PRAGMA index_info({index_name})").fetchall()
+    # index_info rows are (position in the index, position in the table, column name).
+    return [row[2] for row in sorted(rows)]
+
+
+# ----- Helper Functions End -----
+
+
+# The columns stored in a table: the loaded columns, then the derived columns.
+# table_name: one of the TABLE_DTYPES tables.
+# Returns column -> sqlite3 type.
+def get_stored_dtype(table_name):
+    return {**TABLE_DTYPES[table_name], **DERIVED_DTYPES.get(table_name, {})}
+
+
+# Create the four base tables with their keys, derived columns, indexes, change tracking triggers
+# and tier aggregates. Safe to call repeatedly.
+# Tables left over from runs without a declared schema are migrated in place, tables created
+# before the derived columns get them computed for their rows, and indexes declared with other
+# columns than in the DB are created again.
+# db_conn: a database connection.
+def create_schema(db_conn):
+    tables_to_derive = []
+    with db_conn:
+        for table_name in TABLE_DTYPES:
+            exists, has_primary_key = inspect_table(table_name, db_conn)
+            if exists and not has_primary_key:
+                migrate_legacy_table(table_name, db_conn)
+                tables_to_derive.append(table_name)
+            else:
+                db_conn.execute(build_create_table_statement(table_name))
+                if add_missing_derived_columns(table_name, db_conn):
+                    tables_to_derive.append(table_name)
+
+        for index_name, (table_name, columns) in INDEXES.items():
+            if get_index_columns(index_name, db_conn) not in ([], columns):
+                db_conn.execute(f"DROP INDEX {index_name}")
+            db_conn.execute(
+                f"""
+                CREATE INDEX IF NOT EXISTS {index_name}
+                ON {table_name} ({", ".join(columns)})
+            """
+            )
+
+    create_change_tracking(db_conn)
+    create_tier_aggregates(db_conn)
+
+    tables_to_derive = [t for t in tables_to_derive if t in DERIVED_DTYPES]
+    if len(tables_to_derive) > 0:
+        # Imported here, since it needs pandas and this module is used by the views command.
+        from data_generation.derived_columns import refresh_derived_columns
+
+        # The tier aggregates read the popularity tiers, rebuild them once afterwards.
+        with defer_tier_aggregates(db_conn):
+            for table_name in tables_to_derive:
+                num_rows = refresh_derived_columns(db_conn, table_name)
+                print(f"Derived the new columns of {num_rows} {table_name} rows")
+
+
+# Get a table ready for loading: when replacing, empty the table.
+# Emptying instead of dropping keeps the keys, indexes and anything defined on top of the table.
+# The schema must exist: call create_schema once at the start of the load run.
+# table_name: the table about to be loaded.
+# db_conn: a database connection.
+# if_exists: "replace", "append" or "upsert".
+def prepare_table_for_load(table_name, db_conn, if_exists):
+    if if_exists == "replace":
+        with db_conn:
+            db_conn.execute(f"DELETE FROM {table_name}")
@@ -0,0 +1,62 @@
+from data_generation.concurrent_fetch import map_concurrently
+from data_generation.artists_generation import fetch_artist
+
+"""
+Persistent mapping from the seed artist names to their Spotify artist IDs.
+
+Searching is the only way to turn a name into an ID, and search has no batch endpoint.
+Each seed is searched once, after which its artist is refreshed through the artists
+batch endpoint by ID.
+"""
+
+
+# Create the seed_artist table. Safe to call repeatedly.
+# artist_id is NULL for seeds the search found no artist for. Delete their rows to search them again.
+# db_conn: a database connection.
+def create_seed_mapping(db_conn):
+    with db_conn:
+        db_conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS seed_artist (
+                seed_name TEXT PRIMARY KEY,
+                artist_id TEXT
+            )
+        """
+        )
+
+
+# Map the seed names to artist IDs, searching only the seeds that were never resolved.
+# artist_names: the seed artist names.
+# spotify: an object created after connecting to Spotipy library.
+# db_conn: a database connection.
+# max_workers: number of concurrent search calls.
+# Returns a list of (artist_name, artist_id) in the same order as artist_names.
+# artist_id is None if no artist was found.
+def resolve_seed_artist_ids(artist_names, spotify, db_conn, max_workers=1):
+    create_seed_mapping(db_conn)
+    artist_ids = dict(db_conn.execute("SELECT seed_name, artist_id FROM seed_artist"))
+
+    unresolved_names = [
+        artist_name
+        for artist_name in dict.fromkeys(artist_names)
+        if artist_name not in artist_ids
+    ]
+    fetched_artists = map_concurrently(
+        lambda artist_name: fetch_artist(artist_name, spotify),
+        unresolved_names,
+        max_workers,
+    )
+    new_mappings = [
+        (artist_name, None if artist is None else artist.artist_id)
+        for artist_name, artist in zip(unresolved_names, fetched_artists)
+    ]
+
+    with db_conn:
+        db_conn.executemany(
+            "INSERT OR REPLACE INTO seed_artist (seed_name, artist_id) VALUES (?, ?)",
+            new_mappings,
+        )
+    artist_ids.update(new_mappings)
+    print("seeds resolved by search: ", len(new_mappings))
+
+    return [(artist_name, artist_ids[artist_name]) for artist_name in artist_names]
@@ -0,0 +1,53 @@
+from instrumentation.run_metrics import metrics
+from data_generation.streaming_pipeline import load_records
+from data_generation.artists_generation import fetch_artists
+from data_generation.albums_generation import fetch_albums_for_all_artists
+from data_generation.tracks_generation import fetch_tracks_for_all_albums
+from data_generation.track_features_generation import fetch_features_for_all_tracks
+
+"""
+The stage-by-stage ingestion: every dataset is fetched in full before any is loaded.
+"""
+
+
+# Fetch every dataset in full, then load them all into the DB.
+# artist_names: the list of artist names we use to look for the artists from Spotify.
+# spotify: an object created after connecting to Spotipy library.
+# db_conn: a database connection.
+# max_workers: number of concurrent Spotify API calls.
+# if_exists: "replace" rewrites the tables, "upsert" only writes new and changed rows.
+# bulk: write with the plain sqlite3 bulk loader instead of DataFrame.to_sql.
+def run_stage_by_stage(artist_names, spotify, db_conn, max_workers, if_exists, bulk):
+    # ----- Step 1: Create the datasets -----
+    # Fetch the unique artists.
+    with metrics.stage("fetch_artists"):
+        artists = fetch_artists(artist_names, spotify, max_workers)
+    print("artists_size: ", len(artists))
+
+    # Fetch the unique albums (in terms of album name).
+    with metrics.stage("fetch_albums"):
+        albums = fetch_albums_for_all_artists(artists, spotify, max_workers)
+    print("albums_size: ", len(albums))
+
+    # Fetch the unique tracks (in terms of song name).
+    with metrics.stage("fetch_tracks"):
+        tracks = fetch_tracks_for_all_albums(albums, spotify, max_workers)
+    print("tracks_size: ", len(tracks))
+
+    # Fetch the track features.
+    with metrics.stage("fetch_track_features"):
+        track_features = fetch_features_for_all_tracks(tracks, spotify, max_workers)
+    print("track_features_size: ", len(track_features))
+
+    print("All datasets are ready to be imported into db!!!")
+
+    # ----- Step 2: Write the datasets to DB -----
+    datasets = {
+        "artist": artists,
+        "album": albums,
+        "track": tracks,
+        "track_feature": track_features,
+    }
+    for table_name, records in datasets.items():
+        with metrics.stage(f"load_{table_name}"):
+            load_records(table_name, records, db_conn, if_exists, bulk)
@@ -0,0 +1,585 @@
+import queue
+import threading
+import time
+from instrumentation.run_metrics import metrics
+from data_generation.concurrent_fetch import imap_concurrently
+from data_generation.artists_generation import (
+    fetch_artist,
+    fetch_artists_batch,
+    load_artists_to_db,
+)
+from data_generation.albums_generation import (
+    deduplicate_albums,
+    fetch_albums_by_artist,
+    load_albums_to_db,
+)
+from data_generation.tracks_generation import (
+    deduplicate_tracks,
+    fetch_tracks_by_album,
+    fetch_tracks_for_albums_batch,
+    load_tracks_to_db,
+)
+from data_generation.track_features_generation import (
+    fetch_features_for_tracks_batch,
+    load_tracks_features_to_db,
+)
+from data_generation.checkpoint import list_written_rows, record_journal_entries
+from data_generation.schema import prepare_table_for_load
+from data_generation.change_detection import is_album_unchanged
+from data_generation.seed_mapping import resolve_seed_artist_ids
+
+"""
+Streaming ingestion: generator stages joined by bounded queues.
+
+Every stage consumes a stream of (table_name, records) events, passes them through unchanged
+and adds the events it derives from them:
+
+    artists -> albums -> tracks -> track features -> DB writer
+
+Each stage runs in its own thread, so tracks for album N are fetched while the features of
+album N-1 are requested and earlier rows are written to the DB in chunks. Only the queues,
+the current chunk per table and the names used for deduplication are held in memory.
+"""
+
+# The loader used for each table, in the order the tables are created.
+LOADERS = {
+    "artist": load_artists_to_db,
+    "album": load_albums_to_db,
+    "track": load_tracks_to_db,
+    "track_feature": load_tracks_features_to_db,
+}
+
+# Marks the end of a stream passed through a queue.
+_END_OF_STREAM = object()
+
+# ----- Helper Functions -----
+
+# Run a generator in a background thread and yield its items through a bounded queue.
+# The producer blocks once max_buffered items are waiting, which keeps memory flat when
+# a downstream stage is slower than its upstream stage.
+# Errors raised by the generator are raised again in the consuming thread.
+# events: the generator to run.
+# max_buffered: maximum number of items waiting in the queue.
+def run_in_background(events, max_buffered):
+    buffer = queue.Queue(maxsize=max_buffered)
+    errors = []
+
+    def produce():
+        try:
+            for event in events:
+                buffer.put(event)
+        except BaseException as error:
+            errors.append(error)
+        finally:
+            buffer.put(_END_OF_STREAM)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    while True:
+        event = buffer.get()
+        if event is _END_OF_STREAM:
+            break
+        yield event
+
+    producer.join()
+    if errors:
+        raise errors[0]
+
+
+# ----- Helper Functions End -----
+
+
+# Load records into their table with the table's loader, recording the rows written and the
+# time spent writing them.
+# table_name: one of the LOADERS tables.
+# records: the records to load.
+# db_conn: a database connection.
+# if_exists: "replace", "append" or "upsert".
+# bulk: write with the plain sqlite3 bulk loader instead of DataFrame.to_sql.
+def load_records(table_name, records, db_conn, if_exists="replace", bulk=False):
+    with metrics.timer("db_write_seconds", table=table_name):
+        LOADERS[table_name](records, db_conn, if_exists=if_exists, bulk=bulk)
+    metrics.increment("rows_written", len(records), table=table_name)
+
+
+# Stream the unique artists (by ID) found for the given artist names.
+# A ("journal", [("seed", name)]) event follows each name once its artist has been emitted.
+# artist_names: the list of artist names we use to look for the artists from Spotify.
+# spotify: an object created after connecting to Spotipy library.
+# max_workers: number of concurrent API calls.
+# resume_state: state returned by checkpoint.load_resume_state when resuming a run, else None.
+def stream_artists(artist_names, spotify, max_workers=1, resume_state=None):
+    visited_ids = set()
+    if resume_state is not None:
+        visited_ids = resume_state["visited_artist_ids"]
+        artist_names = [
+            artist_name
+            for artist_name in artist_names
+            if artist_name not in resume_state["done_seeds"]
+        ]
+
+    fetched_artists = imap_concurrently(
+        lambda artist_name: (artist_name, fetch_artist(artist_name, spotify)),
+        artist_names,
+        max_workers,
+    )
+
+    for artist_name, artist in fetched_artists:
+        if artist is not None:
+            metrics.increment("rows_fetched", table="artist")
+            if artist.artist_id in visited_ids:
+                metrics.increment("rows_deduplicated", table="artist")
+            else:
+                visited_ids.add(artist.artist_id)
+                yield ("artist", [artist])
+        yield ("journal", [("seed", artist_name)])
+
+
+# Stream the unique artists (by ID) of seeds already resolved to artist IDs, fetching 50 artists
+# per call to the artists endpoint.
+# A ("journal", [("seed", name), ...]) event follows the artists of each batch.
+# seed_artist_ids: list of (artist_name, artist_id) returned by seed_mapping.resolve_seed_artist_ids.
+# spotify: an object created after connecting to Spotipy library.
+# max_workers: number of concurrent API calls.
+# resume_state: state returned by checkpoint.load_resume_state when resuming a run, else None.
+def stream_artists_by_id(seed_artist_ids, spotify, max_workers=1, resume_state=None):
+    visited_ids = set()
+    if resume_state is not None:
+        visited_ids = resume_state["visited_artist_ids"]
+        seed_artist_ids = [
+            (artist_name, artist_id)
+            for artist_name, artist_id in seed_artist_ids
+            if artist_name not in resume_state["done_seeds"]
+        ]
+
+    # Group the new artist IDs into batches of 50, the most spotipy.artists supports per call.
+    # Each batch carries the seeds it covers, including seeds without a new artist.
+    def work_items():
+        seeds_batch = []
+        artist_ids_batch = []
+        for artist_name, artist_id in seed_artist_ids:
+            seeds_batch.append(artist_name)
+            if artist_id is not None and artist_id in visited_ids:
+                metrics.increment("rows_deduplicated", table="artist")
+            elif artist_id is not None:
+                visited_ids.add(artist_id)
+                artist_ids_batch.append(artist_id)
+            if len(artist_ids_batch) == 50:
+                yield seeds_batch, artist_ids_batch
+                seeds_batch = []
+                artist_ids_batch = []
+
+        if len(seeds_batch) > 0:
+            yield seeds_batch, artist_ids_batch
+
+    def fetch_artists_for_item(item):
+        seeds_batch, artist_ids_batch = item
+        if len(artist_ids_batch) == 0:
+            return seeds_batch, []
+        return seeds_batch, fetch_artists_batch(artist_ids_batch, spotify)
+
+    for seeds_batch, artists in imap_concurrently(
+        fetch_artists_for_item, work_items(), max_workers
+    ):
+        # One event per artist, so the next stage fetches their albums concurrently.
+        for artist in artists:
+            if artist is not None:
+                metrics.increment("rows_fetched", table="artist")
+                yield ("artist", [artist])
+        yield ("journal", [("seed", artist_name) for artist_name in seeds_batch])
+
+
+# Pass the events through and add the unique albums (by name) of every artist event.
+# A ("journal", [("artist", artist_id)]) event follows the albums of each artist.
+# events: the upstream stream of (table_name, records) events.
+# spotify: an object created after connecting to Spotipy library.
+# max_workers: number of concurrent API calls.
+# resume_state: state returned by checkpoint.load_resume_state when resuming a run, else None.
+def stream_albums(events, spotify, max_workers=1, resume_state=None):
+    visited_names = set()
+    pending_artists = []
+    if resume_state is not None:
+        visited_names = resume_state["visited_album_names"]
+        pending_artists = resume_state["pending_artists"]
+
+    # Artists written by an earlier run whose albums are unfinished come first.
+    # They are already in the DB, so they are not passed downstream again.
+    def work_items():
+        for artist in pending_artists:
+            yield ("pending_artist", [artist])
+        yield from events
+
+    def fetch_albums_for_event(event):
+        table_name, records = event
+        if table_name not in ("artist", "pending_artist"):
+            return event, []
+        return event, [
+            album
+            for artist in records
+            for album in fetch_albums_by_artist(artist, spotify)
+        ]
+
+    for event, albums in imap_concurrently(
+        fetch_albums_for_event, work_items(), max_workers
+    ):
+        table_name, records = event
+        if table_name != "pending_artist":
+            yield event
+
+        unique_albums = deduplicate_albums(albums, visited_names)
+        if len(unique_albums) > 0:
+            yield ("album", unique_albums)
+        if table_name in ("artist", "pending_artist"):
+            yield ("journal", [("artist", artist.artist_id) for artist in records])
+
+
+# Pass the events through and add the unique tracks (by song name) of every album event.
+# A ("journal", [("album", album_id)]) event follows the tracks of each album.
+# events: the upstream stream of (table_name, records) events.
+# spotify: an object created after connecting to Spotipy library.
+# max_workers: number of concurrent API calls.
+# resume_state: state returned by checkpoint.load_resume_state when resuming a run, else None.
+# stored_state: state returned by change_detection.load_stored_state to skip the albums stored
+# unchanged, else None.
+# batch_endpoints: fetch the tracks of 20 albums per call to the albums endpoint instead of
+# one album_tracks call per album.
+def stream_tracks(
+    events,
+    spotify,
+    max_workers=1,
+    resume_state=None,
+    stored_state=None,
+    batch_endpoints=False,
+):
+    visited_names = set()
+    pending_albums = []
+    if resume_state is not None:
+        visited_names = resume_state["visited_song_names"]
+        pending_albums = resume_state["pending_albums"]
+    pending_album_ids = {album.album_id for album in pending_albums}
+    albums_per_call = 20 if batch_endpoints else 1
+    num_skipped_albums = 0
+
+    # An album stored unchanged is not fetched again.
+    def is_skipped(album):
+        return (
+            stored_state is not None
+            and album.album_id not in pending_album_ids
+            and is_album_unchanged(album, stored_state)
+        )
+
+    # Group the albums of the album events into work items of albums_per_call albums to fetch,
+    # so the calls run concurrently. Skipped albums ride along in the batches to keep the order
+    # in which tracks are deduplicated.
+    # Albums written by an earlier run whose tracks are unfinished come first.
+    def work_items():
+        albums_batch = []
+        num_fetched = 0
+
+        def add_albums(albums):
+            nonlocal albums_batch, num_fetched
+            for album in albums:
+                albums_batch.append(album)
+                if not is_skipped(album):
+                    num_fetched += 1
+                if num_fetched == albums_per_call:
+                    yield None, albums_batch
+                    albums_batch = []
+                    num_fetched = 0
+
+        yield from add_albums(pending_albums)
+        for event in events:
+            yield event, None
+            if event[0] == "album":
+                yield from add_albums(event[1])
+
+        if len(albums_batch) > 0:
+            yield None, albums_batch
+
+    # Returns the tracks of each album of the batch, None for a skipped album.
+    def fetch_tracks_for_item(item):
+        event, albums_batch = item
+        if albums_batch is None:
+            return event, [], []
+
+        album_ids = [album.album_id for album in albums_batch if not is_skipped(album)]
+        if batch_endpoints and len(album_ids) > 0:
+            fetched_tracks = fetch_tracks_for_albums_batch(album_ids, spotify)
+        else:
+            fetched_tracks = [
+                fetch_tracks_by_album(album_id, spotify) for album_id in album_ids
+            ]
+        tracks_by_album_id = dict(zip(album_ids, fetched_tracks))
+
+        return (
+            None,
+            albums_batch,
+            [tracks_by_album_id.get(album.album_id) for album in albums_batch],
+        )
+
+    for event, albums_batch, tracks_per_album in imap_concurrently(
+        fetch_tracks_for_item, work_items(), max_workers
+    ):
+        if event is not None:
+            yield event
+
+        for album, tracks in zip(albums_batch, tracks_per_album):
+            if tracks is None:
+                # Its stored tracks still take part in deduplicating the tracks of later albums.
+                num_skipped_albums += 1
+                visited_names.update(
+                    stored_state["song_names_by_album"].get(album.album_id, [])
+                )
+            else:
+                unique_tracks = deduplicate_tracks(tracks, visited_names)
+                if len(unique_tracks) > 0:
+                    yield ("track", unique_tracks)
+            yield ("journal", [("album", album.album_id)])
+
+    if stored_state is not None:
+        print("unchanged albums skipped: ", num_skipped_albums)
+
+
+# Pass the events through and add the features of the tracks, requested 100 track IDs at a time.
+# A ("journal", [("track_features", track_id), ...]) event follows the features of each batch.
+# events: the upstream stream of (table_name, records) events.
+# spotify: an object created after connecting to Spotipy library.
+# max_workers: number of concurrent API calls.
+# resume_state: state returned by checkpoint.load_resume_state when resuming a run, else None.
+# stored_state: state returned by change_detection.load_stored_state to skip the tracks whose
+# features are stored, else None.
+def stream_track_features(
+    events, spotify, max_workers=1, resume_state=None, stored_state=None
+):
+    pending_tracks = []
+    if resume_state is not None:
+        pending_tracks = resume_state["pending_tracks"]
+    featured_track_ids = set()
+    if stored_state is not None:
+        featured_track_ids = stored_state["featured_track_ids"]
+
+    # Group track IDs into batches of 100, the most spotipy.audio_features supports per call.
+    # Tracks written by an earlier run whose features are unfinished come first.
+    # Tracks whose features are stored are only journaled.
+    def work_items():
+        track_ids_batch = []
+
+        def add_tracks(tracks):
+            nonlocal track_ids_batch
+            for track in tracks:
+                if track.track_id in featured_track_ids:
+                    yield ("journal", [("track_features", track.track_id)]), None
+                    continue
+                track_ids_batch.append(track.track_id)
+                if len(track_ids_batch) == 100:
+                    yield None, track_ids_batch
+                    track_ids_batch = []
+
+        yield from add_tracks(pending_tracks)
+        for event in events:
+            yield event, None
+            if event[0] == "track":
+                yield from add_tracks(event[1])
+
+        if len(track_ids_batch) > 0:
+            yield None, track_ids_batch
+
+    def fetch_features_for_item(item):
+        event, track_ids_batch = item
+        if track_ids_batch is None:
+            return event, None, []
+        return (
+            None,
+            track_ids_batch,
+            fetch_features_for_tracks_batch(track_ids_batch, spotify),
+        )
+
+    for event, track_ids_batch, track_features in imap_concurrently(
+        fetch_features_for_item, work_items(), max_workers
+    ):
+        if event is not None:
+            yield event
+        if len(track_features) > 0:
+            yield ("track_feature", track_features)
+        if track_ids_batch is not None:
+            yield (
+                "journal",
+                [("track_features", track_id) for track_id in track_ids_batch],
+            )
+
+
+# Write the records of the events into the DB in chunks.
+# Buffered records are written once chunk_size of them are waiting in a table, or once they have
+# waited flush_interval seconds, so the first rows land in the DB early in the run.
+# All tables are flushed together, then the journal entries received so far are recorded, so the
+# journal never covers rows that are not written yet. If the run is interrupted (error upstream,
+# Ctrl+C, kill signal), everything received so far is flushed before the error is raised again.
+# A chunk whose load raised is not loaded again, and the journal entries are then no longer
+# recorded, since that chunk may or may not have been written.
+# events: the stream of (table_name, records) events.
+# db_conn: a database connection.
+# chunk_size: number of records per write.
+# flush_interval: maximum seconds records are buffered before being written.
+# if_exists: "replace" replaces each table with its first chunk and appends the following chunks,
+# "upsert" upserts every chunk into the existing tables.
+# bulk: write with the plain sqlite3 bulk loader instead of DataFrame.to_sql.
+# Returns the number of records written per table.
+def write_stream_to_db(
+    events,
+    db_conn,
+    chunk_size=5000,
+    flush_interval=5.0,
+    if_exists="replace",
+    bulk=False,
+):
+    buffers = {table_name: [] for table_name in LOADERS}
+    rows_written = {table_name: 0 for table_name in LOADERS}
+    journal_entries = []
+    buffered_since = None
+    load_failed = False
+
+    # Every table is emptied before the first chunk, rather than by its own first chunk, so a run
+    # stopped before writing a table never leaves the previous run's rows in it.
+    chunk_if_exists = if_exists
+    if if_exists == "replace":
+        for table_name in LOADERS:
+            prepare_table_for_load(table_name, db_conn, "replace")
+        chunk_if_exists = "append"
+
+    def flush():
+        nonlocal journal_entries, buffered_since, load_failed
+        written_rows = []
+        try:
+            for table_name in buffers:
+                records = buffers[table_name]
+                if len(records) == 0:
+                    continue
+                # Taken out of the buffer and counted before loading, so a failed load is never
+                # retried.
+                buffers[table_name] = []
+                rows_written[table_name] += len(records)
+                try:
+                    load_records(table_name, records, db_conn, chunk_if_exists, bulk)
+                except BaseException:
+                    load_failed = True
+                    raise
+                written_rows.extend(list_written_rows(table_name, records))
+        finally:
+            # The rows of the loads that went through are journaled even if a later one failed,
+            # the progress entries only while every load succeeded.
+            if not load_failed:
+                written_rows.extend(journal_entries)
+                journal_entries = []
+            if len(written_rows) > 0:
+                record_journal_entries(db_conn, written_rows)
+        buffered_since = None
+
+    try:
+        for table_name, records in events:
+            if table_name == "journal":
+                journal_entries.extend(records)
+            else:
+                buffers[table_name].extend(records)
+            if buffered_since is None:
+                buffered_since = time.monotonic()
+
+            if (
+                any(len(records) >= chunk_size for records in buffers.values())
+                or time.monotonic() - buffered_since >= flush_interval
+            ):
+                flush()
+    except BaseException:
+        # Each failed load takes its chunk out of the buffers, so this ends. The error raised is
+        # the one that interrupted the run, not the one of a flush.
+        pending = True
+        while pending:
+            try:
+                flush()
+                pending = False
+            except BaseException:
+                pending = any(len(records) > 0 for records in buffers.values())
+        raise
+
+    flush()
+    return rows_written
+
+
+# Fetch and load all datasets as one pipeline: artists -> albums -> tracks -> features -> DB.
+# artist_names: the list of artist names we use to look for the artists from Spotify.
+# spotify: an object created after connecting to Spotipy library.
+# db_conn: a database connection.
+# max_workers: number of concurrent API calls per stage.
+# queue_size: maximum number of events buffered between two stages.
+# chunk_size: number of records per DB write.
+# if_exists: "replace" rewrites the tables, "upsert" only writes new and changed rows.
+# bulk: write with the plain sqlite3 bulk loader instead of DataFrame.to_sql.
+# resume_state: state returned by checkpoint.load_resume_state to carry on an interrupted run.
+# stored_state: state returned by change_detection.load_stored_state to only fetch the tracks of
+# new or changed albums and the features of new tracks.
+# batch_endpoints: minimize round trips. Seeds are searched once and mapped to artist IDs in the DB,
+# then artists are fetched 50 per call and album tracks 20 albums per call.
+# Returns the number of records written per table.
+def run_streaming_ingestion(
+    artist_names,
+    spotify,
+    db_conn,
+    max_workers=1,
+    queue_size=100,
+    chunk_size=5000,
+    if_exists="replace",
+    bulk=False,
+    resume_state=None,
+    stored_state=None,
+    batch_endpoints=False,
+):
+    if batch_endpoints:
+        # Resolved up front, since the mapping lives in the DB owned by this thread.
+        seed_artist_ids = resolve_seed_artist_ids(
+            artist_names, spotify, db_conn, max_workers
+        )
+        artists = stream_artists_by_id(
+            seed_artist_ids, spotify, max_workers, resume_state
+        )
+    else:
+        artists = stream_artists(artist_names, spotify, max_workers, resume_state)
+
+    # Each stage is timed in its own thread, from its first event to its last.
+    events = run_in_background(
+        metrics.timed_events("stream_artists", artists), queue_size
+    )
+    events = run_in_background(
+        metrics.timed_events(
+            "stream_albums", stream_albums(events, spotify, max_workers, resume_state)
+        ),
+        queue_size,
+    )
+    events = run_in_background(
+        metrics.timed_events(
+            "stream_tracks",
+            stream_tracks(
+                events,
+                spotify,
+                max_workers,
+                resume_state,
+                stored_state,
+                batch_endpoints,
+            ),
+        ),
+        queue_size,
+    )
+    events = run_in_background(
+        metrics.timed_events(
+            "stream_track_features",
+            stream_track_features(
+                events, spotify, max_workers, resume_state, stored_state
+            ),
+        ),
+        queue_size,
+    )
+
+    # The writer runs in the calling thread, which owns the DB connection.
+    with metrics.stage("write_stream_to_db"):
+        return write_stream_to_db(
+            events, db_conn, chunk_size, if_exists=if_exists, bulk=bulk
+        )
@@ -0,0 +1,477 @@
+from contextlib import contextmanager
+from instrumentation.run_metrics import metrics
+from data_generation.change_tracking import get_load_generation
+
+"""
+Aggregates of the track features per artist popularity tier, maintained by triggers.
+
+v_features_per_popularity_group reads these tables instead of joining the four base tables,
+so it costs O(number of tiers) whatever the catalog size.
+
+    popularity_tier  tier -> lowest artist popularity in it, its position and plot label.
+                     The last tier (min_popularity NULL) holds everything below the others.
+                     The loaders store the tier of each artist in artist.popularity_tier.
+    tier_track       track_id -> the row the track contributes to its tier: the tier of its
+                     artist, the artist, album and song names, its features and the artist's
+                     ID. A track is in it when it has features, an album and an artist with a
+                     tier.
+    tier_member      (tier, kind, name) -> number of tier_track rows with that artist, album
+                     or song name, i.e. the distinct names of a tier with a reference count.
+    tier_aggregate   tier -> number of rows, distinct artist, album and song names, and the
+                     sum and non NULL count of each feature.
+
+Triggers on the base tables recompute the tier_track rows of the tracks a changed row
+reaches (e.g. every track of an artist whose popularity tier changed). Triggers on tier_track
+add its inserted rows to tier_member and tier_aggregate, and take its deleted rows out.
+The tiers come from set_popularity_tiers, which stores the new tier of every artist and
+rebuilds everything when they change.
+
+A load would pay for the triggers on every row it writes. Every load runs under
+defer_tier_aggregates instead, which drops the base table triggers and, once the load is over,
+rebuilds the aggregates in bulk after a load rewriting every table, or else recomputes the
+tier_track rows of the artists the change tracking stamped during the load.
+"""
+
+# Default tier boundaries: artists with popularity >= 95 are tier_1, >= 90 tier_2, and so on.
+DEFAULT_POPULARITY_TIERS = [95, 90, 85, 80]
+
+# Features averaged per tier.
+AGGREGATED_FEATURES = [
+    "energy",
+    "danceability",
+    "instrumentalness",
+    "liveness",
+    "valence",
+]
+
+# Member kind -> the tier_track column counted distinct and its tier_aggregate count column.
+MEMBER_KINDS = {
+    "artist": ("artist_name", "num_artists"),
+    "album": ("album_name", "num_albums"),
+    "song": ("song_name", "num_songs"),
+}
+
+# How to find the tracks whose tier_track row depends on a row of each table, given the row
+# alias (NEW or OLD).
+TRACK_ID_LOOKUPS = {
+    "artist": """
+        SELECT t.track_id
+        FROM album AS al INNER JOIN track AS t ON (al.album_id = t.album_id)
+        WHERE al.artist_id = {row}.artist_id
+    """,
+    "album": "SELECT track_id FROM track WHERE album_id = {row}.album_id",
+    "track": "SELECT {row}.track_id",
+    "track_feature": "SELECT {row}.track_id",
+}
+
+# Columns of each table the tier_track rows are built from. Updates of other columns don't
+# fire the triggers.
+TRACKED_COLUMNS = {
+    "artist": ["artist_id", "artist_name", "popularity_tier"],
+    "album": ["album_id", "album_name", "artist_id"],
+    "track": ["track_id", "song_name", "album_id"],
+    "track_feature": ["track_id", *AGGREGATED_FEATURES],
+}
+
+# Condition of the base table triggers: the maintenance is not deferred.
+MAINTENANCE_ON = "NOT (SELECT deferred FROM tier_aggregate_state)"
+
+# ----- Helper Functions -----
+
+# Build the SELECT of the tier_track rows, optionally for the tracks or the artists of a
+# subquery only.
+def build_tier_track_query(track_id_filter=None, artist_id_filter=None):
+    track_filter = (
+        f"AND tf.track_id IN ({track_id_filter})" if track_id_filter is not None else ""
+    )
+    artist_filter = (
+        f"AND a.artist_id IN ({artist_id_filter})"
+        if artist_id_filter is not None
+        else ""
+    )
+    return f"""
+        SELECT
+            tf.track_id,
+            a.popularity_tier,
+            a.artist_name,
+            al.album_name,
+            t.song_name,
+            {", ".join(f"tf.{feature}" for feature in AGGREGATED_FEATURES)},
+            a.artist_id
+        FROM track_feature AS tf
+            INNER JOIN track AS t ON (tf.track_id = t.track_id)
+            INNER JOIN album AS al ON (t.album_id = al.album_id)
+            INNER JOIN artist AS a ON (al.artist_id = a.artist_id)
+        -- Artists are only left without a tier while their derived columns are computed.
+        WHERE a.popularity_tier IS NOT NULL
+        {track_filter}
+        {artist_filter}
+    """
+
+
+def create_tables(db_conn):
+    db_conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tier_aggregate_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            deferred INTEGER NOT NULL
+        )
+    """
+    )
+    db_conn.execute(
+        "INSERT OR IGNORE INTO tier_aggregate_state (id, deferred) VALUES (1, 0)"
+    )
+    db_conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS popularity_tier (
+            tier TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+            min_popularity INTEGER,
+            label TEXT NOT NULL
+        )
+    """
+    )
+    db_conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS tier_track (
+            track_id TEXT PRIMARY KEY,
+            tier TEXT,
+            artist_name TEXT,
+            album_name TEXT,
+            song_name TEXT,
+            {", ".join(f"{feature} REAL" for feature in AGGREGATED_FEATURES)},
+            artist_id TEXT
+        )
+    """
+    )
+    db_conn.execute(
+        "CREATE INDEX IF NOT EXISTS ix_tier_track_artist_id ON tier_track (artist_id)"
+    )
+    db_conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tier_member (
+            tier TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            name TEXT NOT NULL,
+            refcount INTEGER NOT NULL,
+            PRIMARY KEY (tier, kind, name)
+        ) WITHOUT ROWID
+    """
+    )
+    count_columns = [count_column for _, count_column in MEMBER_KINDS.values()]
+    feature_columns = [
+        f"sum_{feature} REAL NOT NULL, count_{feature} INTEGER NOT NULL"
+        for feature in AGGREGATED_FEATURES
+    ]
+    db_conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS tier_aggregate (
+            tier TEXT PRIMARY KEY,
+            num_rows INTEGER NOT NULL,
+            {", ".join(f"{column} INTEGER NOT NULL" for column in count_columns)},
+            {", ".join(feature_columns)}
+        )
+    """
+    )
+
+
+# Build the statements adding (sign 1) or taking out (sign -1) a tier_track row, given its
+# alias (NEW or OLD), to tier_member and tier_aggregate.
+def build_tier_track_statements(row, sign):
+    feature_updates = []
+    for feature in AGGREGATED_FEATURES:
+        value = f"{row}.{feature}"
+        new_count = f"count_{feature} + {sign} * ({value} IS NOT NULL)"
+        # An empty sum is reset to 0, so deletes don't leave rounding errors behind.
+        feature_updates.append(
+            f"sum_{feature} = CASE WHEN {new_count} = 0 THEN 0 "
+            f"ELSE sum_{feature} + {sign} * COALESCE({value}, 0) END"
+        )
+        feature_updates.append(f"count_{feature} = {new_count}")
+    statements = [
+        f"""
+        UPDATE tier_aggregate
+        SET num_rows = num_rows + {sign}, {", ".join(feature_updates)}
+        WHERE tier = {row}.tier;
+    """
+    ]
+
+    for kind, (name_column, count_column) in MEMBER_KINDS.items():
+        member = f"tier = {row}.tier AND kind = '{kind}' AND name = {row}.{name_column}"
+        if sign > 0:
+            # A name new to the tier adds one distinct member.
+            statements.append(
+                f"""
+                UPDATE tier_aggregate SET {count_column} = {count_column} + 1
+                WHERE tier = {row}.tier
+                    AND {row}.{name_column} IS NOT NULL
+                    AND NOT EXISTS (SELECT 1 FROM tier_member WHERE {member});
+                INSERT INTO tier_member (tier, kind, name, refcount)
+                SELECT {row}.tier, '{kind}', {row}.{name_column}, 1
+                WHERE {row}.{name_column} IS NOT NULL
+                ON CONFLICT (tier, kind, name) DO UPDATE SET refcount = refcount + 1;
+            """
+            )
+        else:
+            # A name no longer referenced leaves the tier.
+            statements.append(
+                f"""
+                UPDATE tier_member SET refcount = refcount - 1 WHERE {member};
+                UPDATE tier_aggregate SET {count_column} = {count_column} - 1
+                WHERE tier = {row}.tier
+                    AND EXISTS (SELECT 1 FROM tier_member WHERE {member} AND refcount = 0);
+                DELETE FROM tier_member WHERE {member} AND refcount = 0;
+            """
+            )
+    return "".join(statements)
+
+
+# tier_track rows are only inserted and deleted, never updated.
+def create_tier_track_triggers(db_conn):
+    for event, row, sign in [("INSERT", "NEW", 1), ("DELETE", "OLD", -1)]:
+        db_conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS tr_tier_track_{event.lower()}
+            AFTER {event} ON tier_track
+            BEGIN
+                {build_tier_track_statements(row, sign)}
+            END
+        """
+        )
+
+
+def drop_tier_track_triggers(db_conn):
+    for event in ["insert", "delete"]:
+        db_conn.execute(f"DROP TRIGGER IF EXISTS tr_tier_track_{event}")
+
+
+# Create the insert, update and delete triggers of a base table, recomputing the tier_track
+# rows of the tracks the changed row reaches.
+def create_base_table_triggers(table_name, db_conn):
+    lookup = TRACK_ID_LOOKUPS[table_name]
+    track_ids_per_event = {
+        "INSERT": lookup.format(row="NEW"),
+        # An update may move tracks to another artist or album, recompute both sides.
+        f"UPDATE OF {', '.join(TRACKED_COLUMNS[table_name])}": (
+            f"{lookup.format(row='OLD')} UNION {lookup.format(row='NEW')}"
+        ),
+        "DELETE": lookup.format(row="OLD"),
+    }
+
+    for event, track_ids in track_ids_per_event.items():
+        db_conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS tr_{table_name}_{event.split()[0].lower()}_tier
+            AFTER {event} ON {table_name}
+            WHEN {MAINTENANCE_ON}
+            BEGIN
+                DELETE FROM tier_track WHERE track_id IN ({track_ids});
+                INSERT INTO tier_track {build_tier_track_query(track_ids)};
+            END
+        """
+        )
+
+
+def drop_base_table_triggers(db_conn):
+    for table_name in TRACK_ID_LOOKUPS:
+        for event in ["insert", "update", "delete"]:
+            db_conn.execute(f"DROP TRIGGER IF EXISTS tr_{table_name}_{event}_tier")
+
+
+# Recompute the tier_track rows of the artists changed since a generation, included. The
+# tier_track triggers carry the changes over to tier_member and tier_aggregate.
+def refresh_changed_artists(db_conn, generation):
+    changed_artist_ids = "SELECT artist_id FROM artist_change WHERE generation >= ?"
+    with db_conn:
+        db_conn.execute(
+            f"DELETE FROM tier_track WHERE artist_id IN ({changed_artist_ids})",
+            (generation,),
+        )
+        db_conn.execute(
+            f"""
+            INSERT INTO tier_track
+            {build_tier_track_query(artist_id_filter=changed_artist_ids)}
+        """,
+            (generation,),
+        )
+        db_conn.execute("UPDATE tier_aggregate_state SET deferred = 0")
+
+
+def get_popularity_tiers(db_conn):
+    rows = db_conn.execute(
+        """
+        SELECT min_popularity FROM popularity_tier
+        WHERE min_popularity IS NOT NULL
+        ORDER BY position
+    """
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+# Replace the rows of popularity_tier by tiers with the given boundaries.
+def write_popularity_tiers(db_conn, boundaries):
+    db_conn.execute("DELETE FROM popularity_tier")
+    tiers = [(boundary, f"{boundary}+") for boundary in boundaries]
+    tiers.append((None, f"{boundaries[-1]}-" if len(boundaries) > 0 else "all"))
+    db_conn.executemany(
+        """
+        INSERT INTO popularity_tier (tier, position, min_popularity, label)
+        VALUES (?, ?, ?, ?)
+    """,
+        [
+            (f"tier_{position}", position, min_popularity, label)
+            for position, (min_popularity, label) in enumerate(tiers, start=1)
+        ],
+    )
+
+
+# ----- Helper Functions End -----
+
+
+# Recompute tier_track, tier_member and tier_aggregate from the base tables.
+# Runs in bulk, with the tier_track triggers dropped meanwhile.
+# db_conn: a database connection.
+def rebuild_tier_aggregates(db_conn):
+    with db_conn:
+        drop_tier_track_triggers(db_conn)
+        db_conn.execute("DELETE FROM tier_track")
+        db_conn.execute("DELETE FROM tier_member")
+        db_conn.execute("DELETE FROM tier_aggregate")
+
+        db_conn.execute(f"INSERT INTO tier_track {build_tier_track_query()}")
+        for kind, (name_column, _) in MEMBER_KINDS.items():
+            db_conn.execute(
+                f"""
+                INSERT INTO tier_member (tier, kind, name, refcount)
+                SELECT tier, '{kind}', {name_column}, COUNT(*)
+                FROM tier_track
+                WHERE {name_column} IS NOT NULL
+                GROUP BY tier, {name_column}
+            """
+            )
+
+        member_counts = [
+            f"(SELECT COUNT(*) FROM tier_member AS m "
+            f"WHERE m.tier = pt.tier AND m.kind = '{kind}')"
+            for kind in MEMBER_KINDS
+        ]
+        feature_aggregates = [
+            f"COALESCE(SUM(tt.{feature}), 0), COUNT(tt.{feature})"
+            for feature in AGGREGATED_FEATURES
+        ]
+        db_conn.execute(
+            f"""
+            INSERT INTO tier_aggregate
+            SELECT
+                pt.tier,
+                COUNT(tt.track_id),
+                {", ".join(member_counts)},
+                {", ".join(feature_aggregates)}
+            FROM popularity_tier AS pt
+                LEFT JOIN tier_track AS tt ON (pt.tier = tt.tier)
+            GROUP BY pt.tier
+        """
+        )
+        create_tier_track_triggers(db_conn)
+        db_conn.execute("UPDATE tier_aggregate_state SET deferred = 0")
+
+
+# Turn the maintenance of the tier aggregates off for the duration of the with block, e.g. a
+# load, and bring them up to date at the end, including when the block fails.
+# The base table triggers are dropped meanwhile, so they cost nothing per row.
+# A run killed before the end leaves the maintenance off: see rebuild_deferred_tier_aggregates.
+# db_conn: a database connection.
+# full: rebuild the aggregates from scratch at the end, for a block rewriting every table.
+# Otherwise only the tracks of the artists the change tracking stamped during the block are
+# recomputed, so the block must keep the change tracking on (see change_tracking.py).
+@contextmanager
+def defer_tier_aggregates(db_conn, full=True):
+    # Maintenance left off by a killed run can't be caught up on incrementally.
+    row = db_conn.execute("SELECT deferred FROM tier_aggregate_state").fetchone()
+    full = full or row[0] == 1
+    generation = get_load_generation(db_conn)
+    with db_conn:
+        db_conn.execute("UPDATE tier_aggregate_state SET deferred = 1")
+        drop_base_table_triggers(db_conn)
+    try:
+        yield
+    finally:
+        if full:
+            with metrics.stage("rebuild_tier_aggregates"):
+                rebuild_tier_aggregates(db_conn)
+        else:
+            with metrics.stage("refresh_tier_aggregates"):
+                refresh_changed_artists(db_conn, generation)
+        with db_conn:
+            for table_name in TRACK_ID_LOOKUPS:
+                create_base_table_triggers(table_name, db_conn)
+
+
+# Rebuild the tier aggregates if their maintenance was left off, e.g. by a killed load.
+# db_conn: a database connection.
+# Returns whether they were rebuilt.
+def rebuild_deferred_tier_aggregates(db_conn):
+    row = db_conn.execute("SELECT deferred FROM tier_aggregate_state").fetchone()
+    if not row[0]:
+        return False
+    rebuild_tier_aggregates(db_conn)
+    return True
+
+
+# Create the tier aggregate tables and triggers, filling them if they are new. Safe to call repeatedly.
+# Must run after the base tables exist.
+# db_conn: a database connection.
+def create_tier_aggregates(db_conn):
+    is_new = (
+        db_conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tier_track'"
+        ).fetchone()
+        is None
+    )
+
+    is_outdated = False
+    with db_conn:
+        # tier_track rows built before they held the artist's ID are built again.
+        if not is_new and "artist_id" not in {
+            column[1]
+            for column in db_conn.execute("PRAGMA table_info(tier_track)").fetchall()
+        }:
+            db_conn.execute("DROP TABLE tier_track")
+            is_outdated = True
+        create_tables(db_conn)
+        if is_new:
+            write_popularity_tiers(db_conn, DEFAULT_POPULARITY_TIERS)
+        for table_name in TRACK_ID_LOOKUPS:
+            create_base_table_triggers(table_name, db_conn)
+        create_tier_track_triggers(db_conn)
+
+    if is_new or is_outdated:
+        rebuild_tier_aggregates(db_conn)
+
+
+# Set the tier boundaries and, if they changed, store the new tier of every artist and rebuild
+# the aggregates.
+# db_conn: a database connection.
+# boundaries: lowest artist popularity of each tier but the last, in decreasing order,
+# e.g. [95, 90, 85, 80] for tier_1 (>= 95) to tier_5 (< 80).
+# Returns whether the tiers changed.
+def set_popularity_tiers(db_conn, boundaries):
+    boundaries = [int(boundary) for boundary in boundaries]
+    if any(high <= low for high, low in zip(boundaries, boundaries[1:])):
+        raise ValueError(
+            f"Popularity tier boundaries must be decreasing, got {boundaries}"
+        )
+    if boundaries == get_popularity_tiers(db_conn):
+        return False
+
+    # Imported here, since it needs pandas and this module is used by the views command.
+    from data_generation.derived_columns import refresh_derived_columns
+
+    with db_conn:
+        write_popularity_tiers(db_conn, boundaries)
+        # Every tier may have changed. A new generation tells the readers caching results
+        # per generation (e.g. the visualization query cache) that the data changed.
+        db_conn.execute("UPDATE load_generation SET generation = generation + 1")
+    with defer_tier_aggregates(db_conn):
+        refresh_derived_columns(db_conn, "artist", ["popularity_tier"])
+    return True
@@ -1,5 +1,19 @@
-import pandas as pd
-import numpy as np
+from itertools import chain
+from instrumentation.run_metrics import metrics
+from data_generation.concurrent_fetch import map_concurrently
+from data_generation.records import (
+    records_to_frame,
+    TrackFeatureRecord,
+    find_overrides,
+    intern_category,
+)
+from data_generation.columnar_transform import (
+    get_column,
+    transform_track_features_columnar,
+)
+from data_generation.upsert_loading import upsert_records
+from data_generation.bulk_loading import bulk_load_records
+from data_generation.schema import TRACK_FEATURE_DTYPE, prepare_table_for_load
 
 """
 Functions related to track features dataset generation.
@@ -7,22 +21,27 @@ Functions related to track features dataset generation.
 
 # ----- Helper Functions -----
 
-# Convert the raw track features to the format compatible with the track_feature table schema.
+# Convert the raw track features to a track_feature table record (see records.py).
 # track_features_raw: track features from the Spotify API.
 def transform_track_features(track_features_raw):
-    track_features = {
-        "track_id": track_features_raw["id"],
-        "danceability": track_features_raw["danceability"],
-        "energy": track_features_raw["energy"],
-        "instrumentalness": track_features_raw["instrumentalness"],
-        "liveness": track_features_raw["liveness"],
-        "loudness": track_features_raw["loudness"],
-        "speechiness": track_features_raw["speechiness"],
-        "tempo": track_features_raw["tempo"],
-        "type": track_features_raw["type"],
-        "valence": track_features_raw["valence"],
-        "song_uri": track_features_raw["uri"],
-    }
+    track_features = TrackFeatureRecord(
+        track_id=track_features_raw["id"],
+        danceability=track_features_raw["danceability"],
+        energy=track_features_raw["energy"],
+        instrumentalness=track_features_raw["instrumentalness"],
+        liveness=track_features_raw["liveness"],
+        loudness=track_features_raw["loudness"],
+        speechiness=track_features_raw["speechiness"],
+        tempo=track_features_raw["tempo"],
+        type=intern_category(track_features_raw["type"]),
+        valence=track_features_raw["valence"],
+        # The URI is rebuilt from the ID, unless it doesn't follow the pattern.
+        overrides=find_overrides(
+            TrackFeatureRecord,
+            track_features_raw["id"],
+            song_uri=track_features_raw["uri"],
+        ),
+    )
 
     return track_features
 
@@ -30,56 +49,86 @@ def transform_track_features(track_features_raw):
 # ----- Helper Functions End -----
 
 
-# Fetch all track features with all tracks.
-# tracks: all tracks by all artists.
+# Fetch the features of one batch of track IDs.
+# track_ids_batch: at most 100 track IDs.
 # spotify: an object created after connecting to Spotipy library.
-def fetch_features_for_all_tracks(tracks, spotify):
-    track_ids = [t["track_id"] for t in tracks]
+def fetch_features_for_tracks_batch(track_ids_batch, spotify):
+    # It's possible that a track may NOT have feature, in which case the returned element is None.
+    tracks_features_raw = spotify.audio_features(track_ids_batch)
+    track_features = [
+        transform_track_features(tfr) for tfr in tracks_features_raw if tfr is not None
+    ]
+    metrics.increment("rows_fetched", len(track_features), table="track_feature")
+    return track_features
 
-    all_tracks_features_nested = []
+
+# Fetch all track features with all tracks, as a track_feature table DataFrame.
+# The raw track features are transformed column by column (see columnar_transform.py).
+# tracks: all tracks by all artists, as a DataFrame or a list of dicts.
+# spotify: an object created after connecting to Spotipy library.
+# max_workers: number of concurrent API calls. Defaults to 1, which fetches the batches one by one.
+def fetch_features_for_all_tracks(tracks, spotify, max_workers=1):
+    track_ids = get_column(tracks, "track_id")
 
     # spotipy.audio_features can only support 100 ids per time, will group ids into batches of 100.
     # last batch may be less than 100,
-    for i in range(0, len(track_ids), 100):
-        # It's possible that a track may NOT have feature, in which case the returned element is None.
-        tracks_features_raw = spotify.audio_features(track_ids[i : i + 100])
-        transformed_track_features = [
-            transform_track_features(tfr)
-            for tfr in tracks_features_raw
-            if tfr is not None
-        ]
-        all_tracks_features_nested.append(transformed_track_features)
-
-    all_tracks_features = list(np.concatenate(all_tracks_features_nested).flat)
+    track_ids_batches = [track_ids[i : i + 100] for i in range(0, len(track_ids), 100)]
+    tracks_features_raw_batches = map_concurrently(
+        lambda track_ids_batch: spotify.audio_features(track_ids_batch),
+        track_ids_batches,
+        max_workers,
+    )
+
+    all_tracks_features = transform_track_features_columnar(
+        list(chain.from_iterable(tracks_features_raw_batches))
+    )
+    metrics.increment("rows_fetched", len(all_tracks_features), table="track_feature")
     return all_tracks_features
 
 
 # Load the track features into database's track_feature table.
-# tracks_features: the track features to load.
+# tracks_features: the track features to load, as a list of dicts or a DataFrame.
 # db_conn: a database connection.
-def load_tracks_features_to_db(tracks_features, db_conn):
-    tracks_features_df = pd.DataFrame(tracks_features)
+# if_exists: "replace" rewrites the table, "append" adds the rows to it (used when loading in chunks),
+# "upsert" inserts new rows and updates changed rows keyed on track_id, leaving unchanged rows untouched.
+# bulk: load with plain sqlite3 executemany instead of DataFrame.to_sql, see bulk_loading.py.
+def load_tracks_features_to_db(
+    tracks_features, db_conn, if_exists="replace", bulk=False
+):
+    if bulk:
+        num_rows = bulk_load_records(
+            tracks_features,
+            "track_feature",
+            TRACK_FEATURE_DTYPE,
+            "track_id",
+            db_conn,
+            if_exists,
+        )
+        print(f"Bulk loaded track_features: {num_rows} rows written")
+        return
+
+    if if_exists == "upsert":
+        num_changed = upsert_records(
+            tracks_features, "track_feature", TRACK_FEATURE_DTYPE, "track_id", db_conn
+        )
+        print(
+            f"Upserted track_features: {num_changed} of {len(tracks_features)} rows changed"
+        )
+        return
+
+    tracks_features_df = records_to_frame(tracks_features, TRACK_FEATURE_DTYPE)
 
     # Evaluate Nones.
-    print("Number of NaN in track_features DF: ", tracks_features_df.isna().sum().sum())
+    metrics.increment(
+        "nan_values", int(tracks_features_df.isna().sum().sum()), table="track_feature"
+    )
 
+    # Load into the declared table (keys and indexes) rather than letting to_sql create it.
+    prepare_table_for_load("track_feature", db_conn, if_exists)
     tracks_features_df.to_sql(
         name="track_feature",
         con=db_conn,
-        if_exists="replace",
+        if_exists="append",
         index=False,
-        # Following https://www.sqlite.org/datatype3.html to translate the required datatypes to sqlite3 types.
-        dtype={
-            "track_id": "TEXT",
-            "danceability": "REAL",
-            "energy": "REAL",
-            "instrumentalness": "REAL",
-            "liveness": "REAL",
-            "loudness": "REAL",
-            "speechiness": "REAL",
-            "tempo": "REAL",
-            "type": "TEXT",
-            "valence": "REAL",
-            "song_uri": "TEXT",
-        },
+        dtype=TRACK_FEATURE_DTYPE,
     )
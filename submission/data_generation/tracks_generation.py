@@ -1,5 +1,24 @@
-import pandas as pd
-import numpy as np
+from instrumentation.run_metrics import metrics
+from data_generation.concurrent_fetch import map_concurrently
+from data_generation.records import (
+    records_to_frame,
+    TrackRecord,
+    find_overrides,
+    intern_category,
+)
+from data_generation.columnar_transform import (
+    deduplicate_frame,
+    get_column,
+    transform_tracks_columnar,
+)
+from data_generation.upsert_loading import upsert_records
+from data_generation.bulk_loading import bulk_load_records
+from data_generation.derived_columns import add_derived_columns
+from data_generation.schema import (
+    TRACK_DTYPE,
+    get_stored_dtype,
+    prepare_table_for_load,
+)
 
 """
 Functions related to tracks dataset generation.
@@ -11,92 +30,153 @@ Functions related to tracks dataset generation.
 # tracks: list of tracks to be deduplicated.
 # Can't deduplicate based on IDs since the same track may have different IDs (release version etc.)
 # causing the same track to appear multiple times if based on ID.
-def deduplicate_tracks(tracks):
+# visited_names: names already seen, e.g. in earlier chunks of a stream. Updated in place.
+def deduplicate_tracks(tracks, visited_names=None):
     unique_tracks = []
-    visited_names = set()
+    visited_names = set() if visited_names is None else visited_names
 
     for track in tracks:
-        track_name = track["song_name"]
+        track_name = track.song_name
         if track_name not in visited_names:
             unique_tracks.append(track)
             visited_names.add(track_name)
 
+    metrics.increment("rows_fetched", len(tracks), table="track")
+    metrics.increment(
+        "rows_deduplicated", len(tracks) - len(unique_tracks), table="track"
+    )
     return unique_tracks
 
 
+# Convert a raw track dict from the Spotify API to a track table record (see records.py).
+# track_raw: a track object returned by the album_tracks or albums endpoints.
+# album_id: the ID of the album the track belongs to.
+def transform_track(track_raw, album_id):
+    track = TrackRecord(
+        track_id=track_raw["id"],
+        song_name=track_raw["name"],
+        duration_ms=track_raw["duration_ms"],
+        explicit=track_raw["explicit"],
+        disc_number=track_raw["disc_number"],
+        type=intern_category(track_raw["type"]),
+        album_id=album_id,
+        # The URL and URI are rebuilt from the ID, unless they don't follow the pattern.
+        overrides=find_overrides(
+            TrackRecord,
+            track_raw["id"],
+            external_url=track_raw["external_urls"]["spotify"],
+            song_uri=track_raw["uri"],
+        ),
+    )
+
+    return track
+
+
 # ----- Helper Functions End -----
 
 
+# Fetch the raw track dicts of an album from the Spotify API.
+# album_id: the ID of the album.
+# spotify: an object created after connecting to Spotipy library.
+def fetch_tracks_raw_by_album(album_id, spotify):
+    tracks_search_result = spotify.album_tracks(album_id=album_id, limit=50, offset=0)
+    return tracks_search_result["items"]
+
+
 # Fetch tracks associated with an album.
 # album_id: the ID of the album.
 # spotify: an object created after connecting to Spotipy library.
 def fetch_tracks_by_album(album_id, spotify):
     # Search the tracks of an album using the Spotify API.
-    tracks_search_result = spotify.album_tracks(album_id=album_id, limit=50, offset=0)
-    tracks_list_raw = tracks_search_result["items"]
+    tracks_list_raw = fetch_tracks_raw_by_album(album_id, spotify)
 
     tracks_list = []
 
     # Convert the raw tracks to the format compatible with the track table schema.
     for track_raw in tracks_list_raw:
-        track = {
-            "track_id": track_raw["id"],
-            "song_name": track_raw["name"],
-            "external_url": track_raw["external_urls"]["spotify"],
-            "duration_ms": track_raw["duration_ms"],
-            "explicit": track_raw["explicit"],
-            "disc_number": track_raw["disc_number"],
-            "type": track_raw["type"],
-            "song_uri": track_raw["uri"],
-            "album_id": album_id,
-        }
-        tracks_list.append(track)
+        tracks_list.append(transform_track(track_raw, album_id))
 
     return tracks_list
 
 
-# Fetch all tracks across all albums.
-# albums: all albums by all artists.
+# Fetch the tracks of up to 20 albums in a single call to the albums endpoint.
+# Each full album object carries the first 50 of its tracks, same as fetch_tracks_by_album.
+# album_ids_batch: at most 20 album IDs.
 # spotify: an object created after connecting to Spotipy library.
-# Final tracks are deduplicated based on their IDs.
-def fetch_tracks_for_all_albums(albums, spotify):
-    all_tracks_nested = []
-
-    for album in albums:
-        fetched_tracks = fetch_tracks_by_album(album["album_id"], spotify)
-        all_tracks_nested.append(fetched_tracks)
+# Returns one list of tracks per album ID, in the same order.
+def fetch_tracks_for_albums_batch(album_ids_batch, spotify):
+    albums_raw = spotify.albums(album_ids_batch)["albums"]
+
+    # An album that no longer exists comes back as None.
+    return [
+        []
+        if album_raw is None
+        else [
+            transform_track(track_raw, album_id)
+            for track_raw in album_raw["tracks"]["items"]
+        ]
+        for album_id, album_raw in zip(album_ids_batch, albums_raw)
+    ]
+
+
+# Fetch all tracks across all albums, as a track table DataFrame.
+# The raw tracks are transformed column by column (see columnar_transform.py).
+# albums: all albums by all artists, as a DataFrame or a list of dicts.
+# spotify: an object created after connecting to Spotipy library.
+# max_workers: number of concurrent API calls. Defaults to 1, which fetches the albums' tracks one by one.
+# Final tracks are deduplicated based on their song names.
+def fetch_tracks_for_all_albums(albums, spotify, max_workers=1):
+    track_pages = map_concurrently(
+        lambda album_id: (album_id, fetch_tracks_raw_by_album(album_id, spotify)),
+        get_column(albums, "album_id"),
+        max_workers,
+    )
 
-    all_tracks = list(np.concatenate(all_tracks_nested).flat)
-    unique_tracks = deduplicate_tracks(all_tracks)
+    all_tracks = transform_tracks_columnar(track_pages)
+    unique_tracks = deduplicate_frame(all_tracks, "song_name", "track")
 
     print(f"Number of tracks: all {len(all_tracks)} -> unique {len(unique_tracks)}")
     return unique_tracks
 
 
 # Load the tracks into database's track table.
-# tracks: the tracks to load.
+# tracks: the tracks to load, as a list of dicts or a DataFrame.
 # db_conn: a database connection.
-def load_tracks_to_db(tracks, db_conn):
-    tracks_df = pd.DataFrame(tracks)
+# if_exists: "replace" rewrites the table, "append" adds the rows to it (used when loading in chunks),
+# "upsert" inserts new rows and updates changed rows keyed on track_id, leaving unchanged rows untouched.
+# bulk: load with plain sqlite3 executemany instead of DataFrame.to_sql, see bulk_loading.py.
+def load_tracks_to_db(tracks, db_conn, if_exists="replace", bulk=False):
+    # The derived columns (see derived_columns.py) are computed once here and stored.
+    tracks = add_derived_columns(tracks, "track", db_conn)
+    dtype = get_stored_dtype("track")
+
+    if bulk:
+        num_rows = bulk_load_records(
+            tracks, "track", dtype, "track_id", db_conn, if_exists
+        )
+        print(f"Bulk loaded tracks: {num_rows} rows written")
+        return
+
+    if if_exists == "upsert":
+        num_changed = upsert_records(tracks, "track", dtype, "track_id", db_conn)
+        print(f"Upserted tracks: {num_changed} of {len(tracks)} rows changed")
+        return
+
+    tracks_df = records_to_frame(tracks, dtype)
 
     # Evaluate Nones.
-    print("Number of NaN in tracks DF: ", tracks_df.isna().sum().sum())
+    metrics.increment(
+        "nan_values",
+        int(tracks_df[list(TRACK_DTYPE)].isna().sum().sum()),
+        table="track",
+    )
 
+    # Load into the declared table (keys and indexes) rather than letting to_sql create it.
+    prepare_table_for_load("track", db_conn, if_exists)
     tracks_df.to_sql(
         name="track",
         con=db_conn,
-        if_exists="replace",
+        if_exists="append",
         index=False,
-        # Following https://www.sqlite.org/datatype3.html to translate the required datatypes to sqlite3 types.
-        dtype={
-            "track_id": "TEXT",
-            "song_name": "TEXT",
-            "external_url": "TEXT",
-            "duration_ms": "INTEGER",
-            "explicit": "NUMERIC",
-            "disc_number": "INTEGER",
-            "type": "TEXT",
-            "song_uri": "TEXT",
-            "album_id": "TEXT",
-        },
+        dtype=dtype,
     )
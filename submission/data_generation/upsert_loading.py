@@ -0,0 +1,77 @@
+from itertools import chain
+import pandas as pd
+from data_generation.schema import prepare_table_for_load
+from data_generation.records import ColumnarRows, get_columns_getter
+
+"""
+Incremental loading: insert new rows, update changed rows, leave unchanged rows untouched.
+"""
+
+# ----- Helper Functions -----
+
+# Build the INSERT ... ON CONFLICT DO UPDATE statement for a table.
+# The update only fires when at least one column differs, so unchanged rows are not rewritten.
+# table_name: the table to load into.
+# columns: the table's column names.
+# key_column: the column identifying a row, e.g. artist_id.
+# source: table to read the rows from. Defaults to one row of parameters, for executemany.
+def build_upsert_statement(table_name, columns, key_column, source=None):
+    value_columns = [c for c in columns if c != key_column]
+    # WHERE true tells the parser the ON CONFLICT clause isn't a join constraint.
+    rows = (
+        f"VALUES ({', '.join('?' for _ in columns)})"
+        if source is None
+        else f"SELECT {', '.join(columns)} FROM {source} WHERE true"
+    )
+
+    assignments = ", ".join(f"{c} = excluded.{c}" for c in value_columns)
+    changed = " OR ".join(
+        f"{table_name}.{c} IS NOT excluded.{c}" for c in value_columns
+    )
+
+    return f"""
+        INSERT INTO {table_name} ({", ".join(columns)})
+        {rows}
+        ON CONFLICT ({key_column}) DO UPDATE SET {assignments}
+        WHERE {changed}
+    """
+
+
+# Iterate the rows of records as sequences of values in column order.
+# records: iterable of records (see records.py) or dicts with one key per column, or a DataFrame
+# or ColumnarRows.
+def iterate_rows(records, columns):
+    if isinstance(records, ColumnarRows):
+        return zip(*(records.values[c] for c in columns))
+    if isinstance(records, pd.DataFrame):
+        # Iterating the columns yields plain Python values, which sqlite3 can bind.
+        return zip(*(records[c].tolist() for c in columns))
+    records = iter(records)
+    first_record = next(records, None)
+    if first_record is None:
+        return iter(())
+    get_row = get_columns_getter(first_record, columns)
+    return map(get_row, chain([first_record], records))
+
+
+# ----- Helper Functions End -----
+
+
+# Upsert the records into a table keyed on key_column.
+# records: list of records (see records.py) or dicts with one key per column, or a DataFrame.
+# table_name: the table to load into.
+# dtype: the sqlite3 type of each column, in column order.
+# key_column: the column identifying a row, e.g. artist_id.
+# db_conn: a database connection.
+# Returns the number of rows actually inserted or updated.
+def upsert_records(records, table_name, dtype, key_column, db_conn):
+    columns = list(dtype)
+    statement = build_upsert_statement(table_name, columns, key_column)
+    rows = iterate_rows(records, columns)
+
+    prepare_table_for_load(table_name, db_conn, "upsert")
+    with db_conn:
+        cur = db_conn.executemany(statement, rows)
+
+    # The rows written by the statement itself, not by the triggers it fires.
+    return cur.rowcount
@@ -1,37 +1,31 @@
-import sqlite3
-from matplotlib.backends.backend_pdf import PdfPages
-from data_visualization.plot_top_artists_by_followers import *
-from data_visualization.plot_features_per_popularity_group import *
-from data_visualization.plot_counts_per_popularity_group import *
-from data_visualization.plot_features_of_an_artist_over_time import *
+import argparse
+from data_visualization.command import add_arguments, run
+from instrumentation.run_metrics import (
+    add_instrumentation_arguments,
+    start_run_metrics,
+)
 
 """
 Run this file to create the visualizations.
-"""
-
-if __name__ == "__main__":
-    conn = sqlite3.connect("spotify.db")
-    print("Connected to database")
-
-    # Will hold the plots to be saved in one PDF.
-    plots = []
 
-    plots.append(plot_top_artists_by_followers(conn))
-    print("Plotted top artists by followers")
+The query results behind the plots are read first, then the pages are drawn in parallel
+worker processes (see --max-workers) and merged into visualization.pdf. Rendered pages are
+cached in figure_cache/ keyed by a hash of their query result, so a rerun on unchanged
+data only merges the cached pages. Use --no-figure-cache to redraw everything.
 
-    plots.append(plot_features_of_an_artist_over_time(conn))
-    print("Plotted features of an artist over time")
+The query results are cached in query_cache/ too, keyed by their SQL and the DB's load
+generation, so the queries only run again after a new load (see query_cache.py).
 
-    plots.append(plot_features_per_popularity_group(conn))
-    print("Plotted features per popularity group")
+The features over time are plotted for the artists given with --artists (Ed Sheeran by
+default), or for every artist with --all-artists. Their data is read with a single query.
 
-    plots.append(plot_counts_per_popularity_group(conn))
-    print("Plotted counts per popularity group")
-
-    print("Number of plots: ", len(plots))
-
-    with PdfPages("visualization.pdf") as pdf_pages:
-        for plot in plots:
-            pdf_pages.savefig(plot.figure)
+The time spent per plot and per SQLite statement is written to metrics/ (see --metrics-dir).
+"""
 
-    print("Done creating the visualization PDF!")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the visualizations.")
+    add_arguments(parser)
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    start_run_metrics("data_visualization", args)
+    run(args)
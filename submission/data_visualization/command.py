@@ -0,0 +1,156 @@
+import tempfile
+from instrumentation.run_metrics import metrics
+from instrumentation.sqlite_timing import connect_timed
+
+"""
+The report command, run by data_visualization.py and by `cli.py report`.
+
+The plot modules import pandas, matplotlib and seaborn, which take about a second to load.
+They are imported by run() rather than at the top of this module, so building the CLI's
+argument parser, or running another subcommand, doesn't load them.
+"""
+
+
+# Add the report options to an argument parser.
+def add_arguments(parser):
+    parser.add_argument(
+        "--db-path",
+        default="spotify.db",
+        help="SQLite file to read the views from.",
+    )
+    parser.add_argument(
+        "--output",
+        default="visualization.pdf",
+        help="PDF file to write the plots into.",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        help="Number of processes drawing the plots. Defaults to the number of CPUs.",
+    )
+    parser.add_argument(
+        "--figure-cache",
+        default="figure_cache",
+        help="Folder caching the rendered pages.",
+    )
+    parser.add_argument(
+        "--no-figure-cache",
+        action="store_true",
+        help="Redraw every page instead of reusing the cached ones.",
+    )
+    parser.add_argument(
+        "--artists",
+        nargs="+",
+        default=["Ed Sheeran"],
+        help="Artists to plot the features over time of, one page each.",
+    )
+    parser.add_argument(
+        "--all-artists",
+        action="store_true",
+        help="Plot the features over time of every artist, one page each.",
+    )
+    parser.add_argument(
+        "--query-cache",
+        default="query_cache",
+        help="Folder caching the query results behind the plots.",
+    )
+    parser.add_argument(
+        "--query-cache-size",
+        type=int,
+        default=256,
+        help="Size bound of the query cache, in MB.",
+    )
+    parser.add_argument(
+        "--no-query-cache",
+        action="store_true",
+        help="Read every query result from the DB.",
+    )
+
+
+# Create the visualization PDF.
+# args: the parsed arguments, see add_arguments.
+def run(args):
+    from data_visualization.plot_top_artists_by_followers import (
+        read_top_artists_by_followers,
+        draw_top_artists_by_followers,
+    )
+    from data_visualization.plot_features_per_popularity_group import (
+        read_features_per_popularity_group,
+        draw_features_per_popularity_group,
+    )
+    from data_visualization.plot_counts_per_popularity_group import (
+        read_counts_per_popularity_group,
+        draw_counts_per_popularity_group,
+    )
+    from data_visualization.plot_features_of_an_artist_over_time import (
+        read_features_of_artists_over_time,
+        group_features_by_artist,
+        draw_features_of_an_artist_over_time,
+    )
+    from data_visualization.parallel_rendering import render_pdf
+    from data_visualization.query_cache import query_cache
+
+    if not args.no_query_cache:
+        query_cache.configure(args.query_cache, args.query_cache_size * 1024 * 1024)
+
+    conn = connect_timed(args.db_path)
+    print("Connected to database")
+
+    # Will hold the pages to be saved in one PDF, in order:
+    # (page name, draw function, query result, draw keyword arguments).
+    pages = []
+
+    with metrics.stage("read_top_artists_by_followers"):
+        df = read_top_artists_by_followers(conn)
+    pages.append(("top_artists_by_followers", draw_top_artists_by_followers, df, {}))
+
+    # One page per artist, all read with a single query.
+    with metrics.stage("read_features_of_an_artist_over_time"):
+        df = read_features_of_artists_over_time(
+            conn, None if args.all_artists else args.artists
+        )
+    artist_pages = [
+        (
+            f"features_of_an_artist_over_time:{artist_name}",
+            draw_features_of_an_artist_over_time,
+            artist_df,
+            {"artist_name": artist_name},
+        )
+        for artist_name, artist_df in group_features_by_artist(df)
+    ]
+    if not args.all_artists:
+        # Keep the order the artists were given in, and report the unknown ones.
+        pages_by_artist = {page[3]["artist_name"]: page for page in artist_pages}
+        artist_pages = [
+            pages_by_artist[name] for name in args.artists if name in pages_by_artist
+        ]
+        for artist_name in set(args.artists) - set(pages_by_artist):
+            print(f"No features over time for artist {artist_name!r}, skipping")
+    pages.extend(artist_pages)
+
+    with metrics.stage("read_features_per_popularity_group"):
+        df = read_features_per_popularity_group(conn)
+    pages.append(
+        ("features_per_popularity_group", draw_features_per_popularity_group, df, {})
+    )
+
+    with metrics.stage("read_counts_per_popularity_group"):
+        df = read_counts_per_popularity_group(conn)
+    pages.append(
+        ("counts_per_popularity_group", draw_counts_per_popularity_group, df, {})
+    )
+
+    print("Number of plots: ", len(pages))
+
+    with metrics.stage("render_pdf"), tempfile.TemporaryDirectory() as temp_dir:
+        drawn_pages = render_pdf(
+            pages,
+            args.output,
+            cache_dir=temp_dir if args.no_figure_cache else args.figure_cache,
+            max_workers=args.max_workers,
+        )
+    metrics.increment("pages_drawn", len(drawn_pages))
+    metrics.increment("pages_from_cache", len(pages) - len(drawn_pages))
+    print(f"Drew {len(drawn_pages)} plots, reused {len(pages) - len(drawn_pages)}")
+
+    print(f"Done creating the visualization PDF {args.output}!")
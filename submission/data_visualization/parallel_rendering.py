@@ -0,0 +1,116 @@
+import hashlib
+import inspect
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+import pandas as pd
+from pypdf import PdfReader, PdfWriter
+
+"""
+Render the pages of the visualization PDF in parallel, with a cache of rendered pages.
+
+The query results are read in the calling process, which owns the DB connection. Each page
+is then keyed by a hash of its query result, of its draw function's code and arguments.
+Pages whose key is already in the cache are reused as they are. The others are drawn and
+saved as single page PDFs by a pool of worker processes on the headless Agg backend, so
+the CPU heavy drawing and PDF serialization scale across cores. The pages are finally
+merged into one PDF.
+"""
+
+# Name of a cached page file: a prefix and the page's cache key. The cache only ever deletes
+# files matching this pattern, so other files in cache_dir are left alone.
+PAGE_FILE_PREFIX = "page-"
+PAGE_FILE_PATTERN = re.compile(rf"{PAGE_FILE_PREFIX}[0-9a-f]{{64}}\.pdf")
+
+# ----- Helper Functions -----
+
+# Hash of a query result: its columns, their types and every value.
+def hash_dataframe(df):
+    digest = hashlib.sha256()
+    digest.update(
+        json.dumps([list(map(str, df.columns)), list(map(str, df.dtypes))]).encode()
+    )
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+# Cache key of a page. Changing the data, the drawing code or the arguments gives a new key.
+def get_page_cache_key(draw_fn, df, draw_kwargs):
+    module_source = inspect.getsource(sys.modules[draw_fn.__module__])
+    digest = hashlib.sha256()
+    digest.update(f"{draw_fn.__module__}.{draw_fn.__name__}".encode())
+    digest.update(module_source.encode())
+    digest.update(json.dumps(draw_kwargs, sort_keys=True, default=str).encode())
+    digest.update(hash_dataframe(df).encode())
+    return digest.hexdigest()
+
+
+# Worker process setup: draw off screen.
+def use_headless_backend():
+    matplotlib.use("Agg")
+
+
+# Draw a page and save it as a single page PDF. Runs in a worker process.
+# The file is written under a temporary name first, so an interrupted render never leaves
+# a broken page in the cache.
+def render_page(draw_fn, df, draw_kwargs, page_path):
+    plot = draw_fn(df, **draw_kwargs)
+    plot.figure.savefig(page_path + ".tmp", format="pdf")
+    os.replace(page_path + ".tmp", page_path)
+
+
+# ----- Helper Functions End -----
+
+
+# Render pages into one PDF, drawing only the pages missing from the cache.
+# pages: list of (page name, draw function, query result DataFrame, draw keyword arguments).
+# The draw functions take the DataFrame first and return a seaborn/matplotlib plot.
+# They must be module level functions, so the worker processes can import them.
+# output_path: the PDF to write.
+# cache_dir: folder holding the rendered pages. Cached pages not used by this call are deleted,
+# other files are left alone.
+# max_workers: number of worker processes. Defaults to the number of CPUs.
+# Returns the names of the pages that were drawn (the others came from the cache).
+def render_pdf(pages, output_path, cache_dir="figure_cache", max_workers=None):
+    os.makedirs(cache_dir, exist_ok=True)
+    page_paths = [
+        os.path.join(
+            cache_dir,
+            PAGE_FILE_PREFIX + get_page_cache_key(draw_fn, df, draw_kwargs) + ".pdf",
+        )
+        for _, draw_fn, df, draw_kwargs in pages
+    ]
+
+    pages_to_draw = [
+        (page, page_path)
+        for page, page_path in zip(pages, page_paths)
+        if not os.path.exists(page_path)
+    ]
+    if len(pages_to_draw) > 0:
+        with ProcessPoolExecutor(
+            max_workers=max_workers, initializer=use_headless_backend
+        ) as executor:
+            futures = [
+                executor.submit(render_page, draw_fn, df, draw_kwargs, page_path)
+                for (_, draw_fn, df, draw_kwargs), page_path in pages_to_draw
+            ]
+            for future in futures:
+                future.result()
+
+    writer = PdfWriter()
+    for page_path in page_paths:
+        for page in PdfReader(page_path).pages:
+            writer.add_page(page)
+    with open(output_path, "wb") as output_file:
+        writer.write(output_file)
+
+    # Keep the cache to the pages of the latest render.
+    used_files = {os.path.basename(page_path) for page_path in page_paths}
+    for file_name in os.listdir(cache_dir):
+        if PAGE_FILE_PATTERN.fullmatch(file_name) and file_name not in used_files:
+            os.remove(os.path.join(cache_dir, file_name))
+
+    return [page_name for (page_name, _, _, _), _ in pages_to_draw]
@@ -1,24 +1,25 @@
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
+from data_visualization.query_cache import read_sql_query
 
-# Plot a multi bar chart showing artists and albums counts per popularity group.
-def plot_counts_per_popularity_group(conn):
-    # Rename the popularity groups to be more clear.
+# Read the data behind the counts per popularity group bar chart.
+# conn: a sqlite3 database connection.
+def read_counts_per_popularity_group(conn):
+    # Show the popularity groups by their popularity range, e.g. "95+".
     query = """
         SELECT 
-            case
-                when popularity_group = 'tier_1' then '95+'
-                when popularity_group = 'tier_2' then '90+'
-                when popularity_group = 'tier_3' then '85+'
-                when popularity_group = 'tier_4' then '80+'
-                else '80-'
-            end as popularity_group,
+            popularity_label AS popularity_group,
             num_artists AS artists,
             num_albums AS albums
         FROM v_features_per_popularity_group
     """
-    df = pd.read_sql_query(sql=query, con=conn)
+    return read_sql_query(query, conn)
+
+
+# Draw the counts per popularity group bar chart from its data.
+# df: the DataFrame returned by read_counts_per_popularity_group.
+def draw_counts_per_popularity_group(df):
     # Create a DF specific to cat plot.
     cat_df = pd.melt(
         df, id_vars="popularity_group", var_name="category", value_name="count"
@@ -44,3 +45,9 @@ def plot_counts_per_popularity_group(conn):
     # Need to close otherwise will mix with other figures.
     plt.close()
     return cat_plot
+
+
+# Plot a multi bar chart showing artists and albums counts per popularity group.
+# conn: a sqlite3 database connection.
+def plot_counts_per_popularity_group(conn):
+    return draw_counts_per_popularity_group(read_counts_per_popularity_group(conn))
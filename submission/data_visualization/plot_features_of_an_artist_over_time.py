@@ -1,22 +1,59 @@
+import json
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
+from data_visualization.query_cache import read_sql_query
 
-# Plot multi point chart showing features for an artist over time.
+# Columns of v_artist_features_over_time plotted, under the names shown in the legend.
+FEATURE_COLUMNS = """
+    year,
+    avg_danceability AS danceability,
+    avg_energy AS energy,
+    avg_liveness AS liveness,
+    avg_valence AS valence
+"""
+
+# Read the data behind the features of an artist over time point chart.
 # conn: a sqlite3 database connection.
 # artist_name: Name of the artist you are interested in. Defaults to Ed Sheeran.
-def plot_features_of_an_artist_over_time(conn, artist_name="Ed Sheeran"):
+def read_features_of_an_artist_over_time(conn, artist_name="Ed Sheeran"):
     query = f"""
-        SELECT
-            year,
-            avg_danceability AS danceability,
-            avg_energy AS energy,
-            avg_liveness AS liveness,
-            avg_valence AS valence
+        SELECT {FEATURE_COLUMNS}
         FROM v_artist_features_over_time
-        WHERE artist_name = '{artist_name}'
+        WHERE artist_name = ?
     """
-    df = pd.read_sql_query(sql=query, con=conn)
+    return read_sql_query(query, conn, params=(artist_name,))
+
+
+# Read the data behind the charts of many artists at once, in a single query.
+# conn: a sqlite3 database connection.
+# artist_names: names of the artists to read. Defaults to every artist.
+# The names are passed as one JSON array parameter, so there is no limit on their number.
+# Returns a DataFrame with an artist_name column, sorted by artist name and year.
+def read_features_of_artists_over_time(conn, artist_names=None):
+    clauses = [
+        f"SELECT artist_name, {FEATURE_COLUMNS}",
+        "FROM v_artist_features_over_time",
+    ]
+    params = ()
+    if artist_names is not None:
+        clauses.append("WHERE artist_name IN (SELECT value FROM json_each(?))")
+        params = (json.dumps(list(artist_names)),)
+    clauses.append("ORDER BY artist_name, year")
+    return read_sql_query("\n".join(clauses), conn, params=params)
+
+
+# Split the result of read_features_of_artists_over_time into one DataFrame per artist.
+# Yields (artist name, DataFrame in the format of read_features_of_an_artist_over_time).
+def group_features_by_artist(df):
+    for artist_name, artist_df in df.groupby("artist_name", sort=False):
+        yield artist_name, artist_df.drop(columns="artist_name").reset_index(drop=True)
+
+
+# Draw the features of an artist over time point chart from its data.
+# df: the DataFrame returned by read_features_of_an_artist_over_time.
+# artist_name: Name of the artist, shown in the title.
+def draw_features_of_an_artist_over_time(df, artist_name="Ed Sheeran"):
     point_plot = sns.pointplot(
         x="year",
         y="value",
@@ -27,7 +64,7 @@ def plot_features_of_an_artist_over_time(conn, artist_name="Ed Sheeran"):
     point_plot.set(
         xlabel="Year",
         ylabel="Value",
-        title="Song Features for Ed Sheeran Over The Years",
+        title=f"Song Features for {artist_name} Over The Years",
     )
 
     # Adjust the legends.
@@ -37,3 +74,12 @@ def plot_features_of_an_artist_over_time(conn, artist_name="Ed Sheeran"):
     # Need to close otherwise will mix with other figures.
     plt.close()
     return point_plot
+
+
+# Plot multi point chart showing features for an artist over time.
+# conn: a sqlite3 database connection.
+# artist_name: Name of the artist you are interested in. Defaults to Ed Sheeran.
+def plot_features_of_an_artist_over_time(conn, artist_name="Ed Sheeran"):
+    return draw_features_of_an_artist_over_time(
+        read_features_of_an_artist_over_time(conn, artist_name), artist_name
+    )
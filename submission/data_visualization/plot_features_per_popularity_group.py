@@ -1,27 +1,27 @@
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
+from data_visualization.query_cache import read_sql_query
 
-# Plot a point chart showing features per popularity group.
+# Read the data behind the features per popularity group point chart.
 # conn: a sqlite3 database connection.
-def plot_features_per_popularity_group(conn):
-    # Rename the popularity groups to be more clear.
+def read_features_per_popularity_group(conn):
+    # Show the popularity groups by their popularity range, e.g. "95+".
     query = """
         SELECT 
-            case
-                when popularity_group = 'tier_1' then '95+'
-                when popularity_group = 'tier_2' then '90+'
-                when popularity_group = 'tier_3' then '85+'
-                when popularity_group = 'tier_4' then '80+'
-                else '80-'
-            end as popularity_group,
+            popularity_label AS popularity_group,
             avg_energy AS energy,
             avg_danceability AS danceability,
             avg_liveness AS liveness,
             avg_valence AS valence
         FROM v_features_per_popularity_group
     """
-    df = pd.read_sql_query(sql=query, con=conn)
+    return read_sql_query(query, conn)
+
+
+# Draw the features per popularity group point chart from its data.
+# df: the DataFrame returned by read_features_per_popularity_group.
+def draw_features_per_popularity_group(df):
     point_plot = sns.pointplot(
         x="popularity_group",
         y="value",
@@ -42,3 +42,9 @@ def plot_features_per_popularity_group(conn):
     # Need to close otherwise will mix with other figures.
     plt.close()
     return point_plot
+
+
+# Plot a point chart showing features per popularity group.
+# conn: a sqlite3 database connection.
+def plot_features_per_popularity_group(conn):
+    return draw_features_per_popularity_group(read_features_per_popularity_group(conn))
@@ -1,10 +1,11 @@
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
+from data_visualization.query_cache import read_sql_query
 
-# Plot a bar chart showing the top artists in terms of followers.
+# Read the data behind the top artists by followers bar chart.
 # conn: a sqlite3 database connection.
-def plot_top_artists_by_followers(conn):
+def read_top_artists_by_followers(conn):
     # Pick the top 10 artists and change followers unit to millions.
     query = """
         SELECT 
@@ -13,8 +14,12 @@ def plot_top_artists_by_followers(conn):
         FROM v_top_artists_by_followers 
         LIMIT 10
     """
-    df = pd.read_sql_query(sql=query, con=conn)
+    return read_sql_query(query, conn)
 
+
+# Draw the top artists by followers bar chart from its data.
+# df: the DataFrame returned by read_top_artists_by_followers.
+def draw_top_artists_by_followers(df):
     bar_plot = sns.barplot(data=df, x="artist_name", y="followers", palette="rocket")
 
     # Adjust the figure size.
@@ -33,3 +38,9 @@ def plot_top_artists_by_followers(conn):
     # Need to close otherwise will mix with other figures.
     plt.close()
     return bar_plot
+
+
+# Plot a bar chart showing the top artists in terms of followers.
+# conn: a sqlite3 database connection.
+def plot_top_artists_by_followers(conn):
+    return draw_top_artists_by_followers(read_top_artists_by_followers(conn))
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import sqlite3
+import pandas as pd
+from instrumentation.run_metrics import metrics
+
+"""
+Read-through cache of query results, stored as Feather files on disk.
+
+A result is keyed by its SQL text and parameters, the database file, the database's load
+generation (bumped by every data_generation.py run and every change tracking consumer) and
+the SQL of its schema. A new load or a view created with new SQL therefore gives new keys, and the stale files age out of the size-bounded cache, least recently used
+first. PRAGMA data_version is not used: it only changes within the lifetime of a
+connection, so it can't tell two runs apart.
+
+Writes made outside data_generation.py (e.g. by hand in the sqlite3 shell) don't start a
+load generation. Clear the cache folder after such edits.
+
+The `query_cache` object is off until configured, so read_sql_query falls back to
+pd.read_sql_query. From a notebook:
+
+    from data_visualization.query_cache import query_cache
+    query_cache.configure("query_cache")
+"""
+
+# Default size bound of the cache folder.
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# ----- Helper Functions -----
+
+# What the results of a DB depend on, besides the query.
+# Returns (database file, load generation, hash of the schema SQL). The load generation is
+# None for DBs created before change tracking.
+# The schema SQL is hashed rather than PRAGMA schema_version read, as view_creation.py drops
+# and recreates every view with the same SQL on each run.
+def get_data_version(conn):
+    database_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    schema_sql = conn.execute(
+        """
+        SELECT group_concat(sql, ';')
+        FROM (SELECT sql FROM sqlite_master ORDER BY type, name)
+    """
+    ).fetchone()[0]
+    try:
+        load_generation = conn.execute(
+            "SELECT generation FROM load_generation"
+        ).fetchone()[0]
+    except sqlite3.OperationalError:
+        load_generation = None
+    schema_hash = hashlib.sha256((schema_sql or "").encode()).hexdigest()
+    return (database_file, load_generation, schema_hash)
+
+
+def get_cache_key(sql, params, data_version):
+    digest = hashlib.sha256()
+    digest.update(" ".join(sql.split()).encode())
+    digest.update(json.dumps(list(params), default=str).encode())
+    digest.update(json.dumps(data_version).encode())
+    return digest.hexdigest()
+
+
+# ----- Helper Functions End -----
+
+
+class QueryCache:
+    def __init__(self):
+        self.cache_dir = None
+        self.max_bytes = DEFAULT_MAX_BYTES
+
+    # Turn the cache on.
+    # cache_dir: folder holding the cached results. None turns the cache off.
+    # max_bytes: size bound of the folder. The least recently used results are evicted past it.
+    def configure(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    # Same as pd.read_sql_query, served from the cache when the DB hasn't changed.
+    # Returns a DataFrame with a default index.
+    def read_sql_query(self, sql, con, params=()):
+        if self.cache_dir is None:
+            return pd.read_sql_query(sql=sql, con=con, params=params)
+
+        key = get_cache_key(sql, params, get_data_version(con))
+        path = os.path.join(self.cache_dir, key + ".feather")
+        if os.path.exists(path):
+            metrics.increment("query_cache_hits")
+            # Touch the file, the eviction goes by last use.
+            os.utime(path)
+            return pd.read_feather(path)
+
+        metrics.increment("query_cache_misses")
+        df = pd.read_sql_query(sql=sql, con=con, params=params)
+        # Written under a temporary name first, so a reader never sees a partial file.
+        df.to_feather(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self.evict()
+        return df
+
+    # Delete the least recently used results until the folder fits in max_bytes.
+    # Returns the number of results deleted.
+    def evict(self):
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(".feather"):
+                stat = os.stat(os.path.join(self.cache_dir, file_name))
+                entries.append((stat.st_mtime, stat.st_size, file_name))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        num_evicted = 0
+        for _, size, file_name in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, file_name))
+            total_bytes -= size
+            num_evicted += 1
+
+        metrics.increment("query_cache_evictions", num_evicted)
+        return num_evicted
+
+
+# Shared by every read of the visualization and analytics modules.
+query_cache = QueryCache()
+
+
+def read_sql_query(sql, con, params=()):
+    return query_cache.read_sql_query(sql, con, params)
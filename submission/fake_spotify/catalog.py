@@ -0,0 +1,233 @@
+import random
+
+"""
+Synthetic Spotify catalog, generated on demand.
+
+Every artist, album, track and audio features object is derived from its position in the
+catalog and a seed, so the same catalog is rebuilt identically on every run without being
+held in memory, whatever its size. The objects have the shape of the Spotify Web API
+responses that the fetch_* functions read.
+
+Album and song names are drawn from pools smaller than the catalog, so the name based
+deduplication of albums and tracks has duplicates to remove, like in the real catalog.
+"""
+
+# ----- Helper Functions -----
+
+# Build a fixed-length ID from the kind of object and its position, e.g. "ar00000000000000000001f".
+def make_id(prefix, *positions):
+    return prefix + "x".join(f"{position:x}" for position in positions).rjust(
+        22 - len(prefix), "0"
+    )
+
+
+# Read the positions back from an ID built by make_id.
+# Returns None for an ID of another kind or not built by make_id.
+def parse_id(prefix, object_id):
+    if not object_id.startswith(prefix):
+        return None
+    try:
+        return [int(part, 16) for part in object_id[len(prefix) :].split("x")]
+    except ValueError:
+        return None
+
+
+# Spotify accepts both IDs and URIs (spotify:<kind>:<id>) wherever an ID is expected.
+def strip_uri(object_id):
+    return object_id.rsplit(":", 1)[-1]
+
+
+# ----- Helper Functions End -----
+
+
+# A deterministic synthetic catalog.
+# num_artists: number of artists in the catalog.
+# albums_per_artist: average number of albums per artist.
+# tracks_per_album: average number of tracks per album.
+# seed: changes every generated value while keeping the catalog's shape.
+class SyntheticCatalog:
+    def __init__(self, num_artists, albums_per_artist=4, tracks_per_album=10, seed=0):
+        self.num_artists = num_artists
+        self.albums_per_artist = albums_per_artist
+        self.tracks_per_album = tracks_per_album
+        self.seed = seed
+
+    # Names to use as seeds of the ingestion, one per artist.
+    def get_artist_names(self):
+        return [
+            self.get_artist_name(artist_index)
+            for artist_index in range(self.num_artists)
+        ]
+
+    def get_artist_name(self, artist_index):
+        return f"Fake Artist {artist_index}"
+
+    def get_artist_id(self, artist_index):
+        return make_id("ar", artist_index)
+
+    # Returns the index of the artist with this exact name (case insensitive), else None.
+    def find_artist_index(self, artist_name):
+        prefix = "fake artist "
+        if not artist_name.lower().startswith(prefix):
+            return None
+        try:
+            artist_index = int(artist_name[len(prefix) :])
+        except ValueError:
+            return None
+        return artist_index if 0 <= artist_index < self.num_artists else None
+
+    def get_artist(self, artist_id):
+        positions = parse_id("ar", strip_uri(artist_id))
+        if positions is None or len(positions) != 1:
+            return None
+        (artist_index,) = positions
+        if artist_index >= self.num_artists:
+            return None
+
+        rng = self._rng("artist", artist_index)
+        artist_id = make_id("ar", artist_index)
+        return {
+            "id": artist_id,
+            "name": self.get_artist_name(artist_index),
+            "external_urls": {
+                "spotify": f"https://open.spotify.com/artist/{artist_id}"
+            },
+            "genres": rng.sample(
+                ["pop", "rock", "hip hop", "jazz", "indie", "edm"], rng.randint(0, 2)
+            ),
+            "images": []
+            if rng.random() < 0.1
+            else [
+                {
+                    "url": f"https://i.scdn.co/image/{artist_id}",
+                    "height": 640,
+                    "width": 640,
+                }
+            ],
+            "followers": {"href": None, "total": int(rng.paretovariate(1.2) * 1000)},
+            "popularity": rng.randint(0, 100),
+            "type": "artist",
+            "uri": f"spotify:artist:{artist_id}",
+        }
+
+    # All album objects of an artist, in the simplified format of the artist_albums endpoint.
+    def get_artist_albums(self, artist_id):
+        artist = self.get_artist(artist_id)
+        if artist is None:
+            return None
+
+        artist_index = parse_id("ar", artist["id"])[0]
+        num_albums = self._rng("albums", artist_index).randint(
+            1, 2 * self.albums_per_artist - 1
+        )
+        return [
+            self.get_album(make_id("al", artist_index, album_index), with_tracks=False)
+            for album_index in range(num_albums)
+        ]
+
+    # An album object. with_tracks adds the first page of tracks, as the albums endpoint does.
+    def get_album(self, album_id, with_tracks=True):
+        positions = parse_id("al", strip_uri(album_id))
+        if positions is None or len(positions) != 2:
+            return None
+        artist_index, album_index = positions
+        if artist_index >= self.num_artists:
+            return None
+
+        rng = self._rng("album", artist_index, album_index)
+        album_id = make_id("al", artist_index, album_index)
+        album = {
+            "id": album_id,
+            "name": f"Fake Album {rng.randrange(self.num_artists * self.albums_per_artist // 2 + 1)}",
+            "external_urls": {"spotify": f"https://open.spotify.com/album/{album_id}"},
+            "images": []
+            if rng.random() < 0.05
+            else [
+                {
+                    "url": f"https://i.scdn.co/image/{album_id}",
+                    "height": 640,
+                    "width": 640,
+                }
+            ],
+            "release_date": f"{rng.randint(1960, 2022)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "release_date_precision": "day",
+            "total_tracks": rng.randint(1, 2 * self.tracks_per_album - 1),
+            "type": "album",
+            "album_type": "album",
+            "uri": f"spotify:album:{album_id}",
+            "artists": [self._get_simplified_artist(artist_index)],
+        }
+        if with_tracks:
+            album["tracks"] = self.get_album_tracks(album_id)
+        return album
+
+    # All track objects of an album, in the simplified format of the album_tracks endpoint.
+    def get_album_tracks(self, album_id):
+        positions = parse_id("al", strip_uri(album_id))
+        album = self.get_album(album_id, with_tracks=False)
+        if album is None:
+            return None
+
+        artist_index, album_index = positions
+        return [
+            self.get_track(make_id("tr", artist_index, album_index, track_index))
+            for track_index in range(album["total_tracks"])
+        ]
+
+    def get_track(self, track_id):
+        positions = parse_id("tr", strip_uri(track_id))
+        if positions is None or len(positions) != 3:
+            return None
+        artist_index, album_index, track_index = positions
+
+        rng = self._rng("track", artist_index, album_index, track_index)
+        track_id = make_id("tr", artist_index, album_index, track_index)
+        return {
+            "id": track_id,
+            "name": f"Fake Song {rng.randrange(self.num_artists * self.albums_per_artist * self.tracks_per_album // 2 + 1)}",
+            "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+            "duration_ms": rng.randint(60_000, 480_000),
+            "explicit": rng.random() < 0.15,
+            "disc_number": 1,
+            "track_number": track_index + 1,
+            "type": "track",
+            "uri": f"spotify:track:{track_id}",
+            "artists": [self._get_simplified_artist(artist_index)],
+        }
+
+    # Audio features of a track. About 2% of the tracks have none, like in the real catalog.
+    def get_audio_features(self, track_id):
+        track = self.get_track(track_id)
+        if track is None:
+            return None
+
+        rng = self._rng("features", *parse_id("tr", track["id"]))
+        if rng.random() < 0.02:
+            return None
+        return {
+            "id": track["id"],
+            "danceability": rng.random(),
+            "energy": rng.random(),
+            "instrumentalness": rng.random() ** 4,
+            "liveness": rng.random() ** 2,
+            "loudness": rng.uniform(-30.0, 0.0),
+            "speechiness": rng.random() ** 3,
+            "tempo": rng.uniform(60.0, 200.0),
+            "type": "audio_features",
+            "valence": rng.random(),
+            "uri": track["uri"],
+            "duration_ms": track["duration_ms"],
+        }
+
+    # Random numbers derived from the catalog seed and an object's position only.
+    def _rng(self, *key):
+        return random.Random(f"{self.seed}:{key}")
+
+    def _get_simplified_artist(self, artist_index):
+        artist_id = make_id("ar", artist_index)
+        return {
+            "id": artist_id,
+            "name": self.get_artist_name(artist_index),
+            "type": "artist",
+            "uri": f"spotify:artist:{artist_id}",
+        }
@@ -0,0 +1,181 @@
+import math
+import threading
+import time
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from spotipy.exceptions import SpotifyException
+
+"""
+Offline stand-in for spotipy.Spotify, serving a SyntheticCatalog.
+
+It implements the endpoints the ingestion uses with spotipy's method signatures, so it
+can replace the real client anywhere (including under RateLimitedSpotify and
+CachedSpotify). Each call can be slowed down by a fixed latency, list responses are paged
+with a "next" URL that next() follows, and calls over the rate limit fail with the same
+HTTP 429 SpotifyException (and Retry-After header) as the real API.
+"""
+
+# ----- Helper Functions -----
+
+# Build a paging object, as returned by the Spotify API for lists.
+# items: every item of the list.
+# endpoint, object_id: used to build the URL of the next page.
+def make_page(items, endpoint, object_id, limit, offset):
+    next_url = None
+    if offset + limit < len(items):
+        query = urlencode({"id": object_id, "limit": limit, "offset": offset + limit})
+        next_url = f"fake://{endpoint}?{query}"
+
+    return {
+        "href": f"fake://{endpoint}?id={object_id}",
+        "items": items[offset : offset + limit],
+        "limit": limit,
+        "next": next_url,
+        "offset": offset,
+        "previous": None,
+        "total": len(items),
+    }
+
+
+def raise_not_found(object_id):
+    raise SpotifyException(404, -1, f"non existing id: '{object_id}'")
+
+
+# ----- Helper Functions End -----
+
+
+# A fake Spotify client over a synthetic catalog.
+# catalog: a SyntheticCatalog.
+# latency: seconds each call takes, to simulate the network round trip.
+# rate_limit: maximum calls per second before answering 429, None for no limit.
+# Like the real API, the limit is counted over a rolling window (of 1 second here).
+class FakeSpotify:
+    def __init__(self, catalog, latency=0.0, rate_limit=None):
+        self.catalog = catalog
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.calls = {}
+        self.num_rate_limited = 0
+        self._call_times = []
+        self._lock = threading.Lock()
+
+    def search(self, q, limit=10, offset=0, type="artist", market=None):
+        self._start_call("search")
+        if type != "artist":
+            raise SpotifyException(400, -1, f"unsupported search type: {type}")
+
+        # Only "artist:<name>" queries are supported, the only kind the ingestion makes.
+        artist_name = q.split("artist:", 1)[-1].strip()
+        artist_index = self.catalog.find_artist_index(artist_name)
+        items = (
+            []
+            if artist_index is None
+            else [self.catalog.get_artist(self.catalog.get_artist_id(artist_index))]
+        )
+        return {"artists": make_page(items, "search", q, limit, offset)}
+
+    def artist(self, artist_id):
+        self._start_call("artist")
+        artist = self.catalog.get_artist(artist_id)
+        if artist is None:
+            raise_not_found(artist_id)
+        return artist
+
+    # At most 50 IDs per call, unknown IDs come back as None.
+    def artists(self, artists):
+        self._start_call("artists")
+        if len(artists) > 50:
+            raise SpotifyException(400, -1, "too many ids requested")
+        return {
+            "artists": [self.catalog.get_artist(artist_id) for artist_id in artists]
+        }
+
+    def artist_albums(
+        self,
+        artist_id,
+        album_type=None,
+        include_groups=None,
+        country=None,
+        limit=20,
+        offset=0,
+    ):
+        self._start_call("artist_albums")
+        albums = self.catalog.get_artist_albums(artist_id)
+        if albums is None:
+            raise_not_found(artist_id)
+        return make_page(albums, "artist_albums", artist_id, limit, offset)
+
+    # At most 20 IDs per call, unknown IDs come back as None.
+    def albums(self, albums, market=None):
+        self._start_call("albums")
+        if len(albums) > 20:
+            raise SpotifyException(400, -1, "too many ids requested")
+
+        full_albums = []
+        for album_id in albums:
+            album = self.catalog.get_album(album_id)
+            if album is not None:
+                # The tracks of a full album object are paged 50 at a time.
+                album["tracks"] = make_page(
+                    album["tracks"], "album_tracks", album["id"], 50, 0
+                )
+            full_albums.append(album)
+        return {"albums": full_albums}
+
+    def album_tracks(self, album_id, limit=50, offset=0, market=None):
+        self._start_call("album_tracks")
+        tracks = self.catalog.get_album_tracks(album_id)
+        if tracks is None:
+            raise_not_found(album_id)
+        return make_page(tracks, "album_tracks", album_id, limit, offset)
+
+    # At most 100 IDs per call, unknown IDs and tracks without features come back as None.
+    def audio_features(self, tracks=[]):
+        self._start_call("audio_features")
+        if len(tracks) > 100:
+            raise SpotifyException(400, -1, "too many ids requested")
+        return [self.catalog.get_audio_features(track_id) for track_id in tracks]
+
+    # Fetch the next page of a paged result, like spotipy.Spotify.next.
+    def next(self, result):
+        if result["next"] is None:
+            return None
+
+        url = urlparse(result["next"])
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        page_method = getattr(self, url.netloc)
+        if url.netloc == "search":
+            return page_method(
+                q=query["id"], limit=int(query["limit"]), offset=int(query["offset"])
+            )["artists"]
+        return page_method(
+            query["id"], limit=int(query["limit"]), offset=int(query["offset"])
+        )
+
+    # Number of calls per endpoint and of calls answered with 429.
+    def report(self):
+        return {"calls": dict(self.calls), "rate_limited": self.num_rate_limited}
+
+    # Count the call, answer 429 if it goes over the rate limit, then wait for the latency.
+    def _start_call(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+            if self.rate_limit is not None:
+                now = time.monotonic()
+                self._call_times = [t for t in self._call_times if now - t < 1.0]
+                if len(self._call_times) >= self.rate_limit:
+                    self.num_rate_limited += 1
+                    retry_after = 1.0 - (now - self._call_times[0])
+                    raise SpotifyException(
+                        429,
+                        -1,
+                        "API rate limit exceeded",
+                        headers={
+                            "Retry-After": str(math.ceil(retry_after * 100) / 100)
+                        },
+                    )
+                self._call_times.append(now)
+
+        if self.latency > 0:
+            time.sleep(self.latency)
@@ -0,0 +1,298 @@
+import atexit
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
+
+"""
+Metrics of a run, collected in-process and written as a JSON report plus a Prometheus
+textfile (for node_exporter's textfile collector) when the script exits.
+
+    stages      wall time per stage, with the peak RSS (and traced memory) at its end
+    counters    API calls, retries and cache hits per endpoint, rows fetched, deduplicated
+                and written per table, seconds spent writing per table...
+    statements  SQLite time and number of executions per statement
+
+Every module records into the shared `metrics` object, so nothing has to be passed
+around. Profiling with cProfile and tracing allocations with tracemalloc are opt-in.
+"""
+
+# Prefix of the Prometheus metric names.
+PROMETHEUS_PREFIX = "spotify_pipeline"
+
+# Statements are keyed by their whitespace-normalized SQL, cut to this length.
+MAX_STATEMENT_LENGTH = 200
+
+# ----- Helper Functions -----
+
+# Peak resident set size of the process so far, in bytes. None where it can't be read.
+def get_peak_rss_bytes():
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+def normalize_statement(sql):
+    return " ".join(sql.split())[:MAX_STATEMENT_LENGTH]
+
+
+# Format labels the Prometheus way: {key="value",...}.
+def format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " "))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+# ----- Helper Functions End -----
+
+
+# Registry of the metrics of one run. Safe to use from several threads.
+class RunMetrics:
+    def __init__(self):
+        self.profile_dir = None
+        self.trace_memory = False
+        self.started_at = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.statements = {}
+        self._lock = threading.Lock()
+
+    # Turn on the opt-in hooks.
+    # profile_dir: write a cProfile file per stage into this folder. None to not profile.
+    # trace_memory: record the peak memory allocated by Python during each stage with tracemalloc.
+    def configure(self, profile_dir=None, trace_memory=False):
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+        if profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    # Add value to a counter.
+    # name: the counter, e.g. "api_calls".
+    # labels: what the value is about, e.g. endpoint="search".
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    # Add the time spent in the block to a counter, in seconds.
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.increment(name, time.perf_counter() - start, **labels)
+
+    # Time a stage of the run, profiling it if configured.
+    # The cProfile profile covers the calling thread only: run with --max-workers 1 to
+    # include the API calls. Memory is traced process wide, so the traced peak of stages
+    # running at the same time (streaming) covers all of them.
+    @contextmanager
+    def stage(self, name):
+        profiler = None
+        if self.profile_dir is not None:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Only one profiler can be active at a time on Python 3.12+.
+                profiler = None
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(os.path.join(self.profile_dir, f"{name}.prof"))
+
+            with self._lock:
+                stage = self.stages.setdefault(name, {"seconds": 0.0, "runs": 0})
+                stage["seconds"] += elapsed
+                stage["runs"] += 1
+                stage["peak_rss_bytes"] = get_peak_rss_bytes()
+                if self.trace_memory:
+                    stage["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+
+    # Time a generator stage: from its first item until it is exhausted, in the thread
+    # iterating it.
+    def timed_events(self, name, events):
+        with self.stage(name):
+            yield from events
+
+    # sql: the statement run.
+    # seconds: time spent executing it and fetching its rows.
+    def record_statement(self, sql, seconds):
+        statement = normalize_statement(sql)
+        with self._lock:
+            timing = self.statements.setdefault(
+                statement, {"seconds": 0.0, "executions": 0}
+            )
+            timing["seconds"] += seconds
+            timing["executions"] += 1
+
+    # Build the JSON report of the run.
+    # script: name of the script that ran.
+    def build_report(self, script):
+        with self._lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counters.setdefault(name, []).append(
+                    {"labels": dict(labels), "value": value}
+                )
+
+            # Rows written per second of writing, per table.
+            write_seconds = {
+                labels: value
+                for (name, labels), value in self.counters.items()
+                if name == "db_write_seconds"
+            }
+            write_rates = [
+                {"labels": dict(labels), "value": value / write_seconds[labels]}
+                for (name, labels), value in sorted(self.counters.items())
+                if name == "rows_written" and write_seconds.get(labels, 0) > 0
+            ]
+            if len(write_rates) > 0:
+                counters["rows_written_per_second"] = write_rates
+
+            return {
+                "script": script,
+                "started_at": self.started_at,
+                "wall_seconds": time.time() - self.started_at,
+                "peak_rss_bytes": get_peak_rss_bytes(),
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "counters": counters,
+                # Slowest statements first.
+                "statements": sorted(
+                    ({"sql": sql, **timing} for sql, timing in self.statements.items()),
+                    key=lambda timing: timing["seconds"],
+                    reverse=True,
+                ),
+            }
+
+    # Render a report in the Prometheus text exposition format.
+    def build_prometheus_text(self, report):
+        script_label = ("script", report["script"])
+        lines = []
+
+        def add_metric(name, metric_type, help_text, samples):
+            full_name = f"{PROMETHEUS_PREFIX}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {metric_type}")
+            for labels, value in samples:
+                lines.append(
+                    f"{full_name}{format_labels([script_label, *labels])} {value}"
+                )
+
+        add_metric(
+            "run_wall_seconds",
+            "gauge",
+            "Wall time of the run.",
+            [([], report["wall_seconds"])],
+        )
+        if report["peak_rss_bytes"] is not None:
+            add_metric(
+                "peak_rss_bytes",
+                "gauge",
+                "Peak resident set size of the run.",
+                [([], report["peak_rss_bytes"])],
+            )
+        add_metric(
+            "stage_seconds",
+            "gauge",
+            "Wall time per stage.",
+            [
+                ([("stage", name)], stage["seconds"])
+                for name, stage in report["stages"].items()
+            ],
+        )
+        for name, samples in report["counters"].items():
+            add_metric(
+                name,
+                "gauge",
+                f"{name.replace('_', ' ').capitalize()}.",
+                [
+                    (sorted(sample["labels"].items()), sample["value"])
+                    for sample in samples
+                ],
+            )
+        add_metric(
+            "sqlite_statement_seconds",
+            "gauge",
+            "SQLite time per statement.",
+            [
+                ([("statement", timing["sql"])], timing["seconds"])
+                for timing in report["statements"]
+            ],
+        )
+        return "\n".join(lines) + "\n"
+
+    # Write <script>_report.json and <script>.prom into metrics_dir.
+    def write_reports(self, script, metrics_dir):
+        os.makedirs(metrics_dir, exist_ok=True)
+        report = self.build_report(script)
+
+        with open(os.path.join(metrics_dir, f"{script}_report.json"), "w") as file:
+            json.dump(report, file, indent=2)
+
+        # Write then rename, so the textfile collector never reads a partial file.
+        prometheus_path = os.path.join(metrics_dir, f"{script}.prom")
+        with open(prometheus_path + ".tmp", "w") as file:
+            file.write(self.build_prometheus_text(report))
+        os.replace(prometheus_path + ".tmp", prometheus_path)
+
+
+# The metrics of the current run, shared by every module.
+metrics = RunMetrics()
+
+
+# Add the instrumentation options to a script's argument parser.
+def add_instrumentation_arguments(parser):
+    parser.add_argument(
+        "--metrics-dir",
+        default="metrics",
+        help="Folder receiving the JSON run report and the Prometheus textfile.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Write a cProfile file per stage into <metrics-dir>/profiles.",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Record the peak Python memory of each stage with tracemalloc (slower).",
+    )
+
+
+# Configure the metrics from the parsed arguments and write the reports when the script exits,
+# including when it fails.
+# script: name of the script, used to name the report files.
+def start_run_metrics(script, args):
+    metrics.configure(
+        profile_dir=os.path.join(args.metrics_dir, "profiles")
+        if args.profile
+        else None,
+        trace_memory=args.trace_memory,
+    )
+    atexit.register(metrics.write_reports, script, args.metrics_dir)
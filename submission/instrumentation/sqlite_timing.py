@@ -0,0 +1,100 @@
+import sqlite3
+import time
+from instrumentation.run_metrics import metrics
+
+"""
+sqlite3 connection recording the time spent on each statement into the run metrics.
+
+Executing a SELECT only steps to its first row, so the time spent fetching the rows is
+added to the statement as well. Works with pandas' read_sql_query and to_sql, which go
+through the connection's cursors.
+"""
+
+
+# A cursor timing its statements and their fetches.
+class TimedCursor(sqlite3.Cursor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._statement = None
+        self._seconds = 0.0
+
+    def execute(self, sql, parameters=()):
+        self._start_statement(sql)
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._start_statement(sql)
+        return self._timed(super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        self._start_statement(sql_script)
+        return self._timed(super().executescript, sql_script)
+
+    def fetchone(self):
+        return self._timed(super().fetchone)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._timed(super().fetchmany)
+        return self._timed(super().fetchmany, size)
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._record()
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return super().__next__()
+        except StopIteration:
+            self._record()
+            raise
+        finally:
+            self._seconds += time.perf_counter() - start
+
+    def close(self):
+        self._record()
+        super().close()
+
+    def __del__(self):
+        self._record()
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._seconds += time.perf_counter() - start
+
+    # Record the previous statement of the cursor and start timing a new one.
+    def _start_statement(self, sql):
+        self._record()
+        self._statement = sql
+
+    def _record(self):
+        if self._statement is not None:
+            metrics.record_statement(self._statement, self._seconds)
+        self._statement = None
+        self._seconds = 0.0
+
+
+# A connection whose cursors (including the ones of execute shortcuts) are TimedCursors.
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+# Open a database connection recording its statement timings.
+# Takes the same arguments as sqlite3.connect.
+def connect_timed(database, **kwargs):
+    return sqlite3.connect(database, factory=TimedConnection, **kwargs)
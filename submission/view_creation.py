@@ -1,31 +1,25 @@
-import sqlite3
-from view_creation.top_artists_by_followers import *
-from view_creation.top_songs_by_artist_duration import *
-from view_creation.top_songs_by_artist_tempo import *
-from view_creation.features_per_popularity_group import *
-from view_creation.artist_features_over_time import *
+import argparse
+from view_creation.command import add_arguments, run
+from instrumentation.run_metrics import (
+    add_instrumentation_arguments,
+    start_run_metrics,
+)
 
 """
 Run this file to create the views.
-"""
-
-if __name__ == "__main__":
-    db_conn = sqlite3.connect("spotify.db")
-    cur = db_conn.cursor()
-
-    print("Established DB connection")
 
-    create_top_artists_by_followers_view(cur)
-    print("Created top artists by followers view")
+Use --check-query-plans to fail if any view joins a table through a full scan.
 
-    create_top_songs_by_artist_duration_view(cur)
-    print("Created top songs by artist duration view")
+Use --materialize to also store the analytic views as indexed mv_* tables. Rerunning it
+after a load only recomputes the artists touched by that load.
 
-    create_top_songs_by_artist_tempo_view(cur)
-    print("Created top songs by artist tempo view")
-
-    create_features_per_popularity_group_view(cur)
-    print("Created features per popularity group view")
+The time spent per view and per SQLite statement is written to metrics/ (see --metrics-dir).
+"""
 
-    create_artist_features_over_time_view(cur)
-    print("Created artist features over time view")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the views.")
+    add_arguments(parser)
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    start_run_metrics("view_creation", args)
+    run(args)
@@ -1,35 +1,25 @@
-# High level overview:
-#
-# 1) Delete v_artist_features_over_time if exists. This ensures complete overwrite when rerun.
-# 2) Join artist + album + track + track_feature tables to link track features to artists.
-# 3) Extract year from album's release_date. Note that some release_date are years already, which would result in strftime('%Y', al.release_date) < 0.
-# 4) Group by artist + year to get each artist's each year's records.
-# 5) Aggregate the groups to get per artist + year features
-# 6) Sort by artist names in ascending order and years in ascending order.
-def create_artist_features_over_time_view(cur):
-    cur.execute(
-        """
-        DROP VIEW IF EXISTS v_artist_features_over_time
-    """
+# Build the SELECT behind v_artist_features_over_time.
+# artist_id_filter: optional subquery returning artist IDs. Only those artists are computed, and they
+# are filtered before the joins, which keeps incremental refreshes of the materialized view cheap.
+def build_artist_features_over_time_query(artist_id_filter=None):
+    artist_filter = (
+        f"WHERE a.artist_id IN ({artist_id_filter})"
+        if artist_id_filter is not None
+        else ""
     )
 
-    cur.execute(
-        """
-        CREATE VIEW v_artist_features_over_time
-        AS
+    return f"""
             WITH artist_song_with_year AS (
                 SELECT
                     a.artist_name,
-                    CASE
-                        WHEN CAST(strftime('%Y', al.release_date) AS INTEGER)  < 0 THEN al.release_date
-                        ELSE strftime('%Y', al.release_date)
-                    END AS release_year,
+                    al.release_year,
                     t.song_name AS song_name,
                     tf.*
                 FROM artist AS a
                     INNER JOIN album AS al ON (a.artist_id = al.artist_id)
                     INNER JOIN track AS t ON (al.album_id = t.album_id)
                     INNER JOIN track_feature AS tf on (t.track_id = tf.track_id)
+                {artist_filter}
             )
             SELECT 
                 artist_name, 
@@ -47,4 +37,28 @@ def create_artist_features_over_time_view(cur):
             GROUP BY artist_name, release_year
             ORDER BY artist_name ASC, year ASC
     """
+
+
+# High level overview:
+#
+# 1) Delete v_artist_features_over_time if exists. This ensures complete overwrite when rerun.
+# 2) Join artist + album + track + track_feature tables to link track features to artists.
+# 3) Take the year of each album from its release_year column, computed from release_date (at year, month or day
+#    precision) by the loaders.
+# 4) Group by artist + year to get each artist's each year's records.
+# 5) Aggregate the groups to get per artist + year features
+# 6) Sort by artist names in ascending order and years in ascending order.
+def create_artist_features_over_time_view(cur):
+    cur.execute(
+        """
+        DROP VIEW IF EXISTS v_artist_features_over_time
+    """
+    )
+
+    cur.execute(
+        f"""
+        CREATE VIEW v_artist_features_over_time
+        AS
+        {build_artist_features_over_time_query()}
+    """
     )
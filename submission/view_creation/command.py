@@ -0,0 +1,189 @@
+from view_creation.top_artists_by_followers import create_top_artists_by_followers_view
+from view_creation.top_songs_by_artist_duration import (
+    create_top_songs_by_artist_duration_view,
+)
+from view_creation.top_songs_by_artist_tempo import (
+    create_top_songs_by_artist_tempo_view,
+)
+from view_creation.features_per_popularity_group import (
+    create_features_per_popularity_group_view,
+)
+from view_creation.artist_features_over_time import (
+    create_artist_features_over_time_view,
+)
+from view_creation.query_plan_check import check_view_query_plans
+from view_creation.materialized_views import refresh_materialized_views
+from view_creation.cube import refresh_cube
+from view_creation.rankings import (
+    DEFAULT_RANK_DEPTH,
+    RANKABLE_METRICS,
+    refresh_rankings,
+)
+from data_generation.schema import create_schema
+from data_generation.tier_aggregates import (
+    rebuild_deferred_tier_aggregates,
+    set_popularity_tiers,
+)
+from instrumentation.run_metrics import metrics
+from instrumentation.sqlite_timing import connect_timed
+
+"""
+The views command, run by view_creation.py and by `cli.py views`.
+
+It only needs sqlite3 and the SQL of the views, so it starts fast: nothing here imports
+pandas or the plotting libraries, and numpy is only imported to build the similarity index.
+"""
+
+
+# Add the views options to an argument parser.
+def add_arguments(parser):
+    parser.add_argument(
+        "--db-path",
+        default="spotify.db",
+        help="SQLite file to create the views in.",
+    )
+    parser.add_argument(
+        "--check-query-plans",
+        action="store_true",
+        help="Fail if any view joins a table through a full scan instead of an index.",
+    )
+    parser.add_argument(
+        "--popularity-tiers",
+        nargs="*",
+        type=int,
+        metavar="MIN_POPULARITY",
+        help="Lowest artist popularity of each tier but the last, in decreasing order, "
+        "e.g. 95 90 85 80 (the default). Kept in the DB for later runs.",
+    )
+    parser.add_argument(
+        "--materialize",
+        action="store_true",
+        help="Store the analytic views as indexed tables, refreshing only changed artists.",
+    )
+    parser.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help="With --materialize, --rankings, --cube or --similarity-index, rebuild them "
+        "from scratch.",
+    )
+    parser.add_argument(
+        "--rankings",
+        nargs="*",
+        choices=list(RANKABLE_METRICS),
+        metavar="METRIC",
+        help="Keep a table of the top tracks per artist for these metrics and every metric "
+        f"ranked before, refreshing only changed artists. Any of: {', '.join(RANKABLE_METRICS)}.",
+    )
+    parser.add_argument(
+        "--rank-depth",
+        type=int,
+        default=DEFAULT_RANK_DEPTH,
+        help="Number of top tracks kept per artist and metric.",
+    )
+    parser.add_argument(
+        "--cube",
+        action="store_true",
+        help="Keep the per artist and release year feature aggregates behind "
+        "view_creation.cube.rollup, refreshing only changed artists.",
+    )
+    parser.add_argument(
+        "--similarity-index",
+        action="store_true",
+        help="Build the audio feature index behind view_creation.similarity, "
+        "again only if the tracks changed.",
+    )
+    parser.add_argument(
+        "--similarity-index-dir",
+        default="similarity_index",
+        help="Folder of the similarity index files.",
+    )
+
+
+# Create the views.
+# args: the parsed arguments, see add_arguments.
+def run(args):
+    db_conn = connect_timed(args.db_path)
+    cur = db_conn.cursor()
+
+    print("Established DB connection")
+
+    # Make sure the join indexes the views rely on exist (migrates databases created without them).
+    with metrics.stage("create_schema"):
+        create_schema(db_conn)
+
+    # A load killed while the tier aggregates were deferred left them stale.
+    with metrics.stage("rebuild_deferred_tier_aggregates"):
+        if rebuild_deferred_tier_aggregates(db_conn):
+            print("Rebuilt the tier aggregates left stale by an interrupted load")
+
+    if args.popularity_tiers is not None:
+        with metrics.stage("set_popularity_tiers"):
+            if set_popularity_tiers(db_conn, args.popularity_tiers):
+                print(f"Set the popularity tiers to {args.popularity_tiers}")
+
+    with metrics.stage("create_top_artists_by_followers_view"):
+        create_top_artists_by_followers_view(cur)
+    print("Created top artists by followers view")
+
+    with metrics.stage("create_top_songs_by_artist_duration_view"):
+        create_top_songs_by_artist_duration_view(cur)
+    print("Created top songs by artist duration view")
+
+    with metrics.stage("create_top_songs_by_artist_tempo_view"):
+        create_top_songs_by_artist_tempo_view(cur)
+    print("Created top songs by artist tempo view")
+
+    with metrics.stage("create_features_per_popularity_group_view"):
+        create_features_per_popularity_group_view(cur)
+    print("Created features per popularity group view")
+
+    with metrics.stage("create_artist_features_over_time_view"):
+        create_artist_features_over_time_view(cur)
+    print("Created artist features over time view")
+
+    if args.check_query_plans:
+        with metrics.stage("check_view_query_plans"):
+            check_view_query_plans(cur)
+        print("All views join through indexes")
+
+    if args.materialize:
+        with metrics.stage("refresh_materialized_views"):
+            num_artists = refresh_materialized_views(cur, full=args.full_refresh)
+        if num_artists is None:
+            print("Built materialized views from scratch")
+        else:
+            print(f"Refreshed materialized views for {num_artists} changed artists")
+
+    if args.rankings is not None:
+        with metrics.stage("refresh_rankings"):
+            num_artists_per_metric = refresh_rankings(
+                cur, args.rankings, args.rank_depth, full=args.full_refresh
+            )
+        for metric, num_artists in num_artists_per_metric.items():
+            if num_artists is None:
+                print(f"Ranked tracks by {metric} from scratch")
+            else:
+                print(
+                    f"Ranked tracks by {metric} again for {num_artists} changed artists"
+                )
+
+    if args.cube:
+        with metrics.stage("refresh_cube"):
+            num_artists = refresh_cube(cur, full=args.full_refresh)
+        if num_artists is None:
+            print("Built the cube from scratch")
+        else:
+            print(f"Refreshed the cube for {num_artists} changed artists")
+
+    if args.similarity_index:
+        # Imported here, since it needs numpy.
+        from view_creation.similarity import refresh_similarity_index
+
+        with metrics.stage("refresh_similarity_index"):
+            rebuilt = refresh_similarity_index(
+                db_conn, args.similarity_index_dir, full=args.full_refresh
+            )
+        if rebuilt:
+            print(f"Built the similarity index in {args.similarity_index_dir}")
+        else:
+            print("The similarity index is up to date")
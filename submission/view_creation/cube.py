@@ -0,0 +1,288 @@
+import hashlib
+from data_generation.schema import TRACK_FEATURE_DTYPE
+from data_generation.change_tracking import (
+    get_changed_artist_ids,
+    mark_changes_consumed,
+)
+
+# High level overview:
+#
+# 1) cube_fact holds, for every (artist, release year), the number of tracks and the non NULL count, mean and M2
+#    (sum of squared differences from the mean) of every audio feature, next to the artist's name, genre and
+#    popularity tier. M2 is summed around the cell's own mean, which keeps the variance accurate where a sum of
+#    squares minus the squared sum would cancel out.
+# 2) Any roll-up over those dimensions (features per genre per year, per tier per year, per artist, ...) is a GROUP BY
+#    over cube_fact: means and variances are merged from the cells with Chan et al.'s parallel formula, so no slice
+#    reads the base tables. Use rollup() rather than writing a new view.
+# 3) The first build (or a change of the cube's query) fills the table from scratch.
+# 4) On refresh, only the artists stamped by the change tracking triggers since the last refresh are recomputed,
+#    under the "cube" change tracking consumer. Popularity tier changes rewrite artist.popularity_tier, which stamps
+#    the artists moved to another tier.
+
+CHANGE_CONSUMER = "cube"
+
+# Dimensions a roll-up can group and filter on, and the grain of cube_fact (artist_id, release_year).
+CUBE_DIMENSIONS = [
+    "artist_id",
+    "artist_name",
+    "genre",
+    "popularity_tier",
+    "release_year",
+]
+
+# The numeric audio features aggregated.
+CUBE_FEATURES = [
+    column
+    for column, sqlite_type in TRACK_FEATURE_DTYPE.items()
+    if sqlite_type == "REAL"
+]
+
+# Artists to recompute during a refresh.
+REFRESH_ARTIST_IDS = "SELECT artist_id FROM temp.cube_refresh_artist"
+
+# ----- Helper Functions -----
+
+
+# Fingerprint of the cube's query. A different fingerprint means the stored rows are stale.
+def get_cube_fingerprint():
+    return hashlib.sha256(build_cube_query().encode()).hexdigest()
+
+
+def table_exists(cur, table_name):
+    row = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+    ).fetchone()
+    return row is not None
+
+
+# Rebuild cube_fact from scratch.
+def build_cube_table(cur):
+    feature_columns = [
+        f"count_{feature} INTEGER NOT NULL, mean_{feature} REAL, m2_{feature} REAL NOT NULL"
+        for feature in CUBE_FEATURES
+    ]
+
+    cur.execute("DROP TABLE IF EXISTS cube_fact")
+    cur.execute(
+        f"""
+        CREATE TABLE cube_fact (
+            artist_id TEXT NOT NULL,
+            release_year INTEGER,
+            artist_name TEXT,
+            genre TEXT,
+            popularity_tier TEXT,
+            num_tracks INTEGER NOT NULL,
+            {", ".join(feature_columns)}
+        )
+    """
+    )
+    cur.execute("CREATE INDEX ix_cube_fact_artist_id ON cube_fact (artist_id)")
+    cur.execute(f"INSERT INTO cube_fact {build_cube_query()}")
+
+    cur.execute(
+        """
+        INSERT INTO cube_state (id, fingerprint) VALUES (1, ?)
+        ON CONFLICT (id) DO UPDATE SET fingerprint = excluded.fingerprint
+    """,
+        (get_cube_fingerprint(),),
+    )
+
+
+# Recompute the rows of the artists listed in temp.cube_refresh_artist. Rows of deleted artists
+# go too, since the delete triggers stamp them.
+def refresh_artists_in_cube(cur):
+    cur.execute(f"DELETE FROM cube_fact WHERE artist_id IN ({REFRESH_ARTIST_IDS})")
+    cur.execute(f"INSERT INTO cube_fact {build_cube_query(REFRESH_ARTIST_IDS)}")
+
+
+def check_dimensions(dimensions):
+    for dimension in dimensions:
+        if dimension not in CUBE_DIMENSIONS:
+            raise ValueError(
+                f"Can't roll up by {dimension!r}, choose from {', '.join(CUBE_DIMENSIONS)}"
+            )
+
+
+# ----- Helper Functions End -----
+
+
+# Build the SELECT of the cube_fact rows: one per artist and release year.
+# artist_id_filter: optional subquery returning artist IDs. Only those artists are computed, and they
+# are filtered before the joins.
+def build_cube_query(artist_id_filter=None):
+    artist_filter = (
+        f"WHERE a.artist_id IN ({artist_id_filter})"
+        if artist_id_filter is not None
+        else ""
+    )
+    # The mean of each cell is taken first, over a window, then M2 around it.
+    feature_values = [
+        f"tf.{feature}, AVG(tf.{feature}) OVER cell AS cell_mean_{feature}"
+        for feature in CUBE_FEATURES
+    ]
+    # TOTAL is 0.0 rather than NULL when every value is NULL, so M2 always adds up.
+    # AVG is NULL without values.
+    feature_aggregates = [
+        f"COUNT({feature}), AVG({feature}), "
+        f"TOTAL(({feature} - cell_mean_{feature}) * ({feature} - cell_mean_{feature}))"
+        for feature in CUBE_FEATURES
+    ]
+
+    return f"""
+            SELECT
+                artist_id,
+                release_year,
+                artist_name,
+                genre,
+                popularity_tier,
+                COUNT(*),
+                {", ".join(feature_aggregates)}
+            FROM (
+                SELECT
+                    a.artist_id,
+                    al.release_year,
+                    a.artist_name,
+                    a.genre,
+                    a.popularity_tier,
+                    {", ".join(feature_values)}
+                FROM artist AS a
+                    INNER JOIN album AS al ON (a.artist_id = al.artist_id)
+                    INNER JOIN track AS t ON (al.album_id = t.album_id)
+                    INNER JOIN track_feature AS tf ON (t.track_id = tf.track_id)
+                {artist_filter}
+                WINDOW cell AS (PARTITION BY a.artist_id, al.release_year)
+            )
+            GROUP BY artist_id, release_year
+    """
+
+
+# Build or bring up to date cube_fact. Only the artists changed since the previous refresh are
+# recomputed. The table is rebuilt from scratch when it doesn't exist yet, when its query changed
+# or when full is True.
+# cur: a sqlite3 cursor.
+# full: rebuild the table from scratch.
+# Returns the number of artists recomputed, or None after a rebuild.
+def refresh_cube(cur, full=False):
+    db_conn = cur.connection
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cube_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            fingerprint TEXT NOT NULL
+        )
+    """
+    )
+    row = cur.execute("SELECT fingerprint FROM cube_state").fetchone()
+    changed_artist_ids = get_changed_artist_ids(db_conn, CHANGE_CONSUMER)
+
+    with db_conn:
+        if (
+            full
+            or changed_artist_ids is None
+            or not table_exists(cur, "cube_fact")
+            or row is None
+            or row[0] != get_cube_fingerprint()
+        ):
+            build_cube_table(cur)
+            num_artists = None
+        else:
+            if len(changed_artist_ids) > 0:
+                cur.execute("DROP TABLE IF EXISTS temp.cube_refresh_artist")
+                cur.execute(
+                    "CREATE TEMP TABLE cube_refresh_artist (artist_id TEXT PRIMARY KEY)"
+                )
+                cur.executemany(
+                    "INSERT INTO temp.cube_refresh_artist VALUES (?)",
+                    [(artist_id,) for artist_id in changed_artist_ids],
+                )
+                refresh_artists_in_cube(cur)
+            num_artists = len(changed_artist_ids)
+
+        mark_changes_consumed(db_conn, CHANGE_CONSUMER)
+
+    return num_artists
+
+
+# Build the roll-up query of the cube over some dimensions.
+# by: the dimensions to group on, from CUBE_DIMENSIONS. Empty for a single grand total row.
+# features: the features to aggregate, from CUBE_FEATURES. Defaults to all of them.
+# filters: dimension -> a value, or a list of values, the rows must have. None matches NULL.
+# Returns (query, parameters). The query returns the by columns, num_artists, num_tracks, then
+# count_<feature>, mean_<feature> and var_<feature> (the sample variance) for each feature,
+# ordered by the by columns.
+def build_rollup_query(by, features=None, filters=None):
+    features = CUBE_FEATURES if features is None else features
+    filters = {} if filters is None else filters
+    check_dimensions(list(by) + list(filters))
+    for feature in features:
+        if feature not in CUBE_FEATURES:
+            raise ValueError(
+                f"Can't aggregate {feature!r}, choose from {', '.join(CUBE_FEATURES)}"
+            )
+
+    # Chan et al.: the M2 of a group is the sum of the cells' M2 plus, for each cell, its count
+    # times its squared distance to the group mean. The group mean comes from a window over the
+    # cells, so the distances are taken directly rather than as a difference of large sums.
+    group_means = []
+    feature_columns = []
+    for feature in features:
+        count, weighted_means = (
+            f"SUM(count_{feature})",
+            f"SUM(count_{feature} * mean_{feature})",
+        )
+        distance = f"(mean_{feature} - group_mean_{feature})"
+        group_means.append(
+            f"{weighted_means} OVER grp / {count} OVER grp AS group_mean_{feature}"
+        )
+        # A division by 0 is NULL: no mean without values, no variance below 2 values.
+        feature_columns.append(
+            f"{count} AS count_{feature}, "
+            f"{weighted_means} / {count} AS mean_{feature}, "
+            f"(SUM(m2_{feature}) + SUM(count_{feature} * {distance} * {distance})) "
+            f"/ ({count} - 1) AS var_{feature}"
+        )
+
+    conditions = []
+    parameters = []
+    for dimension, values in filters.items():
+        values = values if isinstance(values, (list, tuple, set)) else [values]
+        alternatives = [f"{dimension} IS NULL" for value in values if value is None]
+        values = [value for value in values if value is not None]
+        if len(values) > 0:
+            alternatives.append(f"{dimension} IN ({', '.join('?' for _ in values)})")
+            parameters.extend(values)
+        conditions.append(f"({' OR '.join(alternatives) or '0'})")
+
+    by_columns = "".join(f"{dimension}, " for dimension in by)
+    where = f"WHERE {' AND '.join(conditions)}" if len(conditions) > 0 else ""
+    group_by = (
+        f"GROUP BY {', '.join(by)} ORDER BY {', '.join(by)}" if len(by) > 0 else ""
+    )
+
+    query = f"""
+        SELECT
+            {by_columns}
+            COUNT(DISTINCT artist_id) AS num_artists,
+            SUM(num_tracks) AS num_tracks,
+            {", ".join(feature_columns)}
+        FROM (
+            SELECT *, {", ".join(group_means)}
+            FROM cube_fact
+            {where}
+            WINDOW grp AS ({f"PARTITION BY {', '.join(by)}" if len(by) > 0 else ""})
+        )
+        {group_by}
+    """
+    return query, parameters
+
+
+# Roll the cube up over some dimensions, e.g. rollup(cur, ["genre", "release_year"], ["energy"])
+# for the energy per genre per year. Reads cube_fact only: run refresh_cube first.
+# cur: a sqlite3 cursor.
+# by, features, filters: see build_rollup_query.
+# Returns a list of dicts, one per group, keyed on the column names of build_rollup_query.
+def rollup(cur, by, features=None, filters=None):
+    query, parameters = build_rollup_query(by, features, filters)
+    cur.execute(query, parameters)
+    columns = [description[0] for description in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
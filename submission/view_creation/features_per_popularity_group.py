@@ -1,10 +1,15 @@
+from data_generation.tier_aggregates import AGGREGATED_FEATURES
+
 # High level overview:
 #
 # 1) Delete v_features_per_popularity_group if exists. This ensures complete overwrite when rerun.
-# 2) Based on artist popularity, assign popularity group to each artist.
-# 3) Join artist (with popularity group) with album + track + track feature to link track features to artists.
-# 4) Group by popularity_group and compute group level features (e.g. number of artists, average energy)
-# 5) Sort by popularity_group in ascending order. Note that smaller tier number represents higher popularity.
+# 2) Read the per tier aggregates kept up to date by triggers as the base tables are written
+#    (see data_generation/tier_aggregates.py): the tier of every artist is assigned when its rows are
+#    written, and the distinct counts, sums and counts of the features are maintained per tier.
+# 3) Compute the averages from the sums and counts, leaving out the tiers without any track.
+# 4) Sort by the tier position in ascending order. Note that smaller tier number represents higher popularity.
+#
+# Reading the view costs O(number of tiers) instead of joining the four tables.
 def create_features_per_popularity_group_view(cur):
     cur.execute(
         """
@@ -12,49 +17,24 @@ def create_features_per_popularity_group_view(cur):
     """
     )
 
+    averages = ",\n".join(
+        f"ROUND(ag.sum_{feature} / ag.count_{feature}, 4) AS avg_{feature}"
+        for feature in AGGREGATED_FEATURES
+    )
     cur.execute(
-        """
+        f"""
         CREATE VIEW v_features_per_popularity_group
         AS
-            WITH artist_with_popularity_group AS (
-                SELECT 
-                    *,
-                    CASE  
-                        WHEN popularity >= 95 THEN 'tier_1'
-                        WHEN popularity >= 90 THEN 'tier_2'
-                        WHEN popularity >= 85 THEN 'tier_3'
-                        WHEN popularity >= 80 THEN 'tier_4'
-                        ELSE 'tier_5'
-                    END AS popularity_group
-                FROM artist
-            ), song_feature_with_popularity_group AS (
-                SELECT 
-                    a.popularity_group,
-                    a.artist_name,
-                    al.album_name,
-                    t.song_name,
-                    tf.energy,
-                    tf.danceability,
-                    tf.instrumentalness,
-                    tf.liveness,
-                    tf.valence
-                FROM artist_with_popularity_group AS a 
-                    INNER JOIN album AS al ON (a.artist_id = al.artist_id)
-                    INNER JOIN track AS t ON (al.album_id = t.album_id)
-                    INNER JOIN track_feature AS tf ON (t.track_id = tf.track_id)
-            )
             SELECT
-                popularity_group,
-                COUNT(DISTINCT artist_name) AS num_artists,
-                COUNT(DISTINCT album_name) AS num_albums,
-                COUNT(DISTINCT song_name) AS num_songs,
-                ROUND(AVG(energy), 4) AS avg_energy,
-                ROUND(AVG(danceability), 4) AS avg_danceability,
-                ROUND(AVG(instrumentalness), 4) AS avg_instrumentalness,
-                ROUND(AVG(liveness), 4) AS avg_liveness,
-                ROUND(AVG(valence), 4) AS avg_valence
-            FROM song_feature_with_popularity_group
-            GROUP BY popularity_group
-            ORDER BY popularity_group ASC
+                ag.tier AS popularity_group,
+                ag.num_artists,
+                ag.num_albums,
+                ag.num_songs,
+                {averages},
+                pt.label AS popularity_label
+            FROM tier_aggregate AS ag
+                INNER JOIN popularity_tier AS pt ON (ag.tier = pt.tier)
+            WHERE ag.num_rows > 0
+            ORDER BY pt.position ASC
     """
     )
@@ -0,0 +1,183 @@
+import hashlib
+from data_generation.change_tracking import (
+    get_changed_artist_ids,
+    mark_changes_consumed,
+)
+from view_creation.artist_features_over_time import (
+    build_artist_features_over_time_query,
+)
+from view_creation.top_songs_by_artist_duration import (
+    build_top_songs_by_artist_duration_query,
+)
+from view_creation.top_songs_by_artist_tempo import (
+    build_top_songs_by_artist_tempo_query,
+)
+
+# High level overview:
+#
+# 1) Each materialized view is a real table named mv_<view name without v_> holding the rows of the view, with indexes.
+# 2) The first materialization (or a change of the view's SQL) builds the table from scratch.
+# 3) On refresh, only the artists stamped by the change tracking triggers since the last refresh are recomputed:
+#    their rows are deleted and recomputed with the view's query restricted to those artists.
+# 4) Views that don't split by artist (features per popularity group) are recomputed whole on every refresh. They read
+#    the trigger maintained tier aggregates, so this costs O(number of tiers) and picks up popularity tier changes.
+# 5) The refresh is recorded under the "materialized_views" consumer, in the same transaction as the new rows.
+
+CHANGE_CONSUMER = "materialized_views"
+
+# Artists to recompute during a refresh.
+REFRESH_ARTIST_IDS = "SELECT artist_id FROM temp.refresh_artist"
+
+# view name -> how to materialize it.
+# table: the table holding the rows.
+# build_query: builds the view's SELECT, optionally restricted to an artist ID subquery.
+# None for views recomputed whole.
+# indexes: columns to index, one list per index.
+MATERIALIZED_VIEWS = {
+    "v_artist_features_over_time": {
+        "table": "mv_artist_features_over_time",
+        "build_query": build_artist_features_over_time_query,
+        "indexes": [["artist_name", "year"]],
+    },
+    "v_top_songs_by_artist_duration": {
+        "table": "mv_top_songs_by_artist_duration",
+        "build_query": build_top_songs_by_artist_duration_query,
+        "indexes": [["artist_name"]],
+    },
+    "v_top_songs_by_artist_tempo": {
+        "table": "mv_top_songs_by_artist_tempo",
+        "build_query": build_top_songs_by_artist_tempo_query,
+        "indexes": [["artist_name"]],
+    },
+    "v_features_per_popularity_group": {
+        "table": "mv_features_per_popularity_group",
+        "build_query": None,
+        "indexes": [["popularity_group"]],
+    },
+}
+
+# ----- Helper Functions -----
+
+# Fingerprint of the SQL currently behind a view. A different fingerprint means the stored rows are stale.
+def get_view_fingerprint(cur, view_name):
+    row = cur.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'view' AND name = ?", (view_name,)
+    ).fetchone()
+    return hashlib.sha256(row[0].encode()).hexdigest()
+
+
+def table_exists(cur, table_name):
+    row = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+    ).fetchone()
+    return row is not None
+
+
+# Rebuild a materialized view from scratch.
+def build_materialized_view(cur, view_name, spec):
+    table_name = spec["table"]
+
+    cur.execute(f"DROP TABLE IF EXISTS {table_name}")
+    cur.execute(f"CREATE TABLE {table_name} AS SELECT * FROM {view_name}")
+    for columns in spec["indexes"]:
+        cur.execute(
+            f"""
+            CREATE INDEX ix_{table_name}_{"_".join(columns)}
+            ON {table_name} ({", ".join(columns)})
+        """
+        )
+
+    cur.execute(
+        """
+        INSERT INTO mv_state (view_name, fingerprint) VALUES (?, ?)
+        ON CONFLICT (view_name) DO UPDATE SET fingerprint = excluded.fingerprint
+    """,
+        (view_name, get_view_fingerprint(cur, view_name)),
+    )
+
+
+# Recompute the rows of the artists listed in temp.refresh_artist.
+def refresh_artists_in_materialized_view(cur, view_name, spec):
+    table_name = spec["table"]
+
+    if spec["build_query"] is None:
+        cur.execute(f"DELETE FROM {table_name}")
+        cur.execute(f"INSERT INTO {table_name} SELECT * FROM {view_name}")
+        return
+
+    # The views are keyed by artist name. Rows of renamed or deleted artists go too.
+    cur.execute(
+        f"""
+        DELETE FROM {table_name}
+        WHERE artist_name IN (
+                SELECT artist_name FROM artist WHERE artist_id IN ({REFRESH_ARTIST_IDS})
+            )
+            OR artist_name NOT IN (SELECT artist_name FROM artist)
+    """
+    )
+    cur.execute(
+        f"""
+        INSERT INTO {table_name}
+        {spec["build_query"](REFRESH_ARTIST_IDS)}
+    """
+    )
+
+
+# ----- Helper Functions End -----
+
+
+# Materialize the analytic views into indexed tables, or bring them up to date.
+# Only the artists changed since the previous call are recomputed. A table is rebuilt from
+# scratch when it doesn't exist yet, when its view's SQL changed or when full is True.
+# Must run after the views have been created.
+# cur: a sqlite3 cursor.
+# full: rebuild every materialized view from scratch.
+# Returns the number of artists recomputed, or None after a full rebuild.
+def refresh_materialized_views(cur, full=False):
+    db_conn = cur.connection
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS mv_state (
+            view_name TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL
+        )
+    """
+    )
+    fingerprints = dict(cur.execute("SELECT view_name, fingerprint FROM mv_state"))
+
+    changed_artist_ids = get_changed_artist_ids(db_conn, CHANGE_CONSUMER)
+    rebuild_all = full or changed_artist_ids is None
+
+    with db_conn:
+        # Artists sharing a name with a changed artist are merged into the same view rows,
+        # so they are recomputed together.
+        cur.execute("DROP TABLE IF EXISTS temp.refresh_artist")
+        cur.execute("CREATE TEMP TABLE refresh_artist (artist_id TEXT PRIMARY KEY)")
+        cur.executemany(
+            "INSERT OR IGNORE INTO temp.refresh_artist VALUES (?)",
+            [(artist_id,) for artist_id in changed_artist_ids or []],
+        )
+        cur.execute(
+            """
+            INSERT OR IGNORE INTO temp.refresh_artist
+            SELECT artist_id FROM artist
+            WHERE artist_name IN (
+                SELECT artist_name FROM artist
+                WHERE artist_id IN (SELECT artist_id FROM temp.refresh_artist)
+            )
+        """
+        )
+
+        for view_name, spec in MATERIALIZED_VIEWS.items():
+            if (
+                rebuild_all
+                or not table_exists(cur, spec["table"])
+                or fingerprints.get(view_name) != get_view_fingerprint(cur, view_name)
+            ):
+                build_materialized_view(cur, view_name, spec)
+            elif len(changed_artist_ids) > 0 or spec["build_query"] is None:
+                refresh_artists_in_materialized_view(cur, view_name, spec)
+
+        mark_changes_consumed(db_conn, CHANGE_CONSUMER)
+
+    return None if rebuild_all else len(changed_artist_ids)
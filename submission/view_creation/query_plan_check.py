@@ -0,0 +1,60 @@
+# High level overview:
+#
+# 1) Run EXPLAIN QUERY PLAN on SELECT * from each v_* view.
+# 2) Group the plan steps by their parent step. Steps sharing a parent are the loops of one join, outermost first.
+# 3) The outermost loop of a join may scan its table, every inner loop must SEARCH it through an index.
+#    An inner SCAN means the join reads the whole table once per outer row.
+# 4) An AUTOMATIC index means SQLite had to build a throwaway index because a declared one is missing.
+#
+# See https://www.sqlite.org/eqp.html for the format of the plan.
+
+VIEW_NAMES = [
+    "v_top_artists_by_followers",
+    "v_top_songs_by_artist_duration",
+    "v_top_songs_by_artist_tempo",
+    "v_features_per_popularity_group",
+    "v_artist_features_over_time",
+]
+
+
+# Find the plan steps of a view that fall back to a full scan inside a join.
+# cur: a sqlite3 cursor.
+# view_name: the view to check.
+# Returns the offending plan details, empty if the view only joins through indexes.
+def find_full_scan_joins(cur, view_name):
+    plan = cur.execute(f"EXPLAIN QUERY PLAN SELECT * FROM {view_name}").fetchall()
+
+    offending_steps = []
+    loops_seen_per_parent = {}
+    for _, parent, _, detail in plan:
+        if "AUTOMATIC" in detail:
+            offending_steps.append(detail)
+            continue
+
+        if not (detail.startswith("SCAN ") or detail.startswith("SEARCH ")):
+            continue
+
+        loops_seen = loops_seen_per_parent.get(parent, 0)
+        if loops_seen > 0 and detail.startswith("SCAN "):
+            offending_steps.append(detail)
+        loops_seen_per_parent[parent] = loops_seen + 1
+
+    return offending_steps
+
+
+# Check the query plans of all views and raise an error listing every join that falls back to a full scan.
+# cur: a sqlite3 cursor.
+# view_names: the views to check. Defaults to all v_* views.
+def check_view_query_plans(cur, view_names=None):
+    failures = {}
+    for view_name in VIEW_NAMES if view_names is None else view_names:
+        offending_steps = find_full_scan_joins(cur, view_name)
+        if len(offending_steps) > 0:
+            failures[view_name] = offending_steps
+
+    if len(failures) > 0:
+        details = "\n".join(
+            f"  {view_name}: {'; '.join(steps)}"
+            for view_name, steps in failures.items()
+        )
+        raise RuntimeError(f"Views joining through full scans:\n{details}")
@@ -0,0 +1,257 @@
+import hashlib
+from data_generation.schema import TABLE_DTYPES
+from data_generation.change_tracking import (
+    get_changed_artist_ids,
+    mark_changes_consumed,
+)
+
+# High level overview:
+#
+# 1) Any numeric column of track or track_feature is a metric tracks can be ranked by, per artist.
+# 2) A ranked metric has a table rank_<metric> holding the top tracks of every artist by that metric, keyed on
+#    (artist_id, rank). "Top k by energy for artist Y" is a primary key range read of k rows, not a window over
+#    every track.
+# 3) The first ranking of a metric (or a change of its query or depth) builds its table from scratch.
+# 4) On refresh, only the artists stamped by the change tracking triggers since the metric's last refresh are
+#    ranked again: their rows are deleted and recomputed with the ranking query restricted to those artists.
+# 5) Each metric is its own change tracking consumer ("rankings:<metric>"), so a metric added later or left out
+#    of a refresh catches up on every change it missed.
+#
+# The ranking orders by the metric descending, then by track_id, so ties always rank the same way.
+
+# Number of top tracks kept per artist and metric by default.
+DEFAULT_RANK_DEPTH = 50
+
+# Metrics ranked when none was ranked before and none is asked for: the ones of the top songs views.
+DEFAULT_METRICS = ["duration_ms", "tempo"]
+
+# metric -> the table holding it. Only numeric columns can be ranked.
+RANKABLE_METRICS = {
+    column: table_name
+    for table_name in ["track", "track_feature"]
+    for column, sqlite_type in TABLE_DTYPES[table_name].items()
+    if sqlite_type in ("INTEGER", "REAL")
+}
+
+# Artists to rank again during a refresh.
+REFRESH_ARTIST_IDS = "SELECT artist_id FROM temp.rank_refresh_artist"
+
+# ----- Helper Functions -----
+
+
+def get_rank_table(metric):
+    if metric not in RANKABLE_METRICS:
+        raise ValueError(
+            f"Can't rank by {metric!r}, choose from {', '.join(RANKABLE_METRICS)}"
+        )
+    return f"rank_{metric}"
+
+
+def get_change_consumer(metric):
+    return f"rankings:{metric}"
+
+
+# Fingerprint of a metric's ranking query. A different fingerprint means the stored ranks are stale.
+def get_ranking_fingerprint(metric, depth):
+    return hashlib.sha256(build_ranking_query(metric, depth).encode()).hexdigest()
+
+
+def table_exists(cur, table_name):
+    row = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+    ).fetchone()
+    return row is not None
+
+
+# Rebuild the rank table of a metric from scratch.
+def build_rank_table(cur, metric, depth):
+    table_name = get_rank_table(metric)
+
+    cur.execute(f"DROP TABLE IF EXISTS {table_name}")
+    cur.execute(
+        f"""
+        CREATE TABLE {table_name} (
+            artist_id TEXT NOT NULL,
+            rank INTEGER NOT NULL,
+            track_id TEXT NOT NULL,
+            song_name TEXT,
+            {metric} {TABLE_DTYPES[RANKABLE_METRICS[metric]][metric]},
+            PRIMARY KEY (artist_id, rank)
+        ) WITHOUT ROWID
+    """
+    )
+    cur.execute(f"INSERT INTO {table_name} {build_ranking_query(metric, depth)}")
+
+    cur.execute(
+        """
+        INSERT INTO rank_state (metric, depth, fingerprint) VALUES (?, ?, ?)
+        ON CONFLICT (metric) DO UPDATE
+        SET depth = excluded.depth, fingerprint = excluded.fingerprint
+    """,
+        (metric, depth, get_ranking_fingerprint(metric, depth)),
+    )
+
+
+# Rank again the artists listed in temp.rank_refresh_artist. Rows of deleted artists go too,
+# since the delete triggers stamp them.
+def refresh_artists_in_rank_table(cur, metric, depth):
+    table_name = get_rank_table(metric)
+
+    cur.execute(f"DELETE FROM {table_name} WHERE artist_id IN ({REFRESH_ARTIST_IDS})")
+    cur.execute(
+        f"""
+        INSERT INTO {table_name}
+        {build_ranking_query(metric, depth, REFRESH_ARTIST_IDS)}
+    """
+    )
+
+
+# ----- Helper Functions End -----
+
+
+# Build the SELECT ranking the tracks of every artist by a metric, highest first.
+# Returns the columns artist_id, rank, track_id, song_name and the metric, for ranks 1 to depth.
+# metric: a key of RANKABLE_METRICS.
+# depth: number of top tracks kept per artist.
+# artist_id_filter: optional subquery returning artist IDs. Only those artists are ranked, and they are
+# filtered before the joins.
+def build_ranking_query(metric, depth, artist_id_filter=None):
+    get_rank_table(metric)
+    feature_join = (
+        "INNER JOIN track_feature AS tf ON (t.track_id = tf.track_id)"
+        if RANKABLE_METRICS[metric] == "track_feature"
+        else ""
+    )
+    metric_column = f"{'tf' if feature_join else 't'}.{metric}"
+    artist_filter = (
+        f"AND al.artist_id IN ({artist_id_filter})"
+        if artist_id_filter is not None
+        else ""
+    )
+
+    return f"""
+            WITH artist_songs_ranked AS (
+                SELECT
+                    al.artist_id,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY al.artist_id ORDER BY {metric_column} DESC, t.track_id
+                    ) AS rank,
+                    t.track_id,
+                    t.song_name,
+                    {metric_column} AS {metric}
+                FROM album AS al
+                    INNER JOIN track AS t ON (al.album_id = t.album_id)
+                    {feature_join}
+                WHERE {metric_column} IS NOT NULL
+                {artist_filter}
+            )
+            SELECT artist_id, rank, track_id, song_name, {metric}
+            FROM artist_songs_ranked
+            WHERE rank <= {int(depth)}
+    """
+
+
+# Build the SELECT of the top songs of every artist by a metric, as the top songs views show them:
+# artist_name, song_name and the metric, by artist name then metric descending.
+# artist_id_filter: see build_ranking_query.
+# depth: number of top songs per artist.
+def build_top_songs_by_artist_query(metric, artist_id_filter=None, depth=10):
+    return f"""
+            WITH artist_songs_top AS (
+                {build_ranking_query(metric, depth, artist_id_filter)}
+            )
+            SELECT
+                a.artist_name,
+                s.song_name,
+                s.{metric}
+            FROM artist_songs_top AS s INNER JOIN artist AS a ON (s.artist_id = a.artist_id)
+            ORDER BY artist_name ASC, {metric} DESC
+    """
+
+
+# Build or bring up to date the rank tables of the given metrics and of every metric ranked before.
+# Only the artists changed since a metric's previous refresh are ranked again. A rank table is rebuilt from
+# scratch when it doesn't exist yet, when its query or depth changed or when full is True.
+# cur: a sqlite3 cursor.
+# metric_names: metrics to start ranking, keys of RANKABLE_METRICS. Defaults to DEFAULT_METRICS when no metric
+# was ranked before.
+# depth: number of top tracks kept per artist.
+# full: rebuild every rank table from scratch.
+# Returns metric -> number of artists ranked again, or None after a rebuild.
+def refresh_rankings(cur, metric_names=None, depth=DEFAULT_RANK_DEPTH, full=False):
+    db_conn = cur.connection
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS rank_state (
+            metric TEXT PRIMARY KEY,
+            depth INTEGER NOT NULL,
+            fingerprint TEXT NOT NULL
+        )
+    """
+    )
+    fingerprints = dict(cur.execute("SELECT metric, fingerprint FROM rank_state"))
+
+    metrics_to_refresh = list(fingerprints)
+    for metric in metric_names or ([] if fingerprints else DEFAULT_METRICS):
+        get_rank_table(metric)
+        if metric not in metrics_to_refresh:
+            metrics_to_refresh.append(metric)
+
+    results = {}
+    for metric in metrics_to_refresh:
+        changed_artist_ids = get_changed_artist_ids(
+            db_conn, get_change_consumer(metric)
+        )
+
+        with db_conn:
+            if (
+                full
+                or changed_artist_ids is None
+                or not table_exists(cur, get_rank_table(metric))
+                or fingerprints.get(metric) != get_ranking_fingerprint(metric, depth)
+            ):
+                build_rank_table(cur, metric, depth)
+                results[metric] = None
+            else:
+                if len(changed_artist_ids) > 0:
+                    cur.execute("DROP TABLE IF EXISTS temp.rank_refresh_artist")
+                    cur.execute(
+                        "CREATE TEMP TABLE rank_refresh_artist (artist_id TEXT PRIMARY KEY)"
+                    )
+                    cur.executemany(
+                        "INSERT INTO temp.rank_refresh_artist VALUES (?)",
+                        [(artist_id,) for artist_id in changed_artist_ids],
+                    )
+                    refresh_artists_in_rank_table(cur, metric, depth)
+                results[metric] = len(changed_artist_ids)
+
+            mark_changes_consumed(db_conn, get_change_consumer(metric))
+
+    return results
+
+
+# Get the top tracks of an artist by a ranked metric, read from its rank table.
+# cur: a sqlite3 cursor.
+# metric: a metric ranked by refresh_rankings.
+# artist_name: name of the artist. Artists sharing the name are ranked separately, one after the other.
+# k: number of top tracks. At most the depth the metric was ranked with.
+# Returns a list of (rank, song_name, metric value), best first.
+def get_top_tracks(cur, metric, artist_name, k=10):
+    table_name = get_rank_table(metric)
+    row = cur.execute(
+        "SELECT depth FROM rank_state WHERE metric = ?", (metric,)
+    ).fetchone()
+    if row is None:
+        raise ValueError(f"{metric!r} is not ranked, run refresh_rankings first")
+    if k > row[0]:
+        raise ValueError(f"{metric!r} is ranked to depth {row[0]}, can't get {k}")
+
+    return cur.execute(
+        f"""
+        SELECT r.rank, r.song_name, r.{metric}
+        FROM artist AS a INNER JOIN {table_name} AS r ON (r.artist_id = a.artist_id)
+        WHERE a.artist_name = ? AND r.rank <= ?
+        ORDER BY a.artist_id, r.rank
+    """,
+        (artist_name, k),
+    ).fetchall()
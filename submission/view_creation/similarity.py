@@ -0,0 +1,274 @@
+import json
+import os
+import numpy as np
+from data_generation.schema import TRACK_FEATURE_DTYPE
+from data_generation.change_tracking import (
+    get_changed_artist_ids,
+    mark_changes_consumed,
+)
+
+# High level overview:
+#
+# 1) Every track with audio features is a point in the space of its numeric features (danceability, energy, ...,
+#    tempo, valence). Each feature is normalized to mean 0 and standard deviation 1 over the catalog, so tempo and
+#    loudness don't outweigh the features between 0 and 1. A missing value is the catalog mean (0).
+# 2) The normalized vectors are stored in an index folder as one contiguous float32 matrix (features.npy), with the
+#    track IDs (track_ids.npy) sorted so a track's row is found by binary search, and the squared norm of every row
+#    (sq_norms.npy). SimilarityIndex memory-maps the three files: opening the index reads nothing, and the OS pages
+#    in what the queries touch.
+# 3) The k tracks most similar to a track are its k nearest neighbors by Euclidean distance. Queries are answered in
+#    batches, block of rows by block of rows: the distances of a block to every query are one matrix product
+#    (|x - q|^2 = |x|^2 - 2 x.q + |q|^2), and only the k best of each block are kept.
+# 4) The index is rebuilt by streaming track_feature in track_id order into the memory-mapped files, so memory stays
+#    flat whatever the catalog size. It is rebuilt when the change tracking triggers stamped an artist since the last
+#    build (the "similarity_index" consumer), as the normalization depends on the whole catalog.
+
+CHANGE_CONSUMER = "similarity_index"
+
+# The features the tracks are compared on.
+SIMILARITY_FEATURES = [
+    column
+    for column, sqlite_type in TRACK_FEATURE_DTYPE.items()
+    if sqlite_type == "REAL"
+]
+
+# Default folder of the index files.
+DEFAULT_INDEX_DIR = "similarity_index"
+
+# Rows read from the DB per write into the index files.
+BUILD_CHUNK_ROWS = 100000
+
+# Upper bound of the distances computed at once (queries x rows of a block), about 64 MB of float32.
+MAX_DISTANCES_PER_BLOCK = 16 * 1024 * 1024
+
+# ----- Helper Functions -----
+
+# Per feature mean and standard deviation over the catalog, computed in SQL in one pass.
+# A feature without spread (or without values) gets a standard deviation of 1.
+def get_feature_stats(db_conn):
+    aggregates = [
+        f"AVG({feature}), AVG({feature} * {feature})" for feature in SIMILARITY_FEATURES
+    ]
+    row = db_conn.execute(
+        f"SELECT {', '.join(aggregates)} FROM track_feature"
+    ).fetchone()
+
+    means = []
+    stds = []
+    for mean, mean_of_squares in zip(row[0::2], row[1::2]):
+        mean = 0.0 if mean is None else mean
+        variance = 0.0 if mean_of_squares is None else mean_of_squares - mean * mean
+        means.append(mean)
+        stds.append(float(np.sqrt(variance)) if variance > 1e-12 else 1.0)
+    return np.array(means), np.array(stds)
+
+
+# Write the index files of the current track_feature rows into index_dir.
+# Each file is written under a temporary name and renamed once complete, the metadata last, so
+# a reader never sees a half written index.
+def write_index_files(db_conn, index_dir):
+    os.makedirs(index_dir, exist_ok=True)
+    num_rows, id_length = db_conn.execute(
+        "SELECT COUNT(*), COALESCE(MAX(LENGTH(track_id)), 1) FROM track_feature"
+    ).fetchone()
+    means, stds = get_feature_stats(db_conn)
+
+    paths = {
+        name: os.path.join(index_dir, f"{name}.npy")
+        for name in ["features", "track_ids", "sq_norms"]
+    }
+    files = {
+        "features": np.lib.format.open_memmap(
+            paths["features"] + ".tmp",
+            mode="w+",
+            dtype=np.float32,
+            shape=(num_rows, len(SIMILARITY_FEATURES)),
+        ),
+        "track_ids": np.lib.format.open_memmap(
+            paths["track_ids"] + ".tmp",
+            mode="w+",
+            dtype=f"S{id_length}",
+            shape=(num_rows,),
+        ),
+        "sq_norms": np.lib.format.open_memmap(
+            paths["sq_norms"] + ".tmp", mode="w+", dtype=np.float32, shape=(num_rows,)
+        ),
+    }
+
+    # The primary key index returns the rows in track_id order, which the binary search relies on.
+    cur = db_conn.execute(
+        f"""
+        SELECT track_id, {", ".join(SIMILARITY_FEATURES)}
+        FROM track_feature
+        ORDER BY track_id
+    """
+    )
+    start = 0
+    while True:
+        rows = cur.fetchmany(BUILD_CHUNK_ROWS)
+        if len(rows) == 0:
+            break
+        end = start + len(rows)
+        values = np.array([row[1:] for row in rows], dtype=np.float64)
+        normalized = np.nan_to_num((values - means) / stds).astype(np.float32)
+        files["features"][start:end] = normalized
+        files["track_ids"][start:end] = [row[0].encode() for row in rows]
+        files["sq_norms"][start:end] = np.einsum("ij,ij->i", normalized, normalized)
+        start = end
+
+    for name, array in files.items():
+        array.flush()
+        os.replace(paths[name] + ".tmp", paths[name])
+
+    metadata = {
+        "features": SIMILARITY_FEATURES,
+        "means": means.tolist(),
+        "stds": stds.tolist(),
+        "num_tracks": num_rows,
+        "database": db_conn.execute("PRAGMA database_list").fetchone()[2],
+    }
+    with open(os.path.join(index_dir, "metadata.json.tmp"), "w") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(
+        os.path.join(index_dir, "metadata.json.tmp"),
+        os.path.join(index_dir, "metadata.json"),
+    )
+
+
+def read_metadata(index_dir):
+    path = os.path.join(index_dir, "metadata.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+# Merge candidate neighbors into the best k of each query.
+# distances, rows: (queries, candidates) arrays. Returns the k best (distances, rows) per query, unsorted.
+def keep_nearest(distances, rows, k):
+    if distances.shape[1] <= k:
+        return distances, rows
+    best = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    return (
+        np.take_along_axis(distances, best, axis=1),
+        np.take_along_axis(rows, best, axis=1),
+    )
+
+
+# ----- Helper Functions End -----
+
+
+class SimilarityIndex:
+    # Open the index files of a folder written by refresh_similarity_index, memory-mapped.
+    # index_dir: the index folder.
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR):
+        self.metadata = read_metadata(index_dir)
+        if self.metadata is None:
+            raise FileNotFoundError(
+                f"No similarity index in {index_dir!r}, run refresh_similarity_index first"
+            )
+        self.features = np.load(os.path.join(index_dir, "features.npy"), mmap_mode="r")
+        self.track_ids = np.load(
+            os.path.join(index_dir, "track_ids.npy"), mmap_mode="r"
+        )
+        self.sq_norms = np.load(os.path.join(index_dir, "sq_norms.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    # Row of each track in the index, found by binary search on the sorted track IDs.
+    # Raises KeyError for a track without features in the index.
+    def get_rows(self, track_ids):
+        keys = np.array([track_id.encode() for track_id in track_ids])
+        rows = np.searchsorted(self.track_ids, keys)
+        for track_id, row in zip(track_ids, rows):
+            if row >= len(self) or self.track_ids[row] != track_id.encode():
+                raise KeyError(f"Track {track_id!r} is not in the similarity index")
+        return rows
+
+    # Find the k tracks most similar to each of the given tracks, in one pass over the index.
+    # track_ids: IDs of the tracks to find neighbors for.
+    # k: number of neighbors per track. The track itself is left out.
+    # Returns one list per track of (track_id, distance) pairs, nearest first. The distance is
+    # Euclidean, in standard deviations of the features.
+    def find_similar_batch(self, track_ids, k=10):
+        if k < 1:
+            raise ValueError(f"k must be at least 1, got {k}")
+        query_rows = self.get_rows(track_ids)
+        queries = np.asarray(self.features[query_rows], dtype=np.float32)
+        query_sq_norms = np.asarray(self.sq_norms[query_rows], dtype=np.float32)
+        num_queries = len(query_rows)
+        rows_per_block = max(1024, MAX_DISTANCES_PER_BLOCK // max(num_queries, 1))
+
+        best_distances = np.empty((num_queries, 0), dtype=np.float32)
+        best_rows = np.empty((num_queries, 0), dtype=np.int64)
+        for start in range(0, len(self), rows_per_block):
+            end = min(start + rows_per_block, len(self))
+            block = np.asarray(self.features[start:end])
+            distances = (
+                self.sq_norms[start:end][np.newaxis, :]
+                - 2 * (queries @ block.T)
+                + query_sq_norms[:, np.newaxis]
+            )
+            # A track is not similar to itself.
+            for query, row in enumerate(query_rows):
+                if start <= row < end:
+                    distances[query, row - start] = np.inf
+            block_distances, block_rows = keep_nearest(
+                distances,
+                np.broadcast_to(np.arange(start, end), distances.shape),
+                k,
+            )
+
+            best_distances, best_rows = keep_nearest(
+                np.concatenate([best_distances, block_distances], axis=1),
+                np.concatenate([best_rows, block_rows], axis=1),
+                k,
+            )
+
+        results = []
+        for distances, rows in zip(best_distances, best_rows):
+            order = np.argsort(distances, kind="stable")
+            results.append(
+                [
+                    (
+                        self.track_ids[rows[i]].decode(),
+                        float(np.sqrt(max(distances[i], 0.0))),
+                    )
+                    for i in order
+                    if np.isfinite(distances[i])
+                ]
+            )
+        return results
+
+    # Find the k tracks most similar to a track.
+    # Returns a list of (track_id, distance) pairs, nearest first. See find_similar_batch.
+    def find_similar(self, track_id, k=10):
+        return self.find_similar_batch([track_id], k)[0]
+
+
+# Build the similarity index of the DB's tracks, or rebuild it if any artist changed since its
+# last build.
+# db_conn: a database connection.
+# index_dir: the index folder.
+# full: rebuild even if nothing changed.
+# Returns whether the index was rebuilt.
+def refresh_similarity_index(db_conn, index_dir=DEFAULT_INDEX_DIR, full=False):
+    changed_artist_ids = get_changed_artist_ids(db_conn, CHANGE_CONSUMER)
+    metadata = read_metadata(index_dir)
+    database = db_conn.execute("PRAGMA database_list").fetchone()[2]
+
+    if (
+        not full
+        and changed_artist_ids is not None
+        and len(changed_artist_ids) == 0
+        and metadata is not None
+        and metadata["features"] == SIMILARITY_FEATURES
+        and metadata["database"] == database
+    ):
+        return False
+
+    write_index_files(db_conn, index_dir)
+    with db_conn:
+        mark_changes_consumed(db_conn, CHANGE_CONSUMER)
+    return True
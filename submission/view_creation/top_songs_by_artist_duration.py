@@ -1,3 +1,12 @@
+from view_creation.rankings import build_top_songs_by_artist_query
+
+# Build the SELECT behind v_top_songs_by_artist_duration.
+# artist_id_filter: optional subquery returning artist IDs. Only those artists are computed, and they
+# are filtered before the joins, which keeps incremental refreshes of the materialized view cheap.
+def build_top_songs_by_artist_duration_query(artist_id_filter=None):
+    return build_top_songs_by_artist_query("duration_ms", artist_id_filter)
+
+
 # High level overview:
 #
 # 1) Delete v_top_songs_by_artist_duration if exists. This ensures complete overwrite when rerun.
@@ -16,33 +25,9 @@ def create_top_songs_by_artist_duration_view(cur):
     )
 
     cur.execute(
-        """
+        f"""
         CREATE VIEW v_top_songs_by_artist_duration
         AS
-            WITH artist_songs AS (
-                SELECT 
-                    al.artist_id,
-                    t.song_name,
-                    t.duration_ms
-                FROM track AS t INNER JOIN album AS al ON (t.album_id = al.album_id)
-            ), artist_songs_ranked AS (
-                SELECT
-                    *,
-                    ROW_NUMBER() OVER (PARTITION BY artist_id ORDER BY duration_ms DESC) AS rn
-                FROM artist_songs
-            ), artist_songs_top AS (
-                SELECT
-                    artist_id,
-                    song_name,
-                    duration_ms
-                FROM artist_songs_ranked
-                WHERE rn <= 10
-            )
-            SELECT 
-                a.artist_name,
-                s.song_name,
-                s.duration_ms
-            FROM artist_songs_top AS s INNER JOIN artist AS a ON (s.artist_id = a.artist_id)
-            ORDER BY artist_name ASC, duration_ms DESC
+        {build_top_songs_by_artist_duration_query()}
     """
     )
@@ -1,3 +1,12 @@
+from view_creation.rankings import build_top_songs_by_artist_query
+
+# Build the SELECT behind v_top_songs_by_artist_tempo.
+# artist_id_filter: optional subquery returning artist IDs. Only those artists are computed, and they
+# are filtered before the joins, which keeps incremental refreshes of the materialized view cheap.
+def build_top_songs_by_artist_tempo_query(artist_id_filter=None):
+    return build_top_songs_by_artist_query("tempo", artist_id_filter)
+
+
 # High level overview:
 #
 # 1) Delete v_top_songs_by_artist_tempo if exists. This ensures complete overwrite when rerun.
@@ -16,35 +25,9 @@ def create_top_songs_by_artist_tempo_view(cur):
     )
 
     cur.execute(
-        """
+        f"""
         CREATE VIEW v_top_songs_by_artist_tempo
         AS
-            WITH artist_song_with_tempo AS (
-                SELECT 
-                    al.artist_id,
-                    t.song_name,
-                    tf.tempo
-                FROM album AS al
-                    INNER JOIN track AS t ON (al.album_id = t.album_id)
-                    INNER JOIN track_feature AS tf ON (t.track_id = tf.track_id)
-            ), artist_songs_ranked AS (
-                SELECT
-                    *,
-                    ROW_NUMBER() OVER (PARTITION BY artist_id ORDER BY tempo DESC) AS rn
-                FROM artist_song_with_tempo
-            ), artist_songs_top AS (
-                SELECT
-                    artist_id,
-                    song_name,
-                    tempo
-                FROM artist_songs_ranked
-                WHERE rn <= 10
-            )
-            SELECT 
-                a.artist_name,
-                s.song_name,
-                s.tempo
-            FROM artist_songs_top AS s INNER JOIN artist AS a ON (s.artist_id = a.artist_id)
-            ORDER BY artist_name ASC, tempo DESC
+        {build_top_songs_by_artist_tempo_query()}
     """
     )